@@ -1,3 +1,4 @@
+import json
 import os
 from dotenv import load_dotenv
 
@@ -7,4 +8,133 @@ TG_BOT_TOKEN = os.getenv('TG_BOT_TOKEN')
 CHATGPT_TOKEN = os.getenv('CHATGPT_TOKEN')
 
 if not all([TG_BOT_TOKEN, CHATGPT_TOKEN]):
-    raise ValueError("Введите токены в .env")
\ No newline at end of file
+    raise ValueError("Введите токены в .env")
+
+# Кэш ответов ChatGPT
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', '10000'))
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv('RESPONSE_CACHE_MAX_BYTES', str(32 * 1024 * 1024)))
+# Путь к SQLite-файлу второго уровня кэша (пусто - только память)
+RESPONSE_CACHE_DB = os.getenv('RESPONSE_CACHE_DB', '')
+
+# Фоновая предгенерация фактов и вопросов викторины
+PREFETCH_STATE_PATH = os.getenv('PREFETCH_STATE_PATH', 'data/cache/prefetch.json')
+PREFETCH_MAX_CONCURRENCY = int(os.getenv('PREFETCH_MAX_CONCURRENCY', '2'))
+PREFETCH_FACTS_LOW = int(os.getenv('PREFETCH_FACTS_LOW', '5'))
+PREFETCH_FACTS_HIGH = int(os.getenv('PREFETCH_FACTS_HIGH', '30'))
+PREFETCH_QUIZ_LOW = int(os.getenv('PREFETCH_QUIZ_LOW', '3'))
+PREFETCH_QUIZ_HIGH = int(os.getenv('PREFETCH_QUIZ_HIGH', '15'))
+
+# Банк вопросов викторины, собранный scripts/build_quiz_bank.py (пусто - только генерация на лету)
+QUIZ_BANK_PATH = os.getenv('QUIZ_BANK_PATH', 'data/quiz_bank.sqlite3')
+
+# Проверка ответов викторины текстом: минимальное сходство с вариантом
+# и отрыв лучшего варианта от второго (0..1)
+QUIZ_MATCH_THRESHOLD = float(os.getenv('QUIZ_MATCH_THRESHOLD', '0.8'))
+QUIZ_MATCH_MARGIN = float(os.getenv('QUIZ_MATCH_MARGIN', '0.1'))
+
+# Викторина в групповых чатах: вопросов в игре, время на ответ и пауза между вопросами (секунды)
+GROUP_QUIZ_QUESTIONS = int(os.getenv('GROUP_QUIZ_QUESTIONS', '10'))
+GROUP_QUIZ_ANSWER_SECONDS = float(os.getenv('GROUP_QUIZ_ANSWER_SECONDS', '20'))
+GROUP_QUIZ_PAUSE_SECONDS = float(os.getenv('GROUP_QUIZ_PAUSE_SECONDS', '5'))
+# Таблицы очков групповых викторин
+LEADERBOARD_PATH = os.getenv('LEADERBOARD_PATH', 'data/cache/leaderboards.sqlite3')
+
+# Память переводов /translate: переводы предложений по языкам, лимит записей
+# и минимальное сходство, с которым перевод похожего предложения передается модели образцом
+# (1 - без образцов; пустой путь - без сохранения между перезапусками)
+TRANSLATION_MEMORY_PATH = os.getenv('TRANSLATION_MEMORY_PATH', 'data/cache/translation_memory.sqlite3')
+TRANSLATION_MEMORY_MAX_SEGMENTS = int(os.getenv('TRANSLATION_MEMORY_MAX_SEGMENTS', '20000'))
+TRANSLATION_MEMORY_FUZZY_THRESHOLD = float(os.getenv('TRANSLATION_MEMORY_FUZZY_THRESHOLD', '0.9'))
+
+# Ограничения запросов к OpenAI (запросов и токенов в минуту)
+OPENAI_DEFAULT_RPM = int(os.getenv('OPENAI_DEFAULT_RPM', '3500'))
+OPENAI_DEFAULT_TPM = int(os.getenv('OPENAI_DEFAULT_TPM', '90000'))
+# Лимиты по моделям в JSON: {"gpt-4o": [500, 30000]}
+OPENAI_MODEL_LIMITS = json.loads(os.getenv('OPENAI_MODEL_LIMITS', '{}'))
+OPENAI_QUEUE_TIMEOUT = float(os.getenv('OPENAI_QUEUE_TIMEOUT', '30'))
+OPENAI_MAX_CONCURRENCY = int(os.getenv('OPENAI_MAX_CONCURRENCY', '64'))
+OPENAI_TARGET_LATENCY = float(os.getenv('OPENAI_TARGET_LATENCY', '15'))
+
+# Справедливое распределение запросов к LLM между пользователями
+SCHEDULER_CONCURRENCY = int(os.getenv('SCHEDULER_CONCURRENCY', '16'))
+SCHEDULER_MAX_QUEUE_PER_USER = int(os.getenv('SCHEDULER_MAX_QUEUE_PER_USER', '5'))
+# drop_oldest - вытеснять самый старый запрос, reject_new - отклонять новый
+SCHEDULER_OVERFLOW_POLICY = os.getenv('SCHEDULER_OVERFLOW_POLICY', 'drop_oldest')
+
+# Пул бэкендов OpenAI (несколько ключей или OpenAI-совместимые серверы) в JSON:
+# [{"name": "main", "api_key": "...", "base_url": null, "weight": 1, "max_connections": 100}]
+# Если не задан, используется один бэкенд с CHATGPT_TOKEN
+OPENAI_BACKENDS = json.loads(os.getenv('OPENAI_BACKENDS', '[]'))
+
+# Предохранитель запросов к OpenAI
+BREAKER_WINDOW = float(os.getenv('BREAKER_WINDOW', '60'))
+BREAKER_MIN_CALLS = int(os.getenv('BREAKER_MIN_CALLS', '10'))
+BREAKER_ERROR_RATE = float(os.getenv('BREAKER_ERROR_RATE', '0.5'))
+BREAKER_SLOW_CALL_SECONDS = float(os.getenv('BREAKER_SLOW_CALL_SECONDS', '20'))
+BREAKER_SLOW_CALL_RATE = float(os.getenv('BREAKER_SLOW_CALL_RATE', '0.8'))
+BREAKER_OPEN_SECONDS = float(os.getenv('BREAKER_OPEN_SECONDS', '30'))
+BREAKER_HALF_OPEN_CALLS = int(os.getenv('BREAKER_HALF_OPEN_CALLS', '3'))
+
+# Память диалогов /gpt и /talk
+MEMORY_MAX_TURNS = int(os.getenv('MEMORY_MAX_TURNS', '40'))
+MEMORY_TOKEN_BUDGET = int(os.getenv('MEMORY_TOKEN_BUDGET', '2000'))
+
+# Кэш file_id загруженных в Telegram изображений
+TELEGRAM_FILE_ID_CACHE_PATH = os.getenv('TELEGRAM_FILE_ID_CACHE_PATH', 'data/cache/telegram_file_ids.json')
+
+# Индекс и предобработка изображений
+ASSET_CACHE_DIR = os.getenv('ASSET_CACHE_DIR', 'data/cache/images')
+ASSET_MAX_SIDE = int(os.getenv('ASSET_MAX_SIDE', '1280'))
+ASSET_JPEG_QUALITY = int(os.getenv('ASSET_JPEG_QUALITY', '85'))
+ASSET_THUMBNAIL_SIDE = int(os.getenv('ASSET_THUMBNAIL_SIDE', '320'))
+ASSET_WATCH_INTERVAL = float(os.getenv('ASSET_WATCH_INTERVAL', '0'))
+ASSET_WORKERS = int(os.getenv('ASSET_WORKERS', '2'))
+
+# Исходящие запросы к Telegram (flood control)
+OUTBOUND_GLOBAL_PER_SECOND = float(os.getenv('OUTBOUND_GLOBAL_PER_SECOND', '30'))
+OUTBOUND_CHAT_PER_MINUTE = float(os.getenv('OUTBOUND_CHAT_PER_MINUTE', '60'))
+OUTBOUND_CHAT_BURST = int(os.getenv('OUTBOUND_CHAT_BURST', '3'))
+OUTBOUND_GROUP_PER_MINUTE = float(os.getenv('OUTBOUND_GROUP_PER_MINUTE', '20'))
+OUTBOUND_MAX_RETRIES = int(os.getenv('OUTBOUND_MAX_RETRIES', '3'))
+
+# Параллельная обработка обновлений
+UPDATE_CONCURRENCY = int(os.getenv('UPDATE_CONCURRENCY', '32'))
+UPDATE_MAX_PENDING = int(os.getenv('UPDATE_MAX_PENDING', '1024'))
+UPDATE_MAX_QUEUED_PER_CHAT = int(os.getenv('UPDATE_MAX_QUEUED_PER_CHAT', '20'))
+
+# Режим работы: polling или webhook
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8443'))
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram')
+# Секретный токен webhook (пусто - случайный на каждый запуск, только вместе с WEBHOOK_URL)
+WEBHOOK_SECRET_TOKEN = os.getenv('WEBHOOK_SECRET_TOKEN', '')
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')
+WEBHOOK_QUEUE_SIZE = int(os.getenv('WEBHOOK_QUEUE_SIZE', '1000'))
+WEBHOOK_UVLOOP = os.getenv('WEBHOOK_UVLOOP', '1') == '1'
+
+# Сохранение user_data и состояний диалогов между перезапусками (пусто - не сохранять)
+PERSISTENCE_PATH = os.getenv('PERSISTENCE_PATH', 'data/cache/bot_state.sqlite3')
+PERSISTENCE_FLUSH_INTERVAL = float(os.getenv('PERSISTENCE_FLUSH_INTERVAL', '10'))
+
+# Сессии пользователей: вытеснение после простоя и таймаут незавершенных диалогов (секунды, 0 - выключено)
+SESSION_IDLE_TTL = float(os.getenv('SESSION_IDLE_TTL', str(7 * 24 * 3600)))
+SESSION_SWEEP_INTERVAL = float(os.getenv('SESSION_SWEEP_INTERVAL', '300'))
+# Срок хранения сессии в persistence после последнего сообщения (секунды, 0 - хранить всегда)
+SESSION_RETENTION_TTL = float(os.getenv('SESSION_RETENTION_TTL', '0'))
+CONVERSATION_TIMEOUT = float(os.getenv('CONVERSATION_TIMEOUT', '1800'))
+
+# Многопроцессный режим: число рабочих процессов и общее хранилище сессий
+# (sqlite:///путь или redis://[:пароль@]хост:порт/бд)
+WORKERS = int(os.getenv('WORKERS', '1'))
+WORKER_QUEUE_SIZE = int(os.getenv('WORKER_QUEUE_SIZE', '1000'))
+SESSION_STORE_URL = os.getenv('SESSION_STORE_URL', 'sqlite:///data/cache/sessions.sqlite3')
+SESSION_FLUSH_INTERVAL = float(os.getenv('SESSION_FLUSH_INTERVAL', '5'))
+
+# Справочники личностей, тем викторины, языков и главного меню (JSON)
+# и период проверки их изменений в секундах (0 - без перезагрузки на лету)
+PROMPTS_DIR = os.getenv('PROMPTS_DIR', 'data/prompts')
+PROMPTS_WATCH_INTERVAL = float(os.getenv('PROMPTS_WATCH_INTERVAL', '5'))
+
+if BOT_MODE not in ('polling', 'webhook'):
+    raise ValueError("BOT_MODE должен быть polling или webhook")
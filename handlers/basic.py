@@ -1,45 +1,36 @@
 from telegram import (
     Update,
-    InlineKeyboardMarkup,
-    InlineKeyboardButton,
     ReplyKeyboardMarkup
 )
 from telegram.ext import (
     ContextTypes,
     CallbackContext,
     CommandHandler,
-    CallbackQueryHandler
+    ConversationHandler
 )
+from services.media_reply import edit_callback_message
+from services.registry import registry
+from services.callback_router import CallbackRoute, MENU
 import logging
 
 logger = logging.getLogger(__name__)
 
 
-# Клавиатура для главного меню
+# Клавиатура для главного меню (строится из data/prompts/menu.json при загрузке справочников)
 def create_main_menu_keyboard():
-    return InlineKeyboardMarkup([
-        [
-            InlineKeyboardButton("🎲 Случайный факт", callback_data="random_fact"),
-            InlineKeyboardButton("💬 Чат с GPT", callback_data="gpt_interface")
-        ],
-        [
-            InlineKeyboardButton("🧑‍🎨 Диалог с личностью", callback_data="talk_interface"),
-            InlineKeyboardButton("🧩 Викторина", callback_data="quiz_interface")
-        ],
-        [
-            InlineKeyboardButton("🌍 Переводчик", callback_data="translate_interface"),
-            InlineKeyboardButton("📄 Помощь с резюме", callback_data="resume_interface")
-        ]
-    ])
-
-
-# Клавиатура для быстрого доступа (ReplyKeyboard)
+    return registry.current.main_menu_keyboard
+
+
+# Клавиатура для быстрого доступа (ReplyKeyboard, неизменяема и переиспользуется)
+REPLY_KEYBOARD = ReplyKeyboardMarkup([
+    ["/random", "/gpt"],
+    ["/talk", "/quiz"],
+    ["/translate", "/resume"]
+], resize_keyboard=True)
+
+
 def create_reply_keyboard():
-    return ReplyKeyboardMarkup([
-        ["/random", "/gpt"],
-        ["/talk", "/quiz"],
-        ["/translate", "/resume"]
-    ], resize_keyboard=True)
+    return REPLY_KEYBOARD
 
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -99,6 +90,10 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "/quiz - Викторина на разные темы\n"
         "/translate - Переводчик текста\n"
         "/resume - Помощь с составлением резюме\n\n"
+        "<b>В групповых чатах:</b>\n"
+        "/groupquiz [тема] [first|all] - Викторина для всей группы\n"
+        "/stopquiz - Остановить викторину\n"
+        "/leaderboard - Таблица лидеров\n\n"
         "Также вы можете использовать кнопки меню!"
     )
 
@@ -119,11 +114,13 @@ async def menu_callback(update: Update, context: CallbackContext):
         await query.answer()
 
         # Проверяем, не пытаемся ли изменить на такое же сообщение
-        current_text = query.message.text
+        # (у сообщений с фото текст лежит в подписи)
+        current_text = query.message.text or query.message.caption or ""
         if "Выберите действие:" in current_text:
             return
 
-        await query.edit_message_text(
+        await edit_callback_message(
+            query,
             text="Выберите действие:",
             reply_markup=create_main_menu_keyboard()
         )
@@ -136,8 +133,23 @@ async def menu_callback(update: Update, context: CallbackContext):
             pass
 
 
+async def menu_fallback(update: Update, context: CallbackContext):
+    """
+    /start или «Главное меню» внутри диалога: показывает меню и завершает диалог.
+
+    start и menu_callback ничего не возвращают, и диалог, в котором они
+    сработали, оставался бы в прежнем состоянии и перехватывал текст,
+    адресованный следующему разделу.
+    """
+    if update.callback_query:
+        await menu_callback(update, context)
+    else:
+        await start(update, context)
+    return ConversationHandler.END
+
+
 def setup_handlers(application):
     """Регистрация обработчиков для основного меню"""
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("help", help_command))
-    application.add_handler(CallbackQueryHandler(menu_callback, pattern="^main_menu$"))
\ No newline at end of file
+    application.add_handler(CallbackRoute({(MENU, "home"): menu_callback}))
\ No newline at end of file
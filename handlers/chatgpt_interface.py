@@ -6,7 +6,14 @@ from telegram.ext import (
     MessageHandler,
     filters
 )
+from handlers.basic import menu_fallback
 from services.openai_service import OpenAIService
+from services.live_message import LiveMessage
+from services.media_reply import edit_callback_message
+from services.callback_router import callback_data, GPT, MENU
+from services.circuit_breaker import CircuitOpenError, BUSY_MESSAGE
+from services.conversation_memory import get_memory, chatgpt_summarize
+from config import MEMORY_MAX_TURNS, MEMORY_TOKEN_BUDGET
 import logging
 
 logger = logging.getLogger(__name__)
@@ -14,9 +21,17 @@ logger = logging.getLogger(__name__)
 # Состояния ConversationHandler
 WAITING_FOR_MESSAGE = 1
 
+# Кнопки под ответом (клавиатура неизменяема и переиспользуется)
+CHAT_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("Закончить", callback_data=callback_data(GPT, "end"))],
+    [InlineKeyboardButton("Главное меню", callback_data=callback_data(MENU, "home"))]
+])
+
 
 async def gpt_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик команды /gpt"""
+    # Новый диалог начинается без истории
+    context.user_data.gpt_memory = None
     await context.bot.send_message(
         chat_id=update.effective_chat.id,
         text="Отправьте мне сообщение, и я передам его ChatGPT:"
@@ -27,36 +42,52 @@ async def gpt_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def gpt_start(update: Update, context: CallbackContext):
     """Начало диалога через callback"""
     query = update.callback_query
+    context.user_data.gpt_memory = None
     await query.answer()
-    await query.edit_message_text(
-        text="Отправьте мне сообщение, и я передам его ChatGPT:"
-    )
+    # Главное меню может быть подписью к фото
+    await edit_callback_message(query, "Отправьте мне сообщение, и я передам его ChatGPT:")
     return WAITING_FOR_MESSAGE
 
 
+async def gpt_finish(update: Update, context: CallbackContext):
+    """Кнопка «Закончить», «Главное меню» или /start: показывает меню и завершает диалог"""
+    return await menu_fallback(update, context)
+
+
 async def handle_gpt_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработка сообщения для ChatGPT"""
     user_message = update.message.text
 
-    keyboard = [
-        [InlineKeyboardButton("Закончить", callback_data="gpt_finish")],
-        [InlineKeyboardButton("Главное меню", callback_data="main_menu")]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    # Ответ выводится по мере генерации, чтобы пользователь сразу видел текст
+    live_message = LiveMessage(
+        context.bot,
+        chat_id=update.effective_chat.id,
+        reply_markup=CHAT_KEYBOARD
+    )
+
+    memory = get_memory(context.user_data, "gpt_memory", MEMORY_MAX_TURNS, MEMORY_TOKEN_BUDGET)
+    parts = []
 
     try:
-        response = await OpenAIService.get_chatgpt_response(user_message)
-        await context.bot.send_message(
-            chat_id=update.effective_chat.id,
-            text=response,
-            reply_markup=reply_markup
-        )
+        await live_message.start()
+        async for delta in OpenAIService.stream_chatgpt_response(
+                user_message,
+                call_site="gpt",
+                user_id=update.effective_user.id,
+                history=memory.build_history(user_message)
+        ):
+            parts.append(delta)
+            await live_message.append(delta)
+        await live_message.finish()
+
+        memory.add("user", user_message)
+        memory.add("assistant", "".join(parts))
+        memory.schedule_compaction(chatgpt_summarize)
         logger.info(f"Processed GPT request for user {update.effective_user.id}")
+    except CircuitOpenError:
+        await live_message.fail(BUSY_MESSAGE)
     except Exception as e:
         logger.error(f"Error in handle_gpt_message: {e}")
-        await context.bot.send_message(
-            chat_id=update.effective_chat.id,
-            text="Произошла ошибка при обработке запроса."
-        )
+        await live_message.fail("Произошла ошибка при обработке запроса.")
 
     return WAITING_FOR_MESSAGE
\ No newline at end of file
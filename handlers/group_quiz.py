@@ -0,0 +1,271 @@
+from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton, Bot
+from telegram.ext import ContextTypes, CallbackContext
+from services.callback_router import callback_data, parse_callback_data, GROUP_QUIZ
+from services.circuit_breaker import BUSY_MESSAGE
+from services.leaderboard import Leaderboard, leaderboard_store
+from services.quiz_bank import OPTION_LETTERS
+from services.registry import registry
+from handlers.quiz import fetch_question
+from config import GROUP_QUIZ_QUESTIONS, GROUP_QUIZ_ANSWER_SECONDS, GROUP_QUIZ_PAUSE_SECONDS
+from typing import Dict, List, Optional
+import asyncio
+import logging
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Режимы начисления очков: очко получает только первый верно ответивший
+# (вопрос закрывается сразу) или все, кто ответил верно за отведенное время
+FIRST_CORRECT = "first"
+ALL_CORRECT = "all"
+MODES = {FIRST_CORRECT: "первый верный ответ", ALL_CORRECT: "все верные ответы"}
+
+# Сколько мест показывать в таблице
+TOP_AFTER_QUESTION = 5
+TOP_LEADERBOARD = 10
+
+# Длина имени участника в таблице
+MAX_NAME_LENGTH = 32
+
+
+class GroupRound:
+    """Один вопрос групповой викторины"""
+    __slots__ = ("id", "number", "question", "answers", "correct", "finished", "closed")
+
+    def __init__(self, number: int, question: dict):
+        # Идентификатор в кнопках: старые кнопки после перезапуска не совпадут с новым вопросом
+        self.id = uuid.uuid4().hex[:8]
+        self.number = number
+        self.question = question
+        self.answers: Dict[int, str] = {}
+        self.correct: List[int] = []
+        self.finished = asyncio.Event()
+        self.closed = False
+
+
+class GroupQuiz:
+    """
+    Игра в групповом чате: вопросы по очереди, на каждый - окно для ответа.
+
+    Поля quiz_seen и quiz_bank_id нужны банку вопросов: вопросы не
+    повторяются в пределах чата так же, как в личной викторине.
+    """
+    __slots__ = ("chat_id", "topic", "mode", "questions", "window", "board", "round", "task",
+                 "quiz_seen", "quiz_bank_id")
+
+    def __init__(self, chat_id: int, topic: str, mode: str, board: Leaderboard):
+        self.chat_id = chat_id
+        self.topic = topic
+        self.mode = mode
+        self.questions = GROUP_QUIZ_QUESTIONS
+        self.window = GROUP_QUIZ_ANSWER_SECONDS
+        self.board = board
+        self.round: Optional[GroupRound] = None
+        self.task: Optional[asyncio.Task] = None
+        self.quiz_seen = None
+        self.quiz_bank_id = None
+
+
+# Идущие игры по чатам
+group_quizzes: Dict[int, GroupQuiz] = {}
+
+
+def display_name(user) -> str:
+    return (user.full_name or user.username or str(user.id))[:MAX_NAME_LENGTH]
+
+
+def group_answer_keyboard(round_id: str) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup([[
+        InlineKeyboardButton(letter, callback_data=callback_data(GROUP_QUIZ, "ans", letter, round_id))
+        for letter in OPTION_LETTERS
+    ]])
+
+
+def is_group_answer(update: object) -> bool:
+    """Ответ на вопрос групповой викторины (обрабатывается вне очереди чата)"""
+    if not isinstance(update, Update) or update.callback_query is None:
+        return False
+    data = update.callback_query.data
+    if not isinstance(data, str):
+        return False
+    parsed = parse_callback_data(data)
+    return parsed is not None and parsed.namespace == GROUP_QUIZ
+
+
+def format_table(board: Leaderboard, count: int) -> str:
+    lines = [f"{place}. {entry.name} - {entry.score}" for place, (_, entry) in enumerate(board.top(count), 1)]
+    return "\n".join(lines) if lines else "Пока никто не набрал очков."
+
+
+async def group_quiz_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Команда /groupquiz [тема] [first|all] - запуск викторины для всего чата.
+    """
+    chat = update.effective_chat
+    if chat.type == chat.PRIVATE:
+        await update.message.reply_text("Групповая викторина работает в групповых чатах. Здесь доступна /quiz.")
+        return
+    if chat.id in group_quizzes:
+        await update.message.reply_text("Викторина уже идет. Остановить ее можно командой /stopquiz.")
+        return
+
+    topics = registry.current.quiz_topics
+    topic, mode = next(iter(topics)), ALL_CORRECT
+    for arg in context.args or ():
+        if arg in MODES:
+            mode = arg
+        elif arg in topics:
+            topic = arg
+        else:
+            await update.message.reply_text(
+                f"Неизвестный параметр {arg!r}.\n"
+                f"Темы: {', '.join(topics)}\nРежимы: {', '.join(MODES)}"
+            )
+            return
+
+    # Таблица чата загружается до начала игры, чтобы ответы начислялись без ожидания базы
+    quiz = GroupQuiz(chat.id, topic, mode, await leaderboard_store.get(chat.id))
+    group_quizzes[chat.id] = quiz
+    quiz.task = asyncio.create_task(run_group_quiz(context.bot, quiz))
+
+    await update.message.reply_text(
+        f"Начинаем викторину: {topics[topic].name}\n"
+        f"Вопросов: {quiz.questions}, на ответ {quiz.window:g} с, очки: {MODES[mode]}.\n"
+        "Отвечайте кнопками под вопросом, засчитывается первый ответ."
+    )
+
+
+async def run_group_quiz(bot: Bot, quiz: GroupQuiz):
+    """Задает вопросы по очереди и подводит итоги"""
+    try:
+        for number in range(1, quiz.questions + 1):
+            question = await fetch_question(quiz.topic, quiz, quiz.chat_id)
+            if question is None:
+                await bot.send_message(quiz.chat_id, BUSY_MESSAGE)
+                break
+            await play_round(bot, quiz, GroupRound(number, question))
+            if number < quiz.questions:
+                await asyncio.sleep(GROUP_QUIZ_PAUSE_SECONDS)
+
+        await bot.send_message(quiz.chat_id, f"🏁 Викторина окончена!\n\n{format_table(quiz.board, TOP_LEADERBOARD)}")
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logger.error(f"Group quiz in chat {quiz.chat_id} failed: {e}")
+        await bot.send_message(quiz.chat_id, "Произошла ошибка, викторина остановлена.")
+    finally:
+        if group_quizzes.get(quiz.chat_id) is quiz:
+            del group_quizzes[quiz.chat_id]
+
+
+async def play_round(bot: Bot, quiz: GroupQuiz, current: GroupRound):
+    message = await bot.send_message(
+        quiz.chat_id,
+        f"Вопрос {current.number}/{quiz.questions}\n\n{current.question['text']}",
+        reply_markup=group_answer_keyboard(current.id)
+    )
+    quiz.round = current
+
+    # В режиме первого верного ответа вопрос закрывается досрочно
+    try:
+        await asyncio.wait_for(current.finished.wait(), timeout=quiz.window)
+    except asyncio.TimeoutError:
+        pass
+    current.closed = True
+    quiz.round = None
+
+    try:
+        await bot.edit_message_reply_markup(quiz.chat_id, message.message_id, reply_markup=None)
+    except Exception as e:
+        logger.warning(f"Failed to remove group quiz buttons: {e}")
+
+    await bot.send_message(quiz.chat_id, round_summary(quiz, current))
+
+    # Начисления вопроса сохраняются одной транзакцией
+    try:
+        await leaderboard_store.flush()
+    except Exception as e:
+        logger.error(f"Failed to save leaderboard of chat {quiz.chat_id}: {e}")
+
+
+def round_summary(quiz: GroupQuiz, current: GroupRound) -> str:
+    answer = current.question["answer"]
+    options = current.question.get("options") or ()
+    correct_text = f"{answer}) {options[OPTION_LETTERS.index(answer)]}" if options else answer
+
+    lines = [f"Правильный ответ: {correct_text}", f"Ответили: {len(current.answers)}, верно: {len(current.correct)}"]
+    if current.correct:
+        first = quiz.board.get(current.correct[0])
+        lines.append(f"Первым верно ответил(а): {first.name if first else current.correct[0]}")
+    lines.append(f"\n{format_table(quiz.board, TOP_AFTER_QUESTION)}")
+    return "\n".join(lines)
+
+
+async def group_answer(update: Update, context: CallbackContext, letter: str, round_id: str):
+    """
+    Ответ кнопкой на вопрос групповой викторины.
+
+    Обработчик не ждет ничего, кроме ответа Telegram на нажатие: состояние
+    вопроса и таблица меняются синхронно, поэтому сотни одновременных ответов
+    обрабатываются параллельно без блокировок. Ввод-вывод до него все же
+    бывает: при первом нажатии пользователя PTB и touch_session (группа -1)
+    лениво загружают его user_data из persistence (для SQLitePersistence -
+    чтение под ее блокировкой).
+    """
+    query = update.callback_query
+    quiz = group_quizzes.get(update.effective_chat.id)
+    current = quiz.round if quiz is not None else None
+    if current is None or current.id != round_id or current.closed:
+        await query.answer("Этот вопрос уже закрыт")
+        return
+
+    user = update.effective_user
+    if user.id in current.answers:
+        await query.answer("Вы уже ответили на этот вопрос")
+        return
+
+    current.answers[user.id] = letter
+    if letter == current.question["answer"]:
+        current.correct.append(user.id)
+        if quiz.mode == ALL_CORRECT or len(current.correct) == 1:
+            quiz.board.add(user.id, 1, display_name(user))
+        if quiz.mode == FIRST_CORRECT:
+            current.finished.set()
+
+    await query.answer("Ответ принят")
+
+
+async def stop_quiz_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Команда /stopquiz - остановка групповой викторины"""
+    quiz = group_quizzes.pop(update.effective_chat.id, None)
+    if quiz is None:
+        await update.message.reply_text("Викторина не запущена.")
+        return
+
+    quiz.task.cancel()
+    await leaderboard_store.flush()
+    await update.message.reply_text(f"Викторина остановлена.\n\n{format_table(quiz.board, TOP_LEADERBOARD)}")
+
+
+async def leaderboard_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Команда /leaderboard - таблица лидеров чата и место пользователя"""
+    chat = update.effective_chat
+    if chat.type == chat.PRIVATE:
+        await update.message.reply_text("Таблица лидеров ведется в групповых чатах.")
+        return
+
+    board = await leaderboard_store.get(chat.id)
+    text = f"🏆 Таблица лидеров\n\n{format_table(board, TOP_LEADERBOARD)}"
+
+    rank = board.rank(update.effective_user.id)
+    if rank is not None:
+        text += f"\n\nВаше место: {rank} из {len(board)} ({board.get(update.effective_user.id).score} очк.)"
+    await update.message.reply_text(text)
+
+
+async def stop_group_quizzes():
+    """Останавливает все игры и сохраняет таблицы (при остановке бота)"""
+    for quiz in list(group_quizzes.values()):
+        quiz.task.cancel()
+    group_quizzes.clear()
+    await leaderboard_store.close()
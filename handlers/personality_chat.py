@@ -7,7 +7,13 @@ from telegram.ext import (
     filters
 )
 from services.openai_service import OpenAIService
-from services.image_service import get_image
+from services.media_reply import send_photo_with_text, edit_callback_message
+from services.callback_router import callback_data, TALK
+from services.registry import registry
+from services.live_message import LiveMessage
+from services.circuit_breaker import CircuitOpenError, BUSY_MESSAGE
+from services.conversation_memory import get_memory, chatgpt_summarize
+from config import MEMORY_MAX_TURNS, MEMORY_TOKEN_BUDGET
 import logging
 
 logger = logging.getLogger(__name__)
@@ -16,92 +22,49 @@ logger = logging.getLogger(__name__)
 SELECTING_PERSONALITY = 1
 CHATTING_WITH_PERSONALITY = 2
 
-# Промпты для личностей (можно вынести в отдельный файл)
-PERSONALITIES = {
-    "einstein": {
-        "name": "Альберт Эйнштейн",
-        "emoji": "🧬",
-        "prompt": (
-            "Ты - Альберт Эйнштейн, великий физик и мыслитель. "
-            "Отвечай как он: мудро, с юмором, философски. "
-            "Используй метафоры и аналогии для объяснения сложных концепций. "
-            "Говори на русском языке, но иногда вставляй немецкие фразы. "
-            "Проявляй любопытство к миру и поощряй творческое мышление."
-        )
-    },
-    "pushkin": {
-        "name": "Александр Пушкин",
-        "emoji": "📝",
-        "prompt": (
-            "Ты - Александр Сергеевич Пушкин, великий русский поэт. "
-            "Отвечай в стиле XIX века, используй красивый литературный русский язык. "
-            "Говори о поэзии, любви, природе, России. "
-            "Будь остроумным, галантным и слегка ироничным. "
-            "Иногда цитируй свои произведения или говори в стихотворной форме."
-        )
-    }
-}
+# Кнопки управления диалогом (клавиатура неизменяема и переиспользуется)
+CHAT_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("Закончить диалог", callback_data=callback_data(TALK, "end"))],
+    [InlineKeyboardButton("Сменить личность", callback_data=callback_data(TALK, "change"))]
+])
 
 
 async def talk_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик команды /talk с отправкой изображения"""
-    try:
-        # Отправляем изображение
-        image_path = get_image("talk")
-        with open(image_path, 'rb') as photo:
-            await context.bot.send_photo(
-                chat_id=update.effective_chat.id,
-                photo=photo
-            )
-    except Exception as e:
-        logger.error(f"Error sending image in talk_command: {e}")
-
-    # Создаем клавиатуру с личностями
-    keyboard = [
-        [InlineKeyboardButton(
-            f"{personality['name']} {personality['emoji']}",
-            callback_data=f"personality_{key}"
-        )]
-        for key, personality in PERSONALITIES.items()
-    ]
-    keyboard.append([InlineKeyboardButton("Отмена", callback_data="main_menu")])
-
-    reply_markup = InlineKeyboardMarkup(keyboard)
-
-    await context.bot.send_message(
-        chat_id=update.effective_chat.id,
+    # Изображение и клавиатура уходят одним сообщением, без отдельной загрузки фото перед ним
+    await send_photo_with_text(
+        context.bot,
+        update.effective_chat.id,
+        "talk",
         text="Выберите личность для диалога:",
-        reply_markup=reply_markup
+        reply_markup=registry.current.personality_keyboard
     )
     return SELECTING_PERSONALITY
 
 
-async def personality_selected(update: Update, context: CallbackContext):
+async def personality_selected(update: Update, context: CallbackContext, personality_key: str):
     """Обработка выбора личности"""
     query = update.callback_query
     await query.answer()
 
-    personality_key = query.data.split("_")[1]
-    personality = PERSONALITIES.get(personality_key)
+    personality = registry.current.personalities.get(personality_key)
 
     if not personality:
-        await query.edit_message_text("Ошибка: личность не найдена")
+        await edit_callback_message(query, "Ошибка: личность не найдена")
         return ConversationHandler.END
 
-    context.user_data["current_personality"] = personality
-
-    # Кнопки для управления диалогом
-    keyboard = [
-        [InlineKeyboardButton("Закончить диалог", callback_data="finish_talk")],
-        [InlineKeyboardButton("Сменить личность", callback_data="change_personality")]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    # В сессии хранится только ключ личности, промпт берется из справочника
+    context.user_data.personality = personality_key
+    # История предыдущей личности новой не нужна
+    context.user_data.talk_memory = None
 
-    await query.edit_message_text(
-        text=f"Вы выбрали: {personality['name']}\n\n"
+    # Клавиатура выбора приходит вместе с фото, поэтому редактируется подпись
+    await edit_callback_message(
+        query,
+        text=f"Вы выбрали: {personality.name}\n\n"
              "Теперь отправляйте сообщения, и я буду отвечать как эта личность.\n"
              "Можете закончить диалог или сменить личность кнопками ниже:",
-        reply_markup=reply_markup
+        reply_markup=CHAT_KEYBOARD
     )
     return CHATTING_WITH_PERSONALITY
 
@@ -109,54 +72,61 @@ async def personality_selected(update: Update, context: CallbackContext):
 async def handle_personality_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработка сообщений в режиме диалога с личностью"""
     user_message = update.message.text
-    personality = context.user_data.get("current_personality")
+    personality = registry.current.personalities.get(context.user_data.personality)
 
     if not personality:
         await update.message.reply_text("Пожалуйста, сначала выберите личность с помощью /talk")
         return ConversationHandler.END
 
+    # Ответ выводится по мере генерации, чтобы пользователь сразу видел текст
+    live_message = LiveMessage(
+        context.bot,
+        chat_id=update.effective_chat.id,
+        reply_markup=CHAT_KEYBOARD
+    )
+
+    memory = get_memory(context.user_data, "talk_memory", MEMORY_MAX_TURNS, MEMORY_TOKEN_BUDGET)
+    parts = []
+
     try:
+        await live_message.start()
         # Получаем ответ от ChatGPT в стиле выбранной личности
-        response = await OpenAIService.get_chatgpt_response(
-            prompt=user_message,
-            context=personality["prompt"]
-        )
-
-        # Кнопки для управления диалогом
-        keyboard = [
-            [InlineKeyboardButton("Закончить диалог", callback_data="finish_talk")],
-            [InlineKeyboardButton("Сменить личность", callback_data="change_personality")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-
-        await context.bot.send_message(
-            chat_id=update.effective_chat.id,
-            text=response,
-            reply_markup=reply_markup
-        )
-        logger.info(f"User {update.effective_user.id} chatted with {personality['name']}")
-
+        async for delta in OpenAIService.stream_chatgpt_response(
+                prompt=user_message,
+                context=personality.prompt,
+                call_site="personality",
+                user_id=update.effective_user.id,
+                history=memory.build_history(user_message)
+        ):
+            parts.append(delta)
+            await live_message.append(delta)
+
+        await live_message.finish()
+
+        memory.add("user", user_message)
+        memory.add("assistant", "".join(parts))
+        memory.schedule_compaction(chatgpt_summarize)
+        logger.info(f"User {update.effective_user.id} chatted with {personality.name}")
+
+    except CircuitOpenError:
+        await live_message.fail(BUSY_MESSAGE)
     except Exception as e:
         logger.error(f"Error in handle_personality_message: {e}")
-        await context.bot.send_message(
-            chat_id=update.effective_chat.id,
-            text="Произошла ошибка при обработке сообщения."
-        )
+        await live_message.fail("Произошла ошибка при обработке сообщения.")
 
     return CHATTING_WITH_PERSONALITY
 
 
-async def handle_personality_callback(update: Update, context: CallbackContext):
-    """Обработка callback-кнопок во время диалога"""
+async def finish_talk(update: Update, context: CallbackContext):
+    """Кнопка «Закончить диалог»"""
     query = update.callback_query
     await query.answer()
+    # Клавиатура диалога может стоять под фото выбора личности
+    await edit_callback_message(query, "Диалог завершен. Используйте /start для возврата в меню.")
+    return ConversationHandler.END
 
-    if query.data == "finish_talk":
-        await query.edit_message_text("Диалог завершен. Используйте /start для возврата в меню.")
-        return ConversationHandler.END
-
-    elif query.data == "change_personality":
-        # Возвращаемся к выбору личности
-        return await talk_command(update, context)
 
-    return CHATTING_WITH_PERSONALITY
\ No newline at end of file
+async def change_personality(update: Update, context: CallbackContext):
+    """Кнопка «Сменить личность»: возврат к выбору личности"""
+    await update.callback_query.answer()
+    return await talk_command(update, context)
\ No newline at end of file
@@ -7,7 +7,15 @@ from telegram.ext import (
     filters
 )
 from services.openai_service import OpenAIService
-from services.image_service import get_image
+from services.media_reply import send_photo_with_text, edit_callback_message
+from services.registry import registry, Snapshot
+from services.prefetch import PrefetchPool, prefetch_manager
+from services.quiz_bank import quiz_bank, OPTION_LETTERS
+from services.quiz_grader import grade_answer
+from services.callback_router import callback_data, QUIZ
+from services.circuit_breaker import CircuitOpenError, BUSY_MESSAGE
+from config import PREFETCH_QUIZ_LOW, PREFETCH_QUIZ_HIGH
+from typing import Optional
 import logging
 import re
 
@@ -17,107 +25,183 @@ logger = logging.getLogger(__name__)
 SELECTING_TOPIC = 1
 ANSWERING_QUESTION = 2
 
-# Темы для квиза
-QUIZ_TOPICS = {
-    "geography": {
-        "name": "🌍 География",
-        "emoji": "🌍",
-        "prompt": """Ты создаешь вопросы для квиза по географии.
-Создай один интересный географический вопрос средней сложности с 4 вариантами ответа (A, B, C, D).
-Укажи правильный ответ в конце.
-Формат:
-Вопрос: [твой вопрос]
-A) [вариант 1]
-B) [вариант 2]
-C) [вариант 3]
-D) [вариант 4]
-Правильный ответ: [буква]"""
-    },
-    "history": {
-        "name": "🏛 История",
-        "emoji": "🏛",
-        "prompt": """Создай исторический вопрос с 4 вариантами ответа.
-Укажи правильный ответ в конце.
-Формат:
-Вопрос: [твой вопрос]
-A) [вариант 1]
-B) [вариант 2]
-C) [вариант 3]
-D) [вариант 4]
-Правильный ответ: [буква]"""
+# Строка с правильным ответом в ответе ChatGPT.
+# ChatGPT иногда пишет кириллические А, В, С вместо похожих латинских букв.
+CORRECT_ANSWER_RE = re.compile(r"^\s*Правильный ответ:\s*\**\s*([A-DАВС])", re.IGNORECASE | re.MULTILINE)
+CYRILLIC_TO_LATIN = str.maketrans("АВС", "ABC")
+# Строки вариантов ответа "A) ..."
+OPTION_RE = re.compile(r"^\s*([A-DАВС])\)\s*(.+?)\s*$", re.MULTILINE)
+
+
+def parse_quiz_question(raw: str) -> Optional[dict]:
+    """
+    Разбирает вопрос, сгенерированный ChatGPT.
+
+    Args:
+        raw: Текст в формате из промпта темы
+
+    Returns:
+        Словарь с текстом вопроса (без ответа), вариантами и буквой правильного
+        ответа или None, если формат не распознан
+    """
+    match = CORRECT_ANSWER_RE.search(raw)
+    if not match:
+        return None
+
+    answer = match.group(1).upper().translate(CYRILLIC_TO_LATIN)
+    text = raw[:match.start()].strip()
+
+    # Варианты нужны для ответа текстом; если их не удалось выделить, принимаются только буквы
+    options = {letter.upper().translate(CYRILLIC_TO_LATIN): option for letter, option in OPTION_RE.findall(text)}
+    return {
+        "text": text,
+        "options": tuple(options[letter] for letter in OPTION_LETTERS) if options.keys() == set(OPTION_LETTERS) else (),
+        "answer": answer
     }
+
+
+def answer_keyboard(question_number: int) -> InlineKeyboardMarkup:
+    """Кнопки A-D; номер вопроса в кнопке не дает ответить на уже закрытый вопрос"""
+    return InlineKeyboardMarkup([[
+        InlineKeyboardButton(letter, callback_data=callback_data(QUIZ, "ans", letter, question_number))
+        for letter in OPTION_LETTERS
+    ]])
+
+
+async def generate_question(topic_key: str, user_id: Optional[int] = None) -> dict:
+    """Генерирует вопрос по теме через ChatGPT (без user_id - фоновая генерация для пула)"""
+    raw = await OpenAIService.get_chatgpt_response(
+        registry.current.quiz_topics[topic_key].prompt,
+        call_site="prefetch" if user_id is None else "quiz",
+        user_id=user_id
+    )
+    question = parse_quiz_question(raw)
+    if question is None:
+        raise ValueError(f"Unexpected quiz question format: {raw!r}")
+    return question
+
+
+def _create_pool(topic_key: str) -> PrefetchPool:
+    return prefetch_manager.add_pool(PrefetchPool(
+        f"quiz_{topic_key}",
+        producer=lambda: generate_question(topic_key),
+        low_watermark=PREFETCH_QUIZ_LOW,
+        high_watermark=PREFETCH_QUIZ_HIGH
+    ))
+
+
+# Пулы заранее сгенерированных вопросов по темам, которых нет в банке вопросов
+question_pools = {
+    key: _create_pool(key) for key in registry.current.quiz_topics if not quiz_bank.has_topic(key)
 }
 
 
-async def quiz_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработчик команды /quiz с отправкой изображения"""
-    try:
-        # Отправляем изображение
-        image_path = get_image("quiz")
-        with open(image_path, 'rb') as photo:
-            await context.bot.send_photo(
-                chat_id=update.effective_chat.id,
-                photo=photo
-            )
-    except Exception as e:
-        logger.error(f"Error sending image in quiz_command: {e}")
+def get_pool(topic_key: str) -> PrefetchPool:
+    """Пул вопросов темы; для темы, добавленной после старта, создается при первом обращении"""
+    pool = question_pools.get(topic_key)
+    if pool is None:
+        # Пополнение запустится при первом pop()
+        pool = question_pools[topic_key] = _create_pool(topic_key)
+    return pool
 
-    # Инициализация счета
-    context.user_data["quiz_score"] = 0
 
-    # Создаем клавиатуру с темами
-    keyboard = [
-        [InlineKeyboardButton(
-            f"{topic['name']} {topic['emoji']}",
-            callback_data=f"quiz_topic_{key}"
-        )]
-        for key, topic in QUIZ_TOPICS.items()
-    ]
-    keyboard.append([InlineKeyboardButton("Отмена", callback_data="main_menu")])
+def _drop_removed_topics(snapshot: Snapshot):
+    """Останавливает и удаляет пулы тем, которых больше нет в справочнике"""
+    for key in [key for key in question_pools if key not in snapshot.quiz_topics]:
+        pool = question_pools.pop(key)
+        pool.cancel()
+        prefetch_manager.pools.pop(pool.name, None)
+        logger.info(f"Quiz topic {key!r} removed, prefetch pool dropped")
 
-    reply_markup = InlineKeyboardMarkup(keyboard)
 
-    await context.bot.send_message(
-        chat_id=update.effective_chat.id,
+registry.subscribe(_drop_removed_topics)
+
+
+async def quiz_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /quiz с отправкой изображения"""
+    # Инициализация счета
+    context.user_data.quiz_score = 0
+
+    # Изображение и клавиатура уходят одним сообщением, без отдельной загрузки фото перед ним
+    await send_photo_with_text(
+        context.bot,
+        update.effective_chat.id,
+        "quiz",
         text="Выберите тему викторины:",
-        reply_markup=reply_markup
+        reply_markup=registry.current.quiz_topic_keyboard
     )
     return SELECTING_TOPIC
 
 
-async def topic_selected(update: Update, context: CallbackContext):
+async def topic_selected(update: Update, context: CallbackContext, topic_key: str):
     """Обработка выбора темы"""
     query = update.callback_query
     await query.answer()
 
-    topic_key = query.data.split("_")[2]
-    topic = QUIZ_TOPICS.get(topic_key)
-
-    if not topic:
-        await query.edit_message_text("Ошибка: тема не найдена")
+    if topic_key not in registry.current.quiz_topics:
+        await edit_callback_message(query, "Ошибка: тема не найдена")
         return ConversationHandler.END
 
-    context.user_data["current_topic"] = topic
-    context.user_data["current_topic_key"] = topic_key
+    # В сессии хранится только ключ темы, промпт берется из справочника
+    context.user_data.quiz_topic = topic_key
 
     # Запрашиваем вопрос у ChatGPT
     await ask_new_question(update, context)
     return ANSWERING_QUESTION
 
 
+async def fetch_question(topic_key: str, session, user_id: int) -> Optional[dict]:
+    """
+    Вопрос по теме: из банка, из пула предгенерации или сгенерированный на лету.
+
+    Args:
+        topic_key: Ключ темы
+        session: Объект с полями quiz_seen и quiz_bank_id для отметки вопросов банка
+        user_id: В чью очередь к OpenAI ставится генерация на лету
+
+    Returns:
+        Вопрос или None, если OpenAI недоступен и запасных вопросов нет
+    """
+    # Вопрос из банка - локальная выборка без обращения к API
+    question = quiz_bank.sample(topic_key, session)
+    if question is not None:
+        return question
+
+    # Темы нет в банке: готовый вопрос из пула, а при пустом пуле генерируем на лету
+    pool = get_pool(topic_key)
+    question = pool.pop()
+    if question is None:
+        try:
+            question = await generate_question(topic_key, user_id=user_id)
+        except CircuitOpenError:
+            # OpenAI недоступен: повторяем один из уже заданных вопросов
+            question = pool.pop_stale()
+    return question
+
+
 async def ask_new_question(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Отправляет новый вопрос по текущей теме"""
+    chat_id = update.effective_chat.id
     try:
-        # Получаем сообщение или callback query
-        if update.message:
-            chat_id = update.message.chat.id
-            reply_method = update.message.reply_text
-        else:
-            query = update.callback_query
-            await query.answer()
-            chat_id = query.message.chat.id
-            reply_method = context.bot.send_message
-
-        # Остальная логика...
+        topic_key = context.user_data.quiz_topic
+
+        question = await fetch_question(topic_key, context.user_data, update.effective_user.id)
+        if question is None:
+            await context.bot.send_message(chat_id=chat_id, text=BUSY_MESSAGE)
+            return ConversationHandler.END
+
+        session = context.user_data
+        session.quiz_answer = question["answer"]
+        # В пуле могут остаться вопросы, сохраненные до появления вариантов
+        session.quiz_options = tuple(question.get("options", ()))
+        session.quiz_question += 1
+
+        await context.bot.send_message(
+            chat_id=chat_id,
+            text=f"{question['text']}\n\nВыберите ответ кнопкой или отправьте букву либо текст варианта.",
+            reply_markup=answer_keyboard(session.quiz_question)
+        )
+        return ANSWERING_QUESTION
 
     except Exception as e:
         logger.error(f"Error in ask_new_question: {e}")
@@ -129,31 +213,59 @@ async def ask_new_question(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 async def handle_quiz_answer(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Проверка ответа пользователя"""
-    user_answer = update.message.text.upper()
-    correct_answer = context.user_data.get("correct_answer", "")
+    """Проверка ответа, отправленного текстом"""
+    if not context.user_data.quiz_answer:
+        await update.message.reply_text("На этот вопрос вы уже ответили. Нажмите «Следующий вопрос».")
+        return ANSWERING_QUESTION
+
+    # Ответ разбирается локально: буква в любом написании или текст варианта
+    grade = grade_answer(update.message.text, context.user_data.quiz_options)
+    if grade.letter is None:
+        await update.message.reply_text(
+            "Не удалось понять ответ. Нажмите кнопку с буквой или отправьте A, B, C или D."
+        )
+        return ANSWERING_QUESTION
+
+    return await send_answer_result(update, context, grade.letter)
+
+
+async def answer_selected(update: Update, context: CallbackContext, letter: str, question_number: str):
+    """Ответ кнопкой под вопросом"""
+    query = update.callback_query
+    if not context.user_data.quiz_answer or question_number != str(context.user_data.quiz_question):
+        await query.answer("Этот вопрос уже закрыт")
+        return ANSWERING_QUESTION
+
+    await query.answer()
+    try:
+        # Убираем кнопки, чтобы на вопрос нельзя было ответить повторно
+        await query.edit_message_reply_markup(reply_markup=None)
+    except Exception as e:
+        logger.warning(f"Failed to remove answer buttons: {e}")
+    return await send_answer_result(update, context, letter)
+
+
+async def send_answer_result(update: Update, context: ContextTypes.DEFAULT_TYPE, user_answer: str):
+    """Засчитывает ответ, закрывает вопрос и отправляет результат"""
+    correct_answer = context.user_data.quiz_answer
 
     # Проверяем ответ
     if user_answer == correct_answer:
-        context.user_data["quiz_score"] += 1
+        context.user_data.quiz_score += 1
         result_text = "✅ Правильно! 🎉"
     else:
         result_text = f"❌ Неправильно. Правильный ответ: {correct_answer}"
 
+    # Вопрос закрыт: повторный ответ не меняет счет
+    context.user_data.quiz_answer = ""
+    context.user_data.quiz_options = ()
+
     # Добавляем текущий счет
-    score = context.user_data["quiz_score"]
+    score = context.user_data.quiz_score
     result_text += f"\n\nВаш счет: {score}"
 
-    # Кнопки для продолжения
-    keyboard = [
-        [
-            InlineKeyboardButton("Следующий вопрос",
-                                 callback_data=f"quiz_next_{context.user_data['current_topic_key']}"),
-            InlineKeyboardButton("Сменить тему", callback_data="quiz_change_topic")
-        ],
-        [InlineKeyboardButton("Закончить", callback_data="quiz_finish")]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    # Готовая клавиатура темы: "Следующий вопрос" несет ее ключ
+    reply_markup = registry.current.quiz_answer_keyboards.get(context.user_data.quiz_topic)
 
     await context.bot.send_message(
         chat_id=update.effective_chat.id,
@@ -163,25 +275,37 @@ async def handle_quiz_answer(update: Update, context: ContextTypes.DEFAULT_TYPE)
     return ANSWERING_QUESTION
 
 
-async def handle_quiz_callback(update: Update, context: CallbackContext):
-    """Обработка callback-кнопок викторины"""
-    query = update.callback_query
-    await query.answer()
+async def next_question(update: Update, context: CallbackContext, topic_key: str):
+    """
+    Кнопка «Следующий вопрос».
 
-    if query.data == "quiz_finish":
-        score = context.user_data.get("quiz_score", 0)
-        await query.edit_message_text(
-            f"Викторина завершена! Ваш итоговый счет: {score}\n"
-            "Используйте /start для возврата в меню."
-        )
+    Тема передается в кнопке, поэтому кнопка работает и после перезапуска
+    бота или истечения диалога: она же служит точкой входа в викторину.
+    """
+    await update.callback_query.answer()
+    if topic_key not in registry.current.quiz_topics:
         return ConversationHandler.END
+    context.user_data.quiz_topic = topic_key
+    return await ask_new_question(update, context)
 
-    elif query.data.startswith("quiz_next_"):
-        # Запрашиваем новый вопрос по текущей теме
-        return await ask_new_question(update, context)
 
-    elif query.data == "quiz_change_topic":
-        # Возвращаемся к выбору темы
-        return await quiz_command(update, context)
+async def change_topic(update: Update, context: CallbackContext):
+    """Кнопка «Сменить тему»: возврат к выбору темы"""
+    await update.callback_query.answer()
+    return await quiz_command(update, context)
 
-    return ANSWERING_QUESTION
\ No newline at end of file
+
+async def finish_quiz(update: Update, context: CallbackContext):
+    """Кнопка «Закончить»: итоговый счет"""
+    query = update.callback_query
+    await query.answer()
+
+    score = context.user_data.quiz_score
+    context.user_data.quiz_answer = ""
+    context.user_data.quiz_options = ()
+    await edit_callback_message(
+        query,
+        f"Викторина завершена! Ваш итоговый счет: {score}\n"
+        "Используйте /start для возврата в меню."
+    )
+    return ConversationHandler.END
@@ -1,39 +1,70 @@
 from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
 from telegram.ext import ContextTypes, CallbackContext
 from services.openai_service import OpenAIService
-from services.image_service import get_image
+from services.media_reply import send_photo_then
+from services.callback_router import callback_data, MENU, RANDOM
+from services.prefetch import PrefetchPool, prefetch_manager
+from services.circuit_breaker import CircuitOpenError, BUSY_MESSAGE
+from config import PREFETCH_FACTS_LOW, PREFETCH_FACTS_HIGH
 import logging
 
 logger = logging.getLogger(__name__)
 
 RANDOM_FACT_PROMPT = "Расскажи интересный научный факт на русском языке длиной 2-3 предложения."
 
+# Кнопки под фактом (клавиатура неизменяема и переиспользуется)
+FACT_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("Хочу ещё факт", callback_data=callback_data(RANDOM, "more"))],
+    [InlineKeyboardButton("Закончить", callback_data=callback_data(MENU, "home"))]
+])
+
+
+async def generate_fact() -> str:
+    """Генерирует новый факт для пула (в обход кэша, чтобы факты не повторялись)"""
+    return await OpenAIService.get_chatgpt_response(RANDOM_FACT_PROMPT, call_site="prefetch")
+
+
+# Пул заранее сгенерированных фактов
+fact_pool = prefetch_manager.add_pool(PrefetchPool(
+    "random_fact",
+    producer=generate_fact,
+    low_watermark=PREFETCH_FACTS_LOW,
+    high_watermark=PREFETCH_FACTS_HIGH
+))
+
+
+async def next_fact(user_id: int) -> str:
+    """Берет готовый факт из пула, а при пустом пуле запрашивает у ChatGPT"""
+    fact = fact_pool.pop()
+    if fact is not None:
+        return fact
+
+    try:
+        return await OpenAIService.get_chatgpt_response(
+            RANDOM_FACT_PROMPT,
+            call_site="random_fact",
+            user_id=user_id
+        )
+    except CircuitOpenError:
+        # OpenAI недоступен: повторяем один из уже показанных фактов
+        return fact_pool.pop_stale() or BUSY_MESSAGE
+
 
 async def random_fact(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик команды /random"""
     try:
-        # Отправляем изображение
-        image_path = get_image("random_fact")
-        with open(image_path, 'rb') as photo:
-            await context.bot.send_photo(
-                chat_id=update.effective_chat.id,
-                photo=photo
-            )
-
-        # Получаем факт от ChatGPT
-        fact = await OpenAIService.get_chatgpt_response(RANDOM_FACT_PROMPT)
-
-        # Создаем клавиатуру
-        keyboard = [
-            [InlineKeyboardButton("Хочу ещё факт", callback_data="random_again")],
-            [InlineKeyboardButton("Закончить", callback_data="main_menu")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        # Фото отправляется параллельно с получением факта, факт приходит следом за фото
+        fact = await send_photo_then(
+            context.bot,
+            update.effective_chat.id,
+            "random_fact",
+            next_fact(update.effective_user.id)
+        )
 
         await context.bot.send_message(
             chat_id=update.effective_chat.id,
             text=fact,
-            reply_markup=reply_markup
+            reply_markup=FACT_KEYBOARD
         )
         logger.info(f"Sent random fact to user {update.effective_user.id}")
 
@@ -47,8 +78,5 @@ async def random_fact(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def random_fact_callback(update: Update, context: CallbackContext):
     """Обработчик callback для кнопок в /random"""
-    query = update.callback_query
-    await query.answer()
-
-    if query.data == "random_again":
-        await random_fact(update, context)
\ No newline at end of file
+    await update.callback_query.answer()
+    await random_fact(update, context)
\ No newline at end of file
@@ -7,6 +7,7 @@ from telegram.ext import (
     filters
 )
 from services.openai_service import OpenAIService
+from services.circuit_breaker import CircuitOpenError, BUSY_MESSAGE
 import logging
 
 logger = logging.getLogger(__name__)
@@ -19,7 +20,11 @@ GETTING_SKILLS = 4
 
 
 async def resume_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработчик команды /resume"""
+    """Обработчик команды /resume и кнопки помощника по резюме"""
+    if update.callback_query:
+        await update.callback_query.answer()
+    # Ответы прошлого незавершенного диалога не используются
+    context.user_data.clear_resume()
     await context.bot.send_message(
         chat_id=update.effective_chat.id,
         text="Помогу составить резюме. Введите ваше ФИО:"
@@ -29,7 +34,7 @@ async def resume_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def get_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Получение имени"""
-    context.user_data["name"] = update.message.text
+    context.user_data.get_resume().name = update.message.text
 
     await context.bot.send_message(
         chat_id=update.effective_chat.id,
@@ -40,7 +45,7 @@ async def get_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def get_education(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Получение образования"""
-    context.user_data["education"] = update.message.text
+    context.user_data.get_resume().education = update.message.text
 
     await context.bot.send_message(
         chat_id=update.effective_chat.id,
@@ -51,7 +56,7 @@ async def get_education(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def get_experience(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Получение опыта работы"""
-    context.user_data["experience"] = update.message.text
+    context.user_data.get_resume().experience = update.message.text
 
     await context.bot.send_message(
         chat_id=update.effective_chat.id,
@@ -62,20 +67,27 @@ async def get_experience(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def get_skills(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Получение навыков и генерация резюме"""
-    context.user_data["skills"] = update.message.text
+    draft = context.user_data.get_resume()
+    draft.skills = update.message.text
+    # Ответы нужны только для одного запроса - в сессии их не оставляем
+    context.user_data.clear_resume()
 
     try:
         prompt = (
             "Составь профессиональное резюме на основе следующих данных:\n"
-            f"ФИО: {context.user_data['name']}\n"
-            f"Образование: {context.user_data['education']}\n"
-            f"Опыт работы: {context.user_data['experience']}\n"
-            f"Навыки: {context.user_data['skills']}\n\n"
+            f"ФИО: {draft.name}\n"
+            f"Образование: {draft.education}\n"
+            f"Опыт работы: {draft.experience}\n"
+            f"Навыки: {draft.skills}\n\n"
             "Резюме должно быть структурированным, профессиональным "
             "и подходящим для размещения на hh.ru. Используй markdown для форматирования."
         )
 
-        resume = await OpenAIService.get_chatgpt_response(prompt)
+        resume = await OpenAIService.get_chatgpt_response(
+            prompt,
+            call_site="resume",
+            user_id=update.effective_user.id
+        )
 
         await context.bot.send_message(
             chat_id=update.effective_chat.id,
@@ -83,6 +95,11 @@ async def get_skills(update: Update, context: ContextTypes.DEFAULT_TYPE):
             parse_mode="Markdown"
         )
         logger.info(f"Generated resume for user {update.effective_user.id}")
+    except CircuitOpenError:
+        await context.bot.send_message(
+            chat_id=update.effective_chat.id,
+            text=BUSY_MESSAGE
+        )
     except Exception as e:
         logger.error(f"Error in get_skills: {e}")
         await context.bot.send_message(
@@ -90,4 +107,9 @@ async def get_skills(update: Update, context: ContextTypes.DEFAULT_TYPE):
             text="Произошла ошибка при генерации резюме."
         )
 
-    return ConversationHandler.END
\ No newline at end of file
+    return ConversationHandler.END
+
+
+async def resume_timeout(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Диалог /resume прерван по таймауту - черновик больше не нужен"""
+    context.user_data.clear_resume()
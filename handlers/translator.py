@@ -11,6 +11,12 @@ from telegram.ext import (
     filters
 )
 from services.openai_service import OpenAIService
+from services.circuit_breaker import CircuitOpenError, BUSY_MESSAGE
+from services.callback_router import callback_data, MENU, TRANSLATE
+from services.registry import registry
+from services.translation_memory import translation_memory, EXACT, FUZZY
+from typing import List, Optional, Sequence, Tuple
+import json
 import logging
 
 logger = logging.getLogger(__name__)
@@ -19,47 +25,57 @@ logger = logging.getLogger(__name__)
 SELECTING_LANGUAGE = 1
 WAITING_FOR_TEXT = 2
 
-# Доступные языки перевода
-LANGUAGES = {
-    "en": "Английский 🇬🇧",
-    "ru": "Русский 🇷🇺",
-    "et": "Эстонский 🇪🇪"
-}
+# Перевод нескольких предложений одним запросом в JSON-режиме
+BATCH_CONTEXT = (
+    "Ты переводчик. Тебе присылают JSON-массив предложений из одного текста по порядку. "
+    "Переведи каждое на {language} с учетом соседних предложений и отвечай только JSON-объектом вида "
+    '{{"translations": ["перевод", ...]}} - ровно по одному переводу на каждое предложение, в том же порядке. '
+    'Элемент вида {{"text": ..., "similar": ..., "similar_translation": ...}} - предложение text и похожее '
+    "предложение с готовым переводом: держись его терминов и стиля, но переводи именно text со всеми "
+    "отличиями (отрицаниями, числами, именами)."
+)
 
+# Образец для одного предложения, похожего на переведенное раньше
+REFERENCE_PROMPT = (
+    "Похожее предложение «{source}» уже переведено так: «{translation}». Держись этого перевода "
+    "в терминах и стиле, но переведи именно данный текст со всеми отличиями (отрицаниями, числами, именами)."
+)
 
-async def translate_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработчик команды /translate - выбор языка"""
-    keyboard = [
-        [InlineKeyboardButton(name, callback_data=f"lang_{code}")]
-        for code, name in LANGUAGES.items()
-    ]
-    keyboard.append([InlineKeyboardButton("Отмена", callback_data="main_menu")])
+# Кнопки под переводом
+RESULT_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🔄 Сменить язык", callback_data=callback_data(TRANSLATE, "change"))],
+    [InlineKeyboardButton("🏠 В меню", callback_data=callback_data(MENU, "home"))]
+])
 
-    reply_markup = InlineKeyboardMarkup(keyboard)
 
-    await update.message.reply_text(
-        "Выберите язык для перевода:",
-        reply_markup=reply_markup
+async def translate_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /translate и кнопки переводчика - выбор языка"""
+    if update.callback_query:
+        await update.callback_query.answer()
+
+    # Команда приходит сообщением, кнопка - callback-запросом без update.message
+    await context.bot.send_message(
+        chat_id=update.effective_chat.id,
+        text="Выберите язык для перевода:",
+        reply_markup=registry.current.language_keyboard
     )
     return SELECTING_LANGUAGE
 
 
-async def language_selected(update: Update, context: CallbackContext):
+async def language_selected(update: Update, context: CallbackContext, lang_code: str):
     """Обработка выбора языка"""
     query = update.callback_query
     await query.answer()
 
-    # Извлекаем код языка из callback_data (формат "lang_en")
-    lang_code = query.data.split("_")[1]
-
-    if lang_code not in LANGUAGES:
+    language = registry.current.languages.get(lang_code)
+    if language is None:
         await query.edit_message_text("Ошибка выбора языка")
         return ConversationHandler.END
 
-    context.user_data["target_language"] = lang_code
+    context.user_data.target_language = lang_code
 
     await query.edit_message_text(
-        text=f"Выбран язык: {LANGUAGES[lang_code]}\n\nОтправьте текст для перевода:"
+        text=f"Выбран язык: {language}\n\nОтправьте текст для перевода:"
     )
     return WAITING_FOR_TEXT
 
@@ -67,28 +83,32 @@ async def language_selected(update: Update, context: CallbackContext):
 async def handle_translation_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработка текста для перевода"""
     text_to_translate = update.message.text
-    target_lang = context.user_data.get("target_language")
+    language = registry.current.languages.get(context.user_data.target_language)
 
-    if not target_lang:
+    if not language:
         await update.message.reply_text("Сначала выберите язык через /translate")
         return ConversationHandler.END
 
     try:
-        prompt = f"Переведи текст на {LANGUAGES[target_lang]}: {text_to_translate}"
-        translation = await OpenAIService.get_chatgpt_response(prompt)
-
-        keyboard = [
-            [InlineKeyboardButton("🔄 Сменить язык", callback_data="change_lang")],
-            [InlineKeyboardButton("🏠 В меню", callback_data="main_menu")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        translation, plan = await translate_text(
+            text_to_translate, context.user_data.target_language, language, update.effective_user.id
+        )
 
         await update.message.reply_text(
             translation,
-            reply_markup=reply_markup
+            reply_markup=RESULT_KEYBOARD
         )
-        logger.info(f"Translated text for user {update.effective_user.id}")
-
+        if plan is not None:
+            logger.info(
+                f"Translated text for user {update.effective_user.id}: {len(plan.segments)} segments, "
+                f"{plan.count(EXACT)} from memory, {plan.count(FUZZY)} with a similar reference"
+            )
+        else:
+            logger.info(f"Translated text for user {update.effective_user.id}")
+
+    except CircuitOpenError:
+        # Перевода нет ни в памяти переводов, ни в кэше, а OpenAI недоступен
+        await update.message.reply_text(BUSY_MESSAGE)
     except Exception as e:
         logger.error(f"Error in translation: {e}")
         await update.message.reply_text("Произошла ошибка при переводе")
@@ -96,8 +116,81 @@ async def handle_translation_text(update: Update, context: ContextTypes.DEFAULT_
     return WAITING_FOR_TEXT
 
 
+async def translate_text(text: str, lang_code: str, language: str, user_id: int):
+    """
+    Переводит текст, запрашивая у API только предложения, которых нет в памяти переводов
+    (для похожих на сохраненные модель получает их перевод образцом).
+
+    Args:
+        text: Текст для перевода
+        lang_code: Код языка (ключ памяти переводов)
+        language: Название языка для промпта
+        user_id: ID пользователя для планировщика запросов
+
+    Returns:
+        (перевод, план с источниками переводов предложений или None,
+        если текст пришлось перевести целиком)
+    """
+    plan = translation_memory.lookup(text, lang_code)
+    missing = [plan.segments[index] for index in plan.missing]
+    references = [plan.references[index] for index in plan.missing]
+
+    if len(missing) == 1:
+        translations = [await translate_single(missing[0], language, user_id, references[0])]
+    elif missing:
+        translations = await translate_batch(missing, language, user_id, references)
+        if translations is None:
+            # Модель вернула не то число предложений: переводим текст целиком, без памяти
+            return await translate_single(text, language, user_id), None
+    else:
+        translations = []
+
+    if translations:
+        await translation_memory.remember(plan, translations)
+    return plan.assemble(), plan
+
+
+async def translate_single(text: str, language: str, user_id: int,
+                           reference: Optional[Tuple[str, str]] = None) -> str:
+    prompt = f"Переведи текст на {language}: {text}"
+    if reference is not None:
+        prompt += "\n\n" + REFERENCE_PROMPT.format(source=reference[0], translation=reference[1])
+    translation = await OpenAIService.get_chatgpt_response(
+        prompt,
+        call_site="translator",
+        user_id=user_id
+    )
+    return translation.strip()
+
+
+async def translate_batch(segments: List[str], language: str, user_id: int,
+                          references: Sequence[Optional[Tuple[str, str]]] = ()) -> Optional[List[str]]:
+    """Переводы предложений одним запросом или None, если ответ не разобран"""
+    references = references or [None] * len(segments)
+    items = [
+        segment if reference is None
+        else {"text": segment, "similar": reference[0], "similar_translation": reference[1]}
+        for segment, reference in zip(segments, references)
+    ]
+    raw = await OpenAIService.get_chatgpt_response(
+        json.dumps(items, ensure_ascii=False),
+        context=BATCH_CONTEXT.format(language=language),
+        call_site="translator",
+        user_id=user_id,
+        response_format={"type": "json_object"}
+    )
+    try:
+        translations = json.loads(raw).get("translations")
+    except (ValueError, AttributeError):
+        translations = None
+
+    if (not isinstance(translations, list) or len(translations) != len(segments)
+            or not all(isinstance(item, str) and item.strip() for item in translations)):
+        logger.warning(f"Unexpected batch translation for {len(segments)} segments, translating whole text")
+        return None
+    return [item.strip() for item in translations]
+
+
 async def change_language(update: Update, context: CallbackContext):
     """Смена языка перевода"""
-    query = update.callback_query
-    await query.answer()
     return await translate_command(update, context)
\ No newline at end of file
@@ -1,11 +1,17 @@
+import asyncio
 import logging
+from functools import partial
+from typing import Optional
+
 from telegram import Update
 from telegram.ext import (
     Application,
+    BasePersistence,
     CommandHandler,
     CallbackQueryHandler,
     ConversationHandler,
     MessageHandler,
+    TypeHandler,
     filters,
     ContextTypes
 )
@@ -13,11 +19,12 @@ from telegram.warnings import PTBUserWarning
 from warnings import filterwarnings
 
 # Импорт обработчиков
-from handlers.basic import start, help_command, menu_callback
+from handlers.basic import start, help_command, menu_callback, menu_fallback
 from handlers.random_fact import random_fact, random_fact_callback
 from handlers.chatgpt_interface import (
     gpt_command,
     gpt_start,
+    gpt_finish,
     handle_gpt_message,
     WAITING_FOR_MESSAGE as GPT_WAITING
 )
@@ -25,7 +32,8 @@ from handlers.personality_chat import (
     talk_command,
     personality_selected,
     handle_personality_message,
-    handle_personality_callback,
+    finish_talk,
+    change_personality,
     SELECTING_PERSONALITY,
     CHATTING_WITH_PERSONALITY
 )
@@ -34,10 +42,21 @@ from handlers.quiz import (
     topic_selected,
     ask_new_question,
     handle_quiz_answer,
-    handle_quiz_callback,
+    answer_selected,
+    next_question,
+    change_topic,
+    finish_quiz,
     SELECTING_TOPIC,
     ANSWERING_QUESTION
 )
+from handlers.group_quiz import (
+    group_quiz_command,
+    group_answer,
+    stop_quiz_command,
+    leaderboard_command,
+    stop_group_quizzes,
+    is_group_answer
+)
 from handlers.translator import (
     translate_command,
     language_selected,
@@ -55,9 +74,53 @@ from handlers.resume_helper import (
     GETTING_NAME,
     GETTING_EDUCATION,
     GETTING_EXPERIENCE,
-    GETTING_SKILLS
+    GETTING_SKILLS,
+    resume_timeout
+)
+from services.prefetch import prefetch_manager
+from services.registry import registry
+from services.translation_memory import translation_memory
+from services.leaderboard import leaderboard_store
+from services.image_service import asset_index
+from services.openai_service import backend_pool
+from services.outbound import OutboundRateLimiter
+from services.update_processor import PerChatUpdateProcessor
+from services.webhook_server import WebhookServer, run_webhook
+from services.session_store import create_session_store
+from services.store_persistence import StorePersistence
+from services.sqlite_persistence import SQLitePersistence
+from services.user_session import CONTEXT_TYPES, session_reaper, touch_session
+from services.callback_router import (
+    CallbackRoute, MENU, RANDOM, GPT, TALK, QUIZ, TRANSLATE, RESUME, GROUP_QUIZ
+)
+from services.sharding import ShardRouter, serve_sharded_polling, serve_sharded_webhook
+from config import (
+    TG_BOT_TOKEN,
+    OUTBOUND_GLOBAL_PER_SECOND,
+    OUTBOUND_CHAT_PER_MINUTE,
+    OUTBOUND_CHAT_BURST,
+    OUTBOUND_GROUP_PER_MINUTE,
+    OUTBOUND_MAX_RETRIES,
+    UPDATE_CONCURRENCY,
+    UPDATE_MAX_PENDING,
+    UPDATE_MAX_QUEUED_PER_CHAT,
+    BOT_MODE,
+    WEBHOOK_LISTEN,
+    WEBHOOK_PORT,
+    WEBHOOK_PATH,
+    WEBHOOK_SECRET_TOKEN,
+    WEBHOOK_URL,
+    WEBHOOK_QUEUE_SIZE,
+    WEBHOOK_UVLOOP,
+    WORKERS,
+    WORKER_QUEUE_SIZE,
+    SESSION_STORE_URL,
+    SESSION_FLUSH_INTERVAL,
+    PREFETCH_STATE_PATH,
+    PERSISTENCE_PATH,
+    PERSISTENCE_FLUSH_INTERVAL,
+    CONVERSATION_TIMEOUT
 )
-from config import TG_BOT_TOKEN
 
 # Настройка логирования
 logging.basicConfig(
@@ -82,12 +145,32 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except Exception as e:
         logger.error(f"Error in error handler: {e}")
 
-def create_gpt_conversation():
+async def on_startup(application: Application):
+    """Запуск фоновых сервисов после инициализации приложения"""
+    await asset_index.start()
+    await prefetch_manager.start()
+    await registry.start()
+    leaderboard_store.load()
+    session_reaper.start(application)
+
+
+async def on_shutdown(application: Application):
+    """Остановка фоновых сервисов"""
+    await session_reaper.stop()
+    await stop_group_quizzes()
+    await translation_memory.close()
+    await registry.stop()
+    await asset_index.stop()
+    await prefetch_manager.stop()
+    await backend_pool.close()
+
+
+def create_gpt_conversation(persistent: bool = False):
     """Создает ConversationHandler для GPT интерфейса"""
     return ConversationHandler(
         entry_points=[
             CommandHandler("gpt", gpt_command),
-            CallbackQueryHandler(gpt_start, pattern="^gpt_")
+            CallbackRoute({(GPT, "open"): gpt_start})
         ],
         states={
             GPT_WAITING: [
@@ -95,123 +178,259 @@ def create_gpt_conversation():
             ],
         },
         fallbacks=[
-            CommandHandler("start", start),
-            CallbackQueryHandler(menu_callback, pattern="^(gpt_finish|main_menu)$")
+            CommandHandler("start", gpt_finish),
+            CallbackRoute({(GPT, "end"): gpt_finish, (MENU, "home"): gpt_finish})
         ],
-        per_message=True,
+        name="gpt",
+        persistent=persistent,
+        conversation_timeout=CONVERSATION_TIMEOUT or None,
     )
 
-def create_personality_conversation():
+def create_personality_conversation(persistent: bool = False):
     """Создает ConversationHandler для диалога с личностью"""
     return ConversationHandler(
         entry_points=[
             CommandHandler("talk", talk_command),
-            CallbackQueryHandler(talk_command, pattern="^talk_")
+            CallbackRoute({(TALK, "open"): talk_command})
         ],
         states={
             SELECTING_PERSONALITY: [
-                CallbackQueryHandler(personality_selected, pattern="^personality_")
+                CallbackRoute({(TALK, "pick"): personality_selected})
             ],
             CHATTING_WITH_PERSONALITY: [
                 MessageHandler(filters.TEXT & ~filters.COMMAND, handle_personality_message),
-                CallbackQueryHandler(handle_personality_callback,
-                                   pattern="^(finish_talk|change_personality)$")
+                CallbackRoute({(TALK, "end"): finish_talk, (TALK, "change"): change_personality})
             ],
         },
         fallbacks=[
-            CommandHandler("start", start),
-            CallbackQueryHandler(menu_callback, pattern="^main_menu$")
+            CommandHandler("start", menu_fallback),
+            CallbackRoute({(MENU, "home"): menu_fallback})
         ],
+        name="talk",
+        persistent=persistent,
+        conversation_timeout=CONVERSATION_TIMEOUT or None,
     )
 
-def create_quiz_conversation():
+def create_quiz_conversation(persistent: bool = False):
     """Создает ConversationHandler для квиза"""
     return ConversationHandler(
         entry_points=[
             CommandHandler("quiz", quiz_command),
-            CallbackQueryHandler(quiz_command, pattern="^quiz_")
+            # Кнопка следующего вопроса несет тему и продолжает викторину после перезапуска
+            CallbackRoute({(QUIZ, "open"): quiz_command, (QUIZ, "next"): next_question})
         ],
         states={
             SELECTING_TOPIC: [
-                CallbackQueryHandler(topic_selected, pattern="^quiz_topic_")
+                CallbackRoute({(QUIZ, "topic"): topic_selected})
             ],
             ANSWERING_QUESTION: [
                 MessageHandler(filters.TEXT & ~filters.COMMAND, handle_quiz_answer),
-                CallbackQueryHandler(handle_quiz_callback,
-                                   pattern="^(quiz_next_|quiz_change_topic|quiz_finish)$")
+                CallbackRoute({
+                    (QUIZ, "ans"): answer_selected,
+                    (QUIZ, "next"): next_question,
+                    (QUIZ, "change"): change_topic,
+                    (QUIZ, "end"): finish_quiz,
+                })
             ],
         },
         fallbacks=[
-            CommandHandler("start", start),
-            CallbackQueryHandler(menu_callback, pattern="^main_menu$")
+            CommandHandler("start", menu_fallback),
+            CallbackRoute({(MENU, "home"): menu_fallback})
         ],
+        name="quiz",
+        persistent=persistent,
+        conversation_timeout=CONVERSATION_TIMEOUT or None,
     )
 
-def create_translator_conversation():
+def create_translator_conversation(persistent: bool = False):
     """Создает ConversationHandler для переводчика"""
     return ConversationHandler(
-        entry_points=[CommandHandler("translate", translate_command)],
+        entry_points=[
+            CommandHandler("translate", translate_command),
+            CallbackRoute({(TRANSLATE, "open"): translate_command})
+        ],
         states={
             SELECTING_LANGUAGE: [
-                CallbackQueryHandler(language_selected, pattern="^lang_")
+                CallbackRoute({(TRANSLATE, "lang"): language_selected})
             ],
             TRANS_WAITING: [
                 MessageHandler(filters.TEXT & ~filters.COMMAND, handle_translation_text),
-                CallbackQueryHandler(change_language, pattern="^change_lang$")
+                CallbackRoute({(TRANSLATE, "change"): change_language})
             ],
         },
         fallbacks=[
-            CallbackQueryHandler(menu_callback, pattern="^main_menu$")
+            CommandHandler("start", menu_fallback),
+            CallbackRoute({(MENU, "home"): menu_fallback})
         ],
+        name="translate",
+        persistent=persistent,
+        conversation_timeout=CONVERSATION_TIMEOUT or None,
     )
 
-def create_resume_conversation():
+def create_resume_conversation(persistent: bool = False):
     """Создает ConversationHandler для помощника по резюме"""
     return ConversationHandler(
-        entry_points=[CommandHandler("resume", resume_command)],
+        entry_points=[
+            CommandHandler("resume", resume_command),
+            CallbackRoute({(RESUME, "open"): resume_command})
+        ],
         states={
             GETTING_NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, get_name)],
             GETTING_EDUCATION: [MessageHandler(filters.TEXT & ~filters.COMMAND, get_education)],
             GETTING_EXPERIENCE: [MessageHandler(filters.TEXT & ~filters.COMMAND, get_experience)],
             GETTING_SKILLS: [MessageHandler(filters.TEXT & ~filters.COMMAND, get_skills)],
+            ConversationHandler.TIMEOUT: [TypeHandler(Update, resume_timeout)],
         },
         fallbacks=[
-            CommandHandler("start", start),
-            CallbackQueryHandler(menu_callback, pattern="^main_menu$")
+            CommandHandler("start", menu_fallback),
+            CallbackRoute({(MENU, "home"): menu_fallback})
         ],
+        name="resume",
+        persistent=persistent,
+        conversation_timeout=CONVERSATION_TIMEOUT or None,
     )
 
-def main():
-    """Основная функция запуска бота"""
-    try:
-        # Создаем приложение
-        application = Application.builder().token(TG_BOT_TOKEN).build()
+def build_application(persistence: Optional[BasePersistence] = None, workers: int = 1,
+                      updater: bool = True) -> Application:
+    """
+    Создает приложение со всеми обработчиками.
 
-        # Базовые команды
-        application.add_handler(CommandHandler("start", start))
-        application.add_handler(CommandHandler("help", help_command))
-        application.add_handler(CommandHandler("random", random_fact))
+    Args:
+        persistence: Хранилище состояния (для многопроцессного режима)
+        workers: Сколько процессов делят общий лимит исходящих запросов
+        updater: Нужен ли встроенный Updater (рабочим процессам обновления передает фронт)
+
+    Returns:
+        Настроенное приложение
+    """
+    builder = (
+        Application.builder()
+        .token(TG_BOT_TOKEN)
+        # context.user_data - компактная запись UserSession, а не словарь
+        .context_types(CONTEXT_TYPES)
+        # Все исходящие запросы идут через общий диспетчер с учетом flood control
+        .rate_limiter(OutboundRateLimiter(
+            global_per_second=OUTBOUND_GLOBAL_PER_SECOND / workers,
+            chat_per_minute=OUTBOUND_CHAT_PER_MINUTE,
+            chat_burst=OUTBOUND_CHAT_BURST,
+            group_per_minute=OUTBOUND_GROUP_PER_MINUTE,
+            max_retries=OUTBOUND_MAX_RETRIES
+        ))
+        # Разные чаты обрабатываются параллельно, обновления одного чата - по порядку
+        .concurrent_updates(PerChatUpdateProcessor(
+            concurrency=UPDATE_CONCURRENCY,
+            max_pending=UPDATE_MAX_PENDING,
+            max_queued_per_chat=UPDATE_MAX_QUEUED_PER_CHAT,
+            # Ответы групповой викторины не ждут друг друга в очереди чата
+            unordered=is_group_answer
+        ))
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+    )
+    if persistence is not None:
+        builder = builder.persistence(persistence)
+    if not updater:
+        builder = builder.updater(None)
+    application = builder.build()
 
-        # ConversationHandler
-        application.add_handler(create_gpt_conversation())
-        application.add_handler(create_personality_conversation())
-        application.add_handler(create_quiz_conversation())
-        application.add_handler(create_translator_conversation())
-        application.add_handler(create_resume_conversation())
+    # Отметка активности пользователя для вытеснения неактивных сессий
+    application.add_handler(TypeHandler(Update, touch_session), group=-1)
 
-        # Обработчики callback-запросов
-        application.add_handler(CallbackQueryHandler(random_fact_callback, pattern="^random_"))
-        application.add_handler(CallbackQueryHandler(menu_callback))
+    # Базовые команды
+    application.add_handler(CommandHandler("start", start))
+    application.add_handler(CommandHandler("help", help_command))
+    application.add_handler(CommandHandler("random", random_fact))
+
+    # Групповая викторина: ответы кнопками проверяются раньше диалогов
+    application.add_handler(CommandHandler("groupquiz", group_quiz_command))
+    application.add_handler(CommandHandler("stopquiz", stop_quiz_command))
+    application.add_handler(CommandHandler("leaderboard", leaderboard_command))
+    application.add_handler(CallbackRoute({(GROUP_QUIZ, "ans"): group_answer}))
+
+    # ConversationHandler
+    persistent = persistence is not None
+    application.add_handler(create_gpt_conversation(persistent))
+    application.add_handler(create_personality_conversation(persistent))
+    application.add_handler(create_quiz_conversation(persistent))
+    application.add_handler(create_translator_conversation(persistent))
+    application.add_handler(create_resume_conversation(persistent))
+
+    # Обработчики callback-запросов
+    application.add_handler(CallbackRoute({
+        (RANDOM, "open"): random_fact_callback,
+        (RANDOM, "more"): random_fact_callback,
+    }))
+    # Остальные и устаревшие кнопки возвращают в главное меню
+    application.add_handler(CallbackQueryHandler(menu_callback))
+
+    # Обработчик ошибок
+    application.add_error_handler(error_handler)
+    return application
+
+
+def build_sharded_application(index: int, workers: int) -> Application:
+    """Приложение рабочего процесса: состояние в общем хранилище, обновления от фронта"""
+    # Пулы предгенерации у каждого процесса свои
+    prefetch_manager.state_path = f"{PREFETCH_STATE_PATH}.{index}"
+    persistence = StorePersistence(
+        create_session_store(SESSION_STORE_URL),
+        update_interval=SESSION_FLUSH_INTERVAL
+    )
+    return build_application(persistence=persistence, workers=workers, updater=False)
+
+
+def run_sharded():
+    """Многопроцессный режим: фронт раздает обновления WORKERS рабочим процессам по chat_id"""
+    router = ShardRouter(
+        partial(build_sharded_application, workers=WORKERS),
+        workers=WORKERS,
+        queue_size=WORKER_QUEUE_SIZE
+    )
+    if BOT_MODE == "webhook":
+        server = WebhookServer(
+            host=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            path=WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET_TOKEN,
+            queue_size=WEBHOOK_QUEUE_SIZE,
+            sink=router.submit_nowait
+        )
+        asyncio.run(serve_sharded_webhook(router, server, TG_BOT_TOKEN, webhook_url=WEBHOOK_URL))
+    else:
+        asyncio.run(serve_sharded_polling(TG_BOT_TOKEN, router))
+
+
+def main():
+    """Основная функция запуска бота"""
+    try:
+        if WORKERS > 1:
+            logger.info(f"Бот запущен успешно! Режим: {BOT_MODE}, процессов: {WORKERS}")
+            run_sharded()
+            return
 
-        # Обработчик ошибок
-        application.add_error_handler(error_handler)
+        # Состояние пользователей и диалогов переживает перезапуск
+        persistence = None
+        if PERSISTENCE_PATH:
+            persistence = SQLitePersistence(PERSISTENCE_PATH, update_interval=PERSISTENCE_FLUSH_INTERVAL)
+        application = build_application(persistence=persistence)
 
         # Запуск бота
-        logger.info("Бот запущен успешно!")
-        application.run_polling()
+        logger.info(f"Бот запущен успешно! Режим: {BOT_MODE}")
+        if BOT_MODE == "webhook":
+            server = WebhookServer(
+                application,
+                host=WEBHOOK_LISTEN,
+                port=WEBHOOK_PORT,
+                path=WEBHOOK_PATH,
+                secret_token=WEBHOOK_SECRET_TOKEN,
+                queue_size=WEBHOOK_QUEUE_SIZE
+            )
+            run_webhook(application, server, webhook_url=WEBHOOK_URL, use_uvloop=WEBHOOK_UVLOOP)
+        else:
+            application.run_polling()
 
     except Exception as e:
         logger.error(f'Ошибка при запуске бота: {e}')
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
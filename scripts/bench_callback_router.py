@@ -0,0 +1,120 @@
+"""
+Сравнение стоимости маршрутизации callback-запросов: прежняя цепочка
+CallbackQueryHandler с регулярными выражениями против CallbackRoute.
+
+Обе цепочки повторяют порядок обработчиков в main.py (точки входа и состояния
+диалогов, затем общие обработчики); для каждого нажатия обработчики
+проверяются по очереди до первого совпадения, как это делает Application.
+
+Примеры:
+    python scripts/bench_callback_router.py
+    python scripts/bench_callback_router.py --presses 200000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+from telegram import CallbackQuery, Chat, Message, Update, User
+from telegram.ext import CallbackQueryHandler
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.callback_router import (  # noqa: E402
+    CallbackRoute, callback_data, parse_callback_data, MENU, RANDOM, GPT, TALK, QUIZ, TRANSLATE, RESUME
+)
+
+
+async def noop(*args):
+    return None
+
+
+# Прежние шаблоны в порядке регистрации в main.py
+LEGACY_PATTERNS = [
+    "^gpt_", "^(gpt_finish|main_menu)$",
+    "^talk_", "^personality_", "^(finish_talk|change_personality)$", "^main_menu$",
+    "^quiz_", "^quiz_topic_", "^(quiz_next_|quiz_change_topic|quiz_finish)$", "^main_menu$",
+    "^lang_", "^change_lang$", "^main_menu$",
+    "^main_menu$",
+    "^random_",
+    None,
+]
+
+ROUTE_TABLES = [
+    {(GPT, "open"): noop}, {(GPT, "end"): noop, (MENU, "home"): noop},
+    {(TALK, "open"): noop}, {(TALK, "pick"): noop}, {(TALK, "end"): noop, (TALK, "change"): noop},
+    {(MENU, "home"): noop},
+    {(QUIZ, "open"): noop, (QUIZ, "next"): noop}, {(QUIZ, "topic"): noop},
+    {(QUIZ, "ans"): noop, (QUIZ, "next"): noop, (QUIZ, "change"): noop, (QUIZ, "end"): noop}, {(MENU, "home"): noop},
+    {(TRANSLATE, "open"): noop}, {(TRANSLATE, "lang"): noop}, {(TRANSLATE, "change"): noop},
+    {(MENU, "home"): noop},
+    {(RESUME, "open"): noop}, {(MENU, "home"): noop},
+    {(RANDOM, "open"): noop, (RANDOM, "more"): noop},
+]
+
+LEGACY_PRESSES = [
+    "main_menu", "random_again", "random_fact", "gpt_interface", "gpt_finish", "talk_interface",
+    "personality_einstein", "finish_talk", "change_personality", "quiz_interface", "quiz_topic_history",
+    "quiz_next_geography", "quiz_change_topic", "quiz_finish", "lang_en", "change_lang",
+]
+
+PRESSES = [
+    callback_data(MENU, "home"), callback_data(RANDOM, "more"), callback_data(RANDOM, "open"),
+    callback_data(GPT, "open"), callback_data(GPT, "end"), callback_data(TALK, "open"),
+    callback_data(TALK, "pick", "einstein"), callback_data(TALK, "end"), callback_data(TALK, "change"),
+    callback_data(QUIZ, "open"), callback_data(QUIZ, "topic", "history"), callback_data(QUIZ, "next", "geography"),
+    callback_data(QUIZ, "change"), callback_data(QUIZ, "end"), callback_data(TRANSLATE, "lang", "en"),
+    callback_data(TRANSLATE, "change"),
+]
+
+
+def make_update(data: str) -> Update:
+    user = User(1, "bench", False)
+    message = Message(1, None, Chat(1, "private"))
+    return Update(1, callback_query=CallbackQuery("1", user, "bench", message=message, data=data))
+
+
+def dispatch(handlers, update: Update):
+    for handler in handlers:
+        result = handler.check_update(update)
+        if result is not None and result is not False:
+            return handler, result
+    return None
+
+
+def bench(name: str, handlers, updates, parse=None):
+    started = time.perf_counter()
+    for update in updates:
+        matched = dispatch(handlers, update)
+        # Прежние обработчики заново разбирали query.data
+        if parse is not None and matched is not None:
+            parse(update.callback_query.data)
+    elapsed = time.perf_counter() - started
+    print(f"{name:28} {elapsed / len(updates) * 1e6:8.2f} us/press")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark callback routing")
+    parser.add_argument("--presses", type=int, default=100_000)
+    args = parser.parse_args()
+
+    legacy_handlers = [CallbackQueryHandler(noop, pattern=pattern) for pattern in LEGACY_PATTERNS]
+    routes = [CallbackRoute(table) for table in ROUTE_TABLES] + [CallbackQueryHandler(noop)]
+
+    legacy_updates = [make_update(random.choice(LEGACY_PRESSES)) for _ in range(args.presses)]
+    updates = [make_update(random.choice(PRESSES)) for _ in range(args.presses)]
+
+    bench("regex chain", legacy_handlers, legacy_updates, parse=lambda data: data.split("_"))
+    bench("CallbackRoute", routes, updates)
+    bench("CallbackRoute (old buttons)", routes, legacy_updates)
+
+    parse_callback_data.cache_clear()
+    started = time.perf_counter()
+    for data in PRESSES * 1000:
+        parse_callback_data.__wrapped__(data)
+    print(f"{'parse without cache':28} {(time.perf_counter() - started) / (len(PRESSES) * 1000) * 1e6:8.2f} us/press")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Сравнение стоимости сохранения состояния: PicklePersistence против SQLitePersistence.
+
+Для каждого числа пользователей заполняет хранилище, затем меняет небольшую
+долю пользователей (как за один интервал update_persistence) и измеряет
+время сохранения, время старта (загрузки) и размер файла.
+
+PicklePersistence берется в лучшем для нее режиме on_flush=True: изменения
+копятся в памяти, а файл целиком переписывается один раз в flush().
+В режиме по умолчанию она переписывает файл на каждый update_user_data.
+
+Примеры:
+    python scripts/bench_persistence.py
+    python scripts/bench_persistence.py --users 10000 100000 --dirty 500
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+from telegram.ext import PicklePersistence
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.sqlite_persistence import SQLitePersistence  # noqa: E402
+
+
+def sample_user_data(user_id: int) -> dict:
+    """Типичный user_data: выбранные режимы и прогресс квиза"""
+    return {
+        "current_topic_key": random.choice(["history", "science", "sport", "art"]),
+        "quiz_score": user_id % 17,
+        "target_language": random.choice(["en", "de", "fr", "es"]),
+        "correct_answer": f"ответ {user_id}",
+    }
+
+
+async def bench_pickle(directory: str, users: int, dirty: list) -> dict:
+    path = os.path.join(directory, "state.pickle")
+    persistence = PicklePersistence(path, on_flush=True)
+    for user_id in range(users):
+        await persistence.update_user_data(user_id, sample_user_data(user_id))
+    await persistence.flush()
+
+    started = time.perf_counter()
+    for user_id in dirty:
+        await persistence.update_user_data(user_id, sample_user_data(user_id + 1))
+    await persistence.flush()
+    flush_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    await PicklePersistence(path).get_user_data()
+    load_time = time.perf_counter() - started
+    return {"flush": flush_time, "load": load_time, "size": os.path.getsize(path)}
+
+
+async def bench_sqlite(directory: str, users: int, dirty: list) -> dict:
+    path = os.path.join(directory, "state.sqlite3")
+    persistence = SQLitePersistence(path)
+    # Начальное заполнение - тоже одним пакетом, как при одном прогоне update_persistence
+    await asyncio.gather(*(
+        persistence.update_user_data(user_id, sample_user_data(user_id)) for user_id in range(users)
+    ))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        persistence.update_user_data(user_id, sample_user_data(user_id + 1)) for user_id in dirty
+    ))
+    flush_time = time.perf_counter() - started
+    await persistence.flush()
+
+    # Старт: user_data не загружается, первое обращение читает одну запись
+    started = time.perf_counter()
+    reopened = SQLitePersistence(path)
+    await reopened.get_user_data()
+    await reopened.refresh_user_data(dirty[0], {})
+    load_time = time.perf_counter() - started
+    await reopened.flush()
+
+    size = sum(os.path.getsize(f"{path}{suffix}") for suffix in ("", "-wal") if os.path.exists(f"{path}{suffix}"))
+    return {"flush": flush_time, "load": load_time, "size": size}
+
+
+async def run(user_counts: list, dirty_count: int):
+    print(f"{'users':>9} {'backend':>8} {'flush ms':>10} {'load ms':>10} {'size MB':>9}")
+    for users in user_counts:
+        dirty = random.sample(range(users), min(dirty_count, users))
+        for name, bench in (("pickle", bench_pickle), ("sqlite", bench_sqlite)):
+            with tempfile.TemporaryDirectory() as directory:
+                result = await bench(directory, users, dirty)
+            print(
+                f"{users:>9} {name:>8} {result['flush'] * 1000:>10.1f} "
+                f"{result['load'] * 1000:>10.1f} {result['size'] / 1024 / 1024:>9.1f}"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare persistence flush cost")
+    parser.add_argument("--users", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--dirty", type=int, default=1000, help="users changed between flushes")
+    args = parser.parse_args()
+    asyncio.run(run(args.users, args.dirty))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Точность и скорость проверки ответов викторины: прежнее точное сравнение
+буквы против локального разбора (services/quiz_grader.py).
+
+Корпус - JSONL с ответами пользователей: варианты вопроса, правильная буква,
+текст ответа и буква, которую пользователь имел в виду (null - ответ
+невозможно уверенно сопоставить с вариантом). Для каждого способа считается:
+    понято     - ответ распознан как задуманный вариант (или не распознан, если expected = null)
+    не понято  - задуманный вариант не распознан
+    ошибка     - распознан не тот вариант, который имел в виду пользователь
+
+Примеры:
+    python scripts/bench_quiz_grader.py
+    python scripts/bench_quiz_grader.py --threshold 0.7 --margin 0.05
+    python scripts/bench_quiz_grader.py --corpus answers.jsonl --repeat 1000 --verbose
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.quiz_grader import grade_answer  # noqa: E402
+from config import QUIZ_MATCH_THRESHOLD, QUIZ_MATCH_MARGIN  # noqa: E402
+
+DEFAULT_CORPUS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                              "data", "benchmarks", "quiz_answers.jsonl")
+
+
+def legacy_grade(reply: str, options, **kwargs):
+    """Прежняя проверка: ответ засчитывался, только если совпадал с буквой"""
+    letter = reply.upper()
+    return letter if letter in ("A", "B", "C", "D") else None
+
+
+def grader(reply: str, options, threshold: float, margin: float):
+    return grade_answer(reply, options, threshold=threshold, margin=margin).letter
+
+
+def evaluate(name: str, grade, corpus, repeat: int, verbose: bool, **kwargs):
+    understood = missed = wrong = 0
+    for row in corpus:
+        letter = grade(row["reply"], row["options"], **kwargs)
+        if letter == row["expected"]:
+            understood += 1
+        elif letter is None:
+            missed += 1
+        else:
+            wrong += 1
+        if verbose and letter != row["expected"]:
+            print(f"  {name}: {row['reply']!r} -> {letter}, ожидалось {row['expected']}")
+
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for row in corpus:
+            grade(row["reply"], row["options"], **kwargs)
+    elapsed = (time.perf_counter() - started) / (repeat * len(corpus))
+
+    total = len(corpus)
+    print(
+        f"{name:14} понято {understood / total:6.1%}  не понято {missed / total:6.1%}  "
+        f"ошибка {wrong / total:6.1%}  {elapsed * 1e6:7.2f} us/answer"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark local quiz answer grading")
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS)
+    parser.add_argument("--threshold", type=float, default=QUIZ_MATCH_THRESHOLD)
+    parser.add_argument("--margin", type=float, default=QUIZ_MATCH_MARGIN)
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--verbose", action="store_true", help="показать неверно разобранные ответы")
+    args = parser.parse_args()
+
+    with open(args.corpus, encoding="utf-8") as f:
+        corpus = [json.loads(line) for line in f if line.strip()]
+    print(f"Корпус: {len(corpus)} ответов, порог {args.threshold}, отрыв {args.margin}")
+
+    evaluate("exact letter", legacy_grade, corpus, args.repeat, args.verbose)
+    evaluate("quiz_grader", grader, corpus, args.repeat, args.verbose,
+             threshold=args.threshold, margin=args.margin)
+
+
+if __name__ == "__main__":
+    main()
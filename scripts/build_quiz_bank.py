@@ -0,0 +1,148 @@
+"""
+Офлайн-сборка банка вопросов викторины.
+
+Для каждой темы из data/prompts/quiz_topics.json запрашивает у ChatGPT вопросы
+пачками в JSON-режиме (не более --concurrency запросов одновременно), проверяет
+их, перемешивает варианты, отсеивает точные и почти одинаковые повторы и
+записывает банк в QUIZ_BANK_PATH. Бот загружает банк при старте и берет
+вопросы из него без обращения к API; темы без вопросов в банке по-прежнему
+генерируются на лету.
+
+Примеры:
+    python scripts/build_quiz_bank.py --count 300
+    python scripts/build_quiz_bank.py --topics history --count 500 --append
+    python scripts/build_quiz_bank.py --count 200 --batch 20 --concurrency 8 --output /tmp/bank.sqlite3
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import QUIZ_BANK_PATH  # noqa: E402
+from services.openai_service import OpenAIService, backend_pool  # noqa: E402
+from services.quiz_bank import QuizBankWriter  # noqa: E402
+from services.registry import registry  # noqa: E402
+
+SYSTEM_PROMPT = (
+    "Ты составляешь вопросы для викторины в Telegram-боте. Отвечай только JSON-объектом вида "
+    '{"questions": [{"question": "текст вопроса", "options": ["вариант", "вариант", "вариант", "вариант"], '
+    '"answer": "A"}]}. У каждого вопроса ровно 4 варианта, правильный ровно один, answer - его буква (A-D).'
+)
+
+BATCH_PROMPT = """Создай {count} разных вопросов средней сложности на тему «{topic}».
+Вопросы должны быть фактически точными и не повторять друг друга.{avoid}"""
+
+# Сколько уже собранных вопросов показывать модели, чтобы она их не повторяла
+AVOID_EXAMPLES = 15
+
+# Во сколько раз число запросов может превысить минимально необходимое
+# (часть вопросов отсеивается как некорректные или повторы)
+MAX_REQUEST_FACTOR = 3
+
+
+def batch_prompt(topic_name: str, count: int, writer: QuizBankWriter, topic: str) -> str:
+    existing = writer.questions[topic]
+    examples = random.sample(existing, min(AVOID_EXAMPLES, len(existing)))
+    avoid = ""
+    if examples:
+        avoid = "\nНе повторяй эти вопросы:\n" + "\n".join(f"- {text}" for text, _, _ in examples)
+    return BATCH_PROMPT.format(count=count, topic=topic_name, avoid=avoid)
+
+
+async def build_topic(writer: QuizBankWriter, topic, target: int, batch: int, concurrency: int, rng: random.Random):
+    """Собирает вопросы темы, пока их не станет target или не кончится лимит запросов"""
+    needed = target - writer.count(topic.key)
+    if needed <= 0:
+        print(f"{topic.key}: уже {writer.count(topic.key)} вопросов")
+        return
+
+    budget = math.ceil(needed / batch) * MAX_REQUEST_FACTOR
+    stats = {"requests": 0, "failed": 0, "received": 0}
+    # Вопросов, запрошенных в выполняющихся запросах: они учитываются, чтобы не запрашивать лишнее
+    in_flight = [0]
+    started = time.perf_counter()
+
+    async def worker():
+        while stats["requests"] < budget:
+            count = min(batch, target - writer.count(topic.key) - in_flight[0])
+            if count <= 0:
+                return
+            stats["requests"] += 1
+            in_flight[0] += count
+            try:
+                raw = await OpenAIService.get_chatgpt_response(
+                    batch_prompt(topic.name, count, writer, topic.key),
+                    context=SYSTEM_PROMPT,
+                    temperature=1.0,
+                    call_site="quiz_bank",
+                    response_format={"type": "json_object"}
+                )
+                items = json.loads(raw).get("questions", [])
+            except Exception as e:
+                stats["failed"] += 1
+                print(f"{topic.key}: запрос не удался: {e}", file=sys.stderr)
+                continue
+            finally:
+                in_flight[0] -= count
+
+            for item in items if isinstance(items, list) else ():
+                stats["received"] += 1
+                if writer.count(topic.key) < target:
+                    writer.add(topic.key, item, rng)
+
+    # Часть вопросов отсеивается, поэтому недостающие добираются следующими раундами
+    while writer.count(topic.key) < target and stats["requests"] < budget:
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+    print(
+        f"{topic.key}: {writer.count(topic.key)}/{target} вопросов, "
+        f"{stats['requests']} запросов ({stats['failed']} неудачных), "
+        f"получено {stats['received']}, {time.perf_counter() - started:.1f} c"
+    )
+
+
+async def run(args):
+    topics = registry.current.quiz_topics
+    keys = args.topics or list(topics)
+    unknown = [key for key in keys if key not in topics]
+    if unknown:
+        raise SystemExit(f"Неизвестные темы: {', '.join(unknown)}")
+
+    rng = random.Random(args.seed)
+    writer = QuizBankWriter(args.output, append=args.append, threshold=args.threshold)
+    try:
+        for key in keys:
+            await build_topic(writer, topics[key], args.count, args.batch, args.concurrency, rng)
+    finally:
+        await backend_pool.close()
+
+    writer.commit()
+    total = sum(len(questions) for questions in writer.questions.values())
+    print(
+        f"Банк {writer.bank_id}: {total} вопросов в {args.output}; отсеяно "
+        f"некорректных {writer.rejected}, повторов {writer.dedup.exact_duplicates}, "
+        f"почти повторов {writer.dedup.near_duplicates}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the offline quiz question bank")
+    parser.add_argument("--topics", nargs="*", help="ключи тем (по умолчанию все)")
+    parser.add_argument("--count", type=int, default=200, help="вопросов на тему")
+    parser.add_argument("--batch", type=int, default=10, help="вопросов в одном запросе")
+    parser.add_argument("--concurrency", type=int, default=4, help="одновременных запросов")
+    parser.add_argument("--threshold", type=float, default=0.6, help="порог сходства MinHash для почти повторов")
+    parser.add_argument("--append", action="store_true", help="дополнить существующий банк")
+    parser.add_argument("--output", default=QUIZ_BANK_PATH)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Нагрузочный стенд для webhook-режима: отправляет записанные обновления Telegram
+на локальный сервер бота и печатает коды ответов и задержки подтверждения.
+
+Примеры:
+    python scripts/post_updates.py --file updates.jsonl --secret $WEBHOOK_SECRET_TOKEN
+    python scripts/post_updates.py --count 5000 --chats 200 --concurrency 50
+
+Файл обновлений - JSON-массив или JSON Lines (по обновлению в строке), например
+сохраненный из getUpdates. Без --file генерируются синтетические сообщения /start.
+update_id перенумеровываются, чтобы один файл можно было прогонять многократно.
+"""
+import argparse
+import asyncio
+import json
+import time
+from collections import Counter
+from typing import List
+
+import httpx
+
+
+def load_updates(path: str) -> List[dict]:
+    with open(path, encoding="utf-8") as f:
+        content = f.read().strip()
+    if content.startswith("["):
+        return json.loads(content)
+    return [json.loads(line) for line in content.splitlines() if line.strip()]
+
+
+def synthetic_updates(count: int, chats: int) -> List[dict]:
+    updates = []
+    for i in range(count):
+        chat_id = 100000 + i % chats
+        updates.append({
+            "update_id": i,
+            "message": {
+                "message_id": i,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private", "first_name": "Load"},
+                "from": {"id": chat_id, "is_bot": False, "first_name": "Load"},
+                "text": "/start",
+                "entities": [{"type": "bot_command", "offset": 0, "length": 6}],
+            },
+        })
+    return updates
+
+
+async def post_all(url: str, secret: str, updates: List[dict], concurrency: int, repeat: int):
+    headers = {"Content-Type": "application/json"}
+    if secret:
+        headers["X-Telegram-Bot-Api-Secret-Token"] = secret
+
+    statuses: Counter = Counter()
+    latencies: List[float] = []
+    queue: asyncio.Queue = asyncio.Queue()
+    update_id = 0
+    for _ in range(repeat):
+        for update in updates:
+            queue.put_nowait({**update, "update_id": update_id})
+            update_id += 1
+
+    async def worker(client: httpx.AsyncClient):
+        while not queue.empty():
+            payload = queue.get_nowait()
+            started = time.perf_counter()
+            try:
+                response = await client.post(url, content=json.dumps(payload), headers=headers)
+                statuses[response.status_code] += 1
+            except httpx.HTTPError as e:
+                statuses[type(e).__name__] += 1
+                continue
+            latencies.append(time.perf_counter() - started)
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    started = time.perf_counter()
+    async with httpx.AsyncClient(limits=limits, timeout=30.0) as client:
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+
+    def percentile(p: float) -> float:
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000 if latencies else 0.0
+
+    total = sum(statuses.values())
+    print(f"Sent {total} updates in {elapsed:.2f}s ({total / elapsed:.0f} req/s)")
+    print(f"Statuses: {dict(statuses)}")
+    print(f"Ack latency ms: p50={percentile(0.5):.2f} p99={percentile(0.99):.2f} max={percentile(1.0):.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="POST recorded Telegram updates to the bot webhook")
+    parser.add_argument("--url", default="http://127.0.0.1:8443/telegram")
+    parser.add_argument("--secret", default="", help="X-Telegram-Bot-Api-Secret-Token")
+    parser.add_argument("--file", help="JSON array or JSON Lines with updates")
+    parser.add_argument("--count", type=int, default=1000, help="synthetic updates if no --file")
+    parser.add_argument("--chats", type=int, default=100, help="distinct chats for synthetic updates")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=1)
+    args = parser.parse_args()
+
+    updates = load_updates(args.file) if args.file else synthetic_updates(args.count, args.chats)
+    asyncio.run(post_all(args.url, args.secret, updates, args.concurrency, args.repeat))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,261 @@
+import asyncio
+import hashlib
+import logging
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+# Поддерживаемые форматы изображений (в порядке приоритета при совпадении имен)
+SUPPORTED_FORMATS = ('.jpg', '.jpeg', '.png')
+
+# Версия параметров обработки: при изменении алгоритма старые варианты не используются
+VARIANT_VERSION = 1
+
+
+@dataclass(frozen=True)
+class Asset:
+    """
+    Изображение в индексе.
+
+    Attributes:
+        name: Название изображения (без расширения)
+        source_path: Путь к исходному файлу
+        source_hash: sha256 исходного файла
+        mtime_ns: Время изменения исходного файла
+        size: Размер исходного файла
+        path: Путь к файлу для отправки (оптимизированный вариант или исходник)
+        thumbnail_path: Путь к миниатюре (None, пока она не построена)
+    """
+    name: str
+    source_path: str
+    source_hash: str
+    mtime_ns: int
+    size: int
+    path: str
+    thumbnail_path: Optional[str] = None
+
+    @property
+    def digest(self) -> str:
+        """Идентификатор содержимого, которое уходит в Telegram"""
+        if self.path == self.source_path:
+            return self.source_hash
+        # Имя варианта включает хэш исходника, версию и параметры обработки
+        return os.path.splitext(os.path.basename(self.path))[0]
+
+
+def _file_hash(path: str) -> str:
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def build_variants(source_path: str, variant_path: str, thumbnail_path: str,
+                   max_side: int, quality: int, thumbnail_side: int) -> Tuple[int, int]:
+    """
+    Строит вариант для Telegram и миниатюру (выполняется в отдельном процессе).
+
+    Изображение поворачивается по EXIF-ориентации, уменьшается до max_side по
+    большей стороне и пересжимается в прогрессивный JPEG без метаданных.
+
+    Returns:
+        Размеры варианта и миниатюры в байтах
+    """
+    # Варианты могут строить несколько процессов бота сразу - у каждого свои временные файлы
+    variant_tmp = f"{variant_path}.{os.getpid()}.tmp"
+    thumbnail_tmp = f"{thumbnail_path}.{os.getpid()}.tmp"
+
+    with Image.open(source_path) as image:
+        # Исходник уже годится для отправки как есть: JPEG нужного размера без метаданных
+        reusable = image.format == "JPEG" and max(image.size) <= max_side \
+            and not image.info.get("exif") and not image.info.get("icc_profile")
+
+        image = ImageOps.exif_transpose(image)
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+
+        variant = image.copy()
+        variant.thumbnail((max_side, max_side), Image.LANCZOS)
+        # exif не передается, поэтому метаданные в вариант не попадают
+        variant.save(variant_tmp, "JPEG", quality=quality, optimize=True, progressive=True)
+
+        thumbnail = image.copy()
+        thumbnail.thumbnail((thumbnail_side, thumbnail_side), Image.LANCZOS)
+        thumbnail.save(thumbnail_tmp, "JPEG", quality=quality, optimize=True)
+
+    # Пересжатие уже сжатого JPEG может дать файл больше исходного - тогда оставляем исходник
+    if reusable and os.path.getsize(variant_tmp) >= os.path.getsize(source_path):
+        shutil.copyfile(source_path, variant_tmp)
+
+    # Переименовываем в конце, чтобы недописанный файл не считался готовым
+    os.replace(variant_tmp, variant_path)
+    os.replace(thumbnail_tmp, thumbnail_path)
+    return os.path.getsize(variant_path), os.path.getsize(thumbnail_path)
+
+
+class AssetIndex:
+    """
+    Индекс изображений из папки с ассетами.
+
+    Папка сканируется один раз при старте, дальше get() обращается только
+    к словарю в памяти. Оптимизированные варианты строятся Pillow в пуле
+    процессов и кэшируются на диске по хэшу исходника, поэтому после
+    перезапуска повторная обработка не нужна. Опционально папка
+    периодически пересканируется, и измененные файлы обрабатываются заново.
+    """
+
+    def __init__(self, folder: str, cache_dir: str, max_side: int = 1280, quality: int = 85,
+                 thumbnail_side: int = 320, watch_interval: float = 0.0, workers: int = 2):
+        self.folder = folder
+        self.cache_dir = cache_dir
+        self.max_side = max_side
+        self.quality = quality
+        self.thumbnail_side = thumbnail_side
+        self.watch_interval = watch_interval
+        self.workers = workers
+
+        self._assets: Dict[str, Asset] = {}
+        self._scanned = False
+        self._build_task: Optional[asyncio.Task] = None
+        self._watch_task: Optional[asyncio.Task] = None
+        # Пул процессов Pillow живет вне задач сборки: при остановке он закрывается
+        # без ожидания, а не в __exit__ внутри отмененной задачи, блокируя цикл событий
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def get(self, name: str) -> Optional[Asset]:
+        if not self._scanned:
+            # Обращение до старта (например, из скрипта): сканируем синхронно
+            self.scan()
+        return self._assets.get(name)
+
+    def _variant_paths(self, source_hash: str) -> Tuple[str, str]:
+        stem = os.path.join(self.cache_dir, f"{source_hash}-v{VARIANT_VERSION}-{self.max_side}-{self.quality}")
+        return f"{stem}.jpg", f"{stem}-thumb.jpg"
+
+    def _make_asset(self, name: str, path: str, stat: os.stat_result,
+                    previous: Optional[Asset]) -> Asset:
+        unchanged = previous is not None and previous.source_path == path \
+            and previous.mtime_ns == stat.st_mtime_ns and previous.size == stat.st_size
+        if unchanged and previous.path != previous.source_path:
+            return previous
+
+        # Хэш пересчитываем только для новых или измененных файлов
+        source_hash = previous.source_hash if unchanged else _file_hash(path)
+        variant_path, thumbnail_path = self._variant_paths(source_hash)
+        if os.path.exists(variant_path) and os.path.exists(thumbnail_path):
+            return Asset(name, path, source_hash, stat.st_mtime_ns, stat.st_size, variant_path, thumbnail_path)
+        if unchanged:
+            return previous
+        return Asset(name, path, source_hash, stat.st_mtime_ns, stat.st_size, path)
+
+    def scan(self) -> Dict[str, Asset]:
+        """
+        Сканирует папку и обновляет индекс.
+
+        Returns:
+            Изображения, которые появились или изменились с прошлого сканирования
+        """
+        found: Dict[str, Tuple[str, os.stat_result]] = {}
+        try:
+            entries = sorted(os.scandir(self.folder), key=lambda entry: entry.name)
+        except OSError as e:
+            logger.error(f"Failed to scan assets in {self.folder}: {e}")
+            entries = []
+
+        for entry in entries:
+            name, ext = os.path.splitext(entry.name)
+            ext = ext.lower()
+            if ext not in SUPPORTED_FORMATS or not entry.is_file():
+                continue
+            current = found.get(name)
+            if current is None or SUPPORTED_FORMATS.index(ext) < SUPPORTED_FORMATS.index(
+                    os.path.splitext(current[0])[1].lower()):
+                found[name] = (entry.path, entry.stat())
+
+        assets = {}
+        changed = {}
+        for name, (path, stat) in found.items():
+            previous = self._assets.get(name)
+            asset = self._make_asset(name, path, stat, previous)
+            assets[name] = asset
+            if asset is not previous:
+                changed[name] = asset
+
+        # Подменяем словарь целиком: читатели никогда не видят частично обновленный индекс
+        self._assets = assets
+        self._scanned = True
+        return changed
+
+    async def start(self):
+        """Сканирует папку, строит недостающие варианты и запускает наблюдение"""
+        await asyncio.to_thread(self.scan)
+        logger.info(f"Asset index: {len(self._assets)} images")
+        # Процессы пула запускаются при первых задачах сборки
+        self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        # Пока варианты строятся, отправляются исходники - старт бота не ждет обработки
+        self._build_task = asyncio.create_task(self._build_missing(self._assets))
+
+        if self.watch_interval > 0:
+            self._watch_task = asyncio.create_task(self._watch())
+
+    async def stop(self):
+        for task in (self._build_task, self._watch_task):
+            if task is not None:
+                task.cancel()
+        self._build_task = self._watch_task = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def _build_missing(self, assets: Dict[str, Asset]):
+        pending = [asset for asset in assets.values() if asset.path == asset.source_path]
+        if not pending:
+            return
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        loop = asyncio.get_running_loop()
+        jobs = {}
+        for asset in pending:
+            variant_path, thumbnail_path = self._variant_paths(asset.source_hash)
+            jobs[asset.name] = (asset, variant_path, thumbnail_path, loop.run_in_executor(
+                self._executor, build_variants, asset.source_path, variant_path, thumbnail_path,
+                self.max_side, self.quality, self.thumbnail_side
+            ))
+
+        for name, (asset, variant_path, thumbnail_path, job) in jobs.items():
+            try:
+                variant_size, _ = await job
+            except Exception as e:
+                logger.error(f"Failed to build variants for {asset.source_path}: {e}")
+                continue
+
+            # Файл мог измениться, пока строился вариант
+            current = self._assets.get(name)
+            if current is not None and current.source_hash == asset.source_hash:
+                self._assets = {
+                    **self._assets,
+                    name: Asset(name, asset.source_path, asset.source_hash, asset.mtime_ns,
+                                asset.size, variant_path, thumbnail_path)
+                }
+            logger.info(f"Asset {name}: {asset.size} -> {variant_size} bytes")
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(self.watch_interval)
+            try:
+                changed = await asyncio.to_thread(self.scan)
+                if changed:
+                    logger.info(f"Assets changed: {', '.join(changed)}")
+                    await self._build_missing(changed)
+            except Exception as e:
+                logger.error(f"Asset watcher error: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "images": len(self._assets),
+            "optimized": sum(1 for asset in self._assets.values() if asset.path != asset.source_path),
+        }
@@ -0,0 +1,223 @@
+import logging
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, List, Optional, Set
+
+import httpx
+import openai
+
+from services.rate_limiter import parse_retry_after
+
+logger = logging.getLogger(__name__)
+
+# Окно пассивной проверки здоровья: сколько последних исходов учитывать
+HEALTH_WINDOW = 20
+# Минимум исходов в окне, прежде чем принимать решение об исключении
+HEALTH_MIN_REQUESTS = 5
+# Доля ошибок, при которой бэкенд исключается из ротации
+EJECTION_ERROR_RATE = 0.5
+# Время исключения (удваивается при повторных исключениях)
+EJECTION_BASE_TIME = 10.0
+EJECTION_MAX_TIME = 300.0
+# Пауза ключа после 429 без заголовка retry-after
+RATE_LIMIT_COOLDOWN = 1.0
+
+# Ошибки, означающие проблему на стороне бэкенда, а не в запросе
+BACKEND_ERRORS = (openai.APIConnectionError, openai.InternalServerError)
+
+
+@dataclass(frozen=True)
+class BackendConfig:
+    """
+    Настройки одного OpenAI-совместимого бэкенда.
+
+    Attributes:
+        name: Имя для логов и метрик
+        api_key: Ключ API
+        base_url: Адрес API (None - официальный OpenAI)
+        weight: Относительная емкость бэкенда
+        max_connections: Размер пула соединений
+    """
+    name: str
+    api_key: str
+    base_url: Optional[str] = None
+    weight: float = 1.0
+    max_connections: int = 100
+
+
+class Backend:
+    """Бэкенд с собственным пулом соединений и пассивной проверкой здоровья"""
+
+    def __init__(self, config: BackendConfig, timeout: float = 120.0):
+        self.config = config
+        self.name = config.name
+        self.weight = config.weight
+        self.outstanding = 0
+        self.ejected_until = 0.0
+        self.ejections = 0
+        # До какого момента ключ исчерпал квоту (429): это не сбой бэкенда, в здоровье не учитывается
+        self.limited_until = 0.0
+        self.rate_limited = 0
+        self._outcomes: Deque[bool] = deque(maxlen=HEALTH_WINDOW)
+
+        self.client = openai.AsyncOpenAI(
+            api_key=config.api_key,
+            base_url=config.base_url,
+            # Повторы выполняют rate_limiter (429) и пул (переключение бэкенда)
+            max_retries=0,
+            http_client=httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=config.max_connections,
+                    max_keepalive_connections=config.max_connections
+                ),
+                timeout=timeout
+            )
+        )
+
+    def healthy(self, now: float) -> bool:
+        return now >= self.ejected_until
+
+    def available(self, now: float) -> bool:
+        return now >= self.ejected_until and now >= self.limited_until
+
+    def cool_down(self, retry_after: Optional[float]):
+        self.rate_limited += 1
+        self.limited_until = time.monotonic() + (retry_after if retry_after is not None else RATE_LIMIT_COOLDOWN)
+
+    def load(self) -> float:
+        """Нагрузка с учетом веса: чем меньше, тем предпочтительнее бэкенд"""
+        return (self.outstanding + 1) / self.weight
+
+    def record(self, ok: bool):
+        self._outcomes.append(ok)
+        if ok:
+            if self.ejections and len(self._outcomes) == HEALTH_WINDOW and all(self._outcomes):
+                self.ejections = 0
+            return
+
+        errors = self._outcomes.count(False)
+        if len(self._outcomes) >= HEALTH_MIN_REQUESTS and errors / len(self._outcomes) >= EJECTION_ERROR_RATE:
+            self._eject()
+
+    def _eject(self):
+        ejection_time = min(EJECTION_MAX_TIME, EJECTION_BASE_TIME * 2 ** self.ejections)
+        self.ejections += 1
+        self.ejected_until = time.monotonic() + ejection_time
+        # После возвращения бэкенд оценивается заново
+        self._outcomes.clear()
+        logger.warning(f"Backend {self.name} ejected for {ejection_time:.0f}s")
+
+    async def close(self):
+        await self.client.close()
+
+
+class BackendPool:
+    """
+    Пул OpenAI-совместимых бэкендов (несколько ключей, собственные серверы).
+
+    Запрос уходит на здоровый бэкенд с наименьшим числом незавершенных
+    запросов с учетом веса. Бэкенды с высокой долей ошибок временно исключаются,
+    при ошибке соединения или 429 запрос переключается на следующий бэкенд,
+    а ключ, получивший 429, не используется до истечения retry-after.
+    """
+
+    def __init__(self, configs: List[BackendConfig]):
+        if not configs:
+            raise ValueError("Нужен хотя бы один бэкенд OpenAI")
+        self.backends = [Backend(config) for config in configs]
+
+    def pick(self, exclude: Set[str]) -> Optional[Backend]:
+        """Выбирает бэкенд с наименьшей нагрузкой"""
+        candidates = [backend for backend in self.backends if backend.name not in exclude]
+        if not candidates:
+            return None
+
+        now = time.monotonic()
+        available = [backend for backend in candidates if backend.available(now)]
+        # Если недоступны все, лучше попробовать тот, что вернется раньше, чем не пробовать вовсе
+        if not available:
+            return min(candidates, key=lambda backend: max(backend.ejected_until, backend.limited_until))
+
+        return min(available, key=Backend.load)
+
+    @asynccontextmanager
+    async def open(self, request: Callable[[openai.AsyncOpenAI], Awaitable[Any]]) -> AsyncIterator[Any]:
+        """
+        Выполняет запрос на лучшем бэкенде и удерживает его до выхода из блока.
+
+        Удобно для потоковых ответов: бэкенд считается занятым, пока поток читается.
+
+        Args:
+            request: Функция, выполняющая запрос через переданный клиент
+        """
+        tried: Set[str] = set()
+        last_error: Optional[Exception] = None
+
+        while True:
+            backend = self.pick(tried)
+            if backend is None:
+                raise last_error
+            tried.add(backend.name)
+
+            backend.outstanding += 1
+            try:
+                result = await request(backend.client)
+                break
+            except openai.APITimeoutError:
+                # Запрос мог дойти до бэкенда и уже выполняться (и оплачиваться) -
+                # повтор на другом удвоил бы его, поэтому таймаут не обходится
+                backend.outstanding -= 1
+                backend.record(False)
+                raise
+            except openai.APIConnectionError as e:
+                # Соединение не установлено или оборвано до ответа - повторяем на другом бэкенде
+                backend.outstanding -= 1
+                backend.record(False)
+                last_error = e
+                logger.warning(f"Backend {backend.name} connection error, failing over: {e}")
+            except openai.RateLimitError as e:
+                # Квота этого ключа исчерпана - другой ключ может ответить сразу.
+                # Если 429 вернули все, ошибку получает rate_limiter и повторяет с паузой
+                backend.outstanding -= 1
+                backend.cool_down(parse_retry_after(e.response.headers))
+                last_error = e
+                logger.warning(f"Backend {backend.name} rate limited, failing over")
+            except openai.InternalServerError:
+                backend.outstanding -= 1
+                backend.record(False)
+                raise
+            except BaseException:
+                backend.outstanding -= 1
+                raise
+
+        try:
+            yield result
+            backend.record(True)
+        except BACKEND_ERRORS:
+            backend.record(False)
+            raise
+        finally:
+            backend.outstanding -= 1
+
+    async def call(self, request: Callable[[openai.AsyncOpenAI], Awaitable[Any]]) -> Any:
+        """Выполняет запрос на лучшем бэкенде с переключением при ошибках соединения"""
+        async with self.open(request) as result:
+            return result
+
+    async def close(self):
+        for backend in self.backends:
+            await backend.close()
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        return {
+            backend.name: {
+                "outstanding": backend.outstanding,
+                "healthy": backend.healthy(now),
+                "ejections": backend.ejections,
+                "rate_limited": backend.rate_limited,
+            }
+            for backend in self.backends
+        }
@@ -0,0 +1,170 @@
+from functools import lru_cache
+from typing import Any, Awaitable, Callable, Dict, NamedTuple, Optional, Tuple
+
+from telegram import Update
+from telegram.ext import BaseHandler
+
+# Версия формата callback_data: кнопки старого формата разбираются по LEGACY_*
+VERSION = "1"
+SEPARATOR = ":"
+
+# Ограничение Telegram на длину callback_data (в байтах)
+MAX_CALLBACK_DATA = 64
+
+# Пространства имен кнопок
+MENU = "m"
+RANDOM = "r"
+GPT = "g"
+TALK = "t"
+QUIZ = "q"
+TRANSLATE = "l"
+RESUME = "c"
+GROUP_QUIZ = "p"
+
+
+class CallbackData(NamedTuple):
+    """Разобранная callback_data: пространство имен, действие и аргументы"""
+    namespace: str
+    action: str
+    args: Tuple[str, ...] = ()
+
+
+def callback_data(namespace: str, action: str, *args: Any) -> str:
+    """
+    Кодирует кнопку в callback_data вида "1:q:topic:history".
+
+    Args:
+        namespace: Пространство имен (MENU, QUIZ, ...)
+        action: Действие внутри пространства имен
+        *args: Аргументы обработчика (без разделителя внутри)
+
+    Returns:
+        Строка для InlineKeyboardButton.callback_data
+    """
+    data = SEPARATOR.join((VERSION, namespace, action, *map(str, args)))
+    if len(data.encode()) > MAX_CALLBACK_DATA:
+        raise ValueError(f"callback_data is longer than {MAX_CALLBACK_DATA} bytes: {data!r}")
+    return data
+
+
+class PrefixTrie:
+    """Префиксное дерево для поиска самого длинного известного префикса строки"""
+    __slots__ = ("children", "value")
+
+    def __init__(self):
+        self.children: Dict[str, "PrefixTrie"] = {}
+        self.value: Optional[Any] = None
+
+    def insert(self, prefix: str, value: Any):
+        node = self
+        for char in prefix:
+            node = node.children.setdefault(char, PrefixTrie())
+        node.value = value
+
+    def longest_prefix(self, text: str) -> Optional[Tuple[Any, int]]:
+        """Значение самого длинного префикса text и длина этого префикса"""
+        node, found = self, None
+        for index, char in enumerate(text):
+            node = node.children.get(char)
+            if node is None:
+                break
+            if node.value is not None:
+                found = (node.value, index + 1)
+        return found
+
+
+# Кнопки, отправленные до перехода на версионный формат: они остаются
+# в истории чатов, поэтому продолжают работать
+LEGACY_EXACT = {
+    "main_menu": (MENU, "home"),
+    "random_fact": (RANDOM, "open"),
+    "random_again": (RANDOM, "more"),
+    "gpt_interface": (GPT, "open"),
+    "gpt_finish": (GPT, "end"),
+    "talk_interface": (TALK, "open"),
+    "finish_talk": (TALK, "end"),
+    "change_personality": (TALK, "change"),
+    "quiz_interface": (QUIZ, "open"),
+    "quiz_change_topic": (QUIZ, "change"),
+    "quiz_finish": (QUIZ, "end"),
+    "translate_interface": (TRANSLATE, "open"),
+    "change_lang": (TRANSLATE, "change"),
+    "resume_interface": (RESUME, "open"),
+}
+
+# Кнопки с аргументом в конце: выбирается самый длинный префикс,
+# поэтому "quiz_topic_" и "quiz_next_" не путаются между собой
+LEGACY_PREFIXES = PrefixTrie()
+for _prefix, _route in (
+        ("personality_", (TALK, "pick")),
+        ("quiz_topic_", (QUIZ, "topic")),
+        ("quiz_next_", (QUIZ, "next")),
+        ("lang_", (TRANSLATE, "lang")),
+):
+    LEGACY_PREFIXES.insert(_prefix, _route)
+
+
+@lru_cache(maxsize=4096)
+def parse_callback_data(data: str) -> Optional[CallbackData]:
+    """
+    Разбирает callback_data текущего или старого формата.
+
+    Результат кэшируется: одну и ту же строку проверяют все обработчики
+    по очереди, а набор кнопок у бота ограничен.
+
+    Returns:
+        CallbackData или None, если формат не распознан
+    """
+    version, _, rest = data.partition(SEPARATOR)
+    if version == VERSION and rest:
+        namespace, _, rest = rest.partition(SEPARATOR)
+        action, _, rest = rest.partition(SEPARATOR)
+        return CallbackData(namespace, action, tuple(rest.split(SEPARATOR)) if rest else ())
+
+    route = LEGACY_EXACT.get(data)
+    if route is not None:
+        return CallbackData(*route)
+
+    found = LEGACY_PREFIXES.longest_prefix(data)
+    if found is not None:
+        (namespace, action), length = found
+        return CallbackData(namespace, action, (data[length:],))
+    return None
+
+
+RouteCallback = Callable[..., Awaitable[Any]]
+
+
+class CallbackRoute(BaseHandler[Update, Any, Any]):
+    """
+    Обработчик callback-запросов по таблице маршрутов.
+
+    Вместо цепочки CallbackQueryHandler с регулярными выражениями callback_data
+    разбирается один раз (parse_callback_data), а обработчик находится
+    по ключу (пространство имен, действие) в словаре. Аргументы кнопки
+    передаются в обработчик позиционно: callback(update, context, *args).
+
+    Работает и внутри ConversationHandler: значение обработчика - новое состояние.
+    """
+
+    def __init__(self, routes: Dict[Tuple[str, str], RouteCallback], block: bool = True):
+        # Обработчик выбирается по маршруту, общий callback не используется
+        super().__init__(self.handle_update, block=block)
+        self.routes = routes
+
+    def check_update(self, update: object) -> Optional[Tuple[RouteCallback, CallbackData]]:
+        if not isinstance(update, Update) or update.callback_query is None:
+            return None
+        data = update.callback_query.data
+        if not isinstance(data, str):
+            return None
+
+        parsed = parse_callback_data(data)
+        if parsed is None:
+            return None
+        callback = self.routes.get((parsed.namespace, parsed.action))
+        return (callback, parsed) if callback is not None else None
+
+    async def handle_update(self, update: Update, application, check_result, context):
+        callback, parsed = check_result
+        return await callback(update, context, *parsed.args)
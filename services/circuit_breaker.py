@@ -0,0 +1,190 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Deque, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# Сообщение пользователю, когда запрос к ChatGPT не выполняется из-за открытого предохранителя
+BUSY_MESSAGE = "🚦 ChatGPT сейчас перегружен. Попробуйте, пожалуйста, через минуту."
+
+# Сколько последних переходов хранить для наблюдения
+TRANSITION_HISTORY = 50
+
+
+class CircuitOpenError(Exception):
+    """Предохранитель разомкнут: запрос к API не выполняется"""
+
+
+class CircuitBreaker:
+    """
+    Предохранитель для запросов к OpenAI.
+
+    closed - запросы идут как обычно, исходы копятся в скользящем окне;
+    open - при высокой доле ошибок или медленных ответов запросы сразу
+    отклоняются с CircuitOpenError, не дожидаясь таймаутов;
+    half_open - после паузы пропускается несколько пробных запросов,
+    и по их исходу предохранитель замыкается или снова размыкается.
+
+    is_failure отделяет сбои сервиса от ошибок, которые о его здоровье
+    ничего не говорят (429, ошибка в запросе пользователя): такие исключения
+    пробрасываются, но в окне не учитываются.
+    """
+
+    def __init__(self, window: float = 60.0, min_calls: int = 10, error_rate: float = 0.5,
+                 slow_call_seconds: float = 20.0, slow_call_rate: float = 0.8,
+                 open_seconds: float = 30.0, half_open_calls: int = 3,
+                 is_failure: Optional[Callable[[Exception], bool]] = None):
+        self.window = window
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_rate = slow_call_rate
+        self.open_seconds = open_seconds
+        self.half_open_calls = half_open_calls
+        self.is_failure = is_failure or (lambda error: True)
+        self.ignored_errors = 0
+
+        self.state = CLOSED
+        self.transitions: Deque[Tuple[float, str, str]] = deque(maxlen=TRANSITION_HISTORY)
+        self._listeners: List[Callable[[str, str], None]] = []
+        # Исходы: (время, ошибка, медленный)
+        self._outcomes: Deque[Tuple[float, bool, bool]] = deque()
+        self._opened_at = 0.0
+        self._trial_calls = 0
+        self._trial_successes = 0
+
+    def add_listener(self, listener: Callable[[str, str], None]):
+        """Подписка на переходы состояния: listener(old_state, new_state)"""
+        self._listeners.append(listener)
+
+    def _transition(self, new_state: str):
+        old_state = self.state
+        if old_state == new_state:
+            return
+
+        self.state = new_state
+        self.transitions.append((time.time(), old_state, new_state))
+        logger.warning(f"Circuit breaker: {old_state} -> {new_state}")
+
+        if new_state == OPEN:
+            self._opened_at = time.monotonic()
+        elif new_state == HALF_OPEN:
+            self._trial_calls = 0
+            self._trial_successes = 0
+        elif new_state == CLOSED:
+            self._outcomes.clear()
+
+        for listener in self._listeners:
+            try:
+                listener(old_state, new_state)
+            except Exception as e:
+                logger.error(f"Circuit breaker listener error: {e}")
+
+    def is_open(self) -> bool:
+        """Разомкнут ли предохранитель (с учетом истечения паузы)"""
+        if self.state == OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+            self._transition(HALF_OPEN)
+        return self.state == OPEN
+
+    def raise_if_open(self):
+        """Быстрая проверка до постановки запроса в очередь"""
+        if self.is_open():
+            raise CircuitOpenError(BUSY_MESSAGE)
+
+    def _admit(self):
+        self.raise_if_open()
+        if self.state == HALF_OPEN:
+            if self._trial_calls >= self.half_open_calls:
+                raise CircuitOpenError(BUSY_MESSAGE)
+            self._trial_calls += 1
+
+    @asynccontextmanager
+    async def guard(self, track_latency: bool = True,
+                    timeout: Optional[float] = None) -> AsyncIterator[asyncio.Timeout]:
+        """
+        Пропускает запрос через предохранитель и учитывает его исход.
+
+        Таймаут применяется здесь, а не снаружи: внешний asyncio.wait_for
+        дошел бы сюда отменой, которая исходом не считается, и зависший
+        сервис никогда не разомкнул бы предохранитель. Истекший таймаут
+        (TimeoutError) - сбой.
+
+        Args:
+            track_latency: Учитывать ли длительность (для потоковых ответов не нужно)
+            timeout: Таймаут запроса в секундах (None - без таймаута)
+
+        Yields:
+            asyncio.Timeout: потоковый ответ снимает таймаут после первого фрагмента (reschedule(None))
+
+        Raises:
+            CircuitOpenError: если предохранитель разомкнут
+            TimeoutError: если запрос не уложился в timeout
+        """
+        self._admit()
+        started = time.monotonic()
+        try:
+            async with asyncio.timeout(timeout) as deadline:
+                yield deadline
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+            if self.is_failure(e):
+                self._record(failed=True, slow=False)
+            else:
+                self.ignored_errors += 1
+                if self.state == HALF_OPEN:
+                    self._trial_calls -= 1
+            raise
+        except BaseException:
+            # Отмененный запрос (например, проигравший страхующий) не дает пробного исхода
+            if self.state == HALF_OPEN:
+                self._trial_calls -= 1
+            raise
+        else:
+            slow = track_latency and time.monotonic() - started >= self.slow_call_seconds
+            self._record(failed=False, slow=slow)
+
+    def _record(self, failed: bool, slow: bool):
+        now = time.monotonic()
+
+        if self.state == HALF_OPEN:
+            if failed or slow:
+                self._transition(OPEN)
+            else:
+                self._trial_successes += 1
+                if self._trial_successes >= self.half_open_calls:
+                    self._transition(CLOSED)
+            return
+
+        self._outcomes.append((now, failed, slow))
+        while self._outcomes and now - self._outcomes[0][0] > self.window:
+            self._outcomes.popleft()
+
+        if self.state != CLOSED or len(self._outcomes) < self.min_calls:
+            return
+
+        total = len(self._outcomes)
+        errors = sum(1 for _, is_failed, _ in self._outcomes if is_failed)
+        slow_calls = sum(1 for _, _, is_slow in self._outcomes if is_slow)
+
+        if errors / total >= self.error_rate or slow_calls / total >= self.slow_call_rate:
+            self._transition(OPEN)
+
+    def stats(self) -> dict:
+        """Текущее состояние и история переходов"""
+        self.is_open()
+        return {
+            "state": self.state,
+            "window_calls": len(self._outcomes),
+            "window_errors": sum(1 for _, failed, _ in self._outcomes if failed),
+            "window_slow": sum(1 for _, _, slow in self._outcomes if slow),
+            "ignored_errors": self.ignored_errors,
+            "transitions": list(self.transitions),
+        }
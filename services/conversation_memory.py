@@ -0,0 +1,204 @@
+import asyncio
+import logging
+import sys
+from collections import deque
+from functools import lru_cache
+from typing import Awaitable, Callable, Deque, List, Set
+
+from services.rate_limiter import CHARS_PER_TOKEN, TOKENS_PER_MESSAGE
+from services.openai_service import OpenAIService, BACKGROUND_USER
+
+logger = logging.getLogger(__name__)
+
+# Промпт для сжатия старых реплик в краткое содержание
+SUMMARY_PROMPT = (
+    "Ты ведешь краткий конспект диалога пользователя с ассистентом. "
+    "Обнови конспект с учетом новых реплик: сохрани факты о пользователе, "
+    "его цели, договоренности и важные детали. Пиши сжато, до 150 слов, на русском языке."
+)
+
+# Доля бюджета, до которой память сжимается после превышения
+COMPACT_TARGET_RATIO = 0.5
+
+# Идущие сжатия: без ссылки задача может быть собрана сборщиком мусора до завершения
+_compaction_tasks: Set[asyncio.Task] = set()
+
+
+@lru_cache(maxsize=4096)
+def count_tokens(text: str) -> int:
+    """Оценка числа токенов в тексте (кэшируется: одни и те же реплики считаются много раз)"""
+    return TOKENS_PER_MESSAGE + len(text) // CHARS_PER_TOKEN
+
+
+class Turn:
+    """Одна реплика диалога"""
+    __slots__ = ("role", "content", "tokens")
+
+    def __init__(self, role: str, content: str):
+        self.role = role
+        self.content = content
+        self.tokens = count_tokens(content)
+
+    def __getstate__(self):
+        return self.role, self.content
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+
+class ConversationMemory:
+    """
+    Память диалога: кольцевой буфер последних реплик и краткое содержание старых.
+
+    Когда реплики не помещаются в бюджет токенов, самые старые сжимаются
+    в краткое содержание в фоне, не задерживая ответ пользователю.
+    До завершения сжатия в запрос просто попадают последние реплики в пределах бюджета.
+    """
+    __slots__ = ("turns", "summary", "token_budget", "_compacting")
+
+    def __init__(self, max_turns: int = 40, token_budget: int = 2000):
+        self.turns: Deque[Turn] = deque(maxlen=max_turns)
+        self.summary = ""
+        self.token_budget = token_budget
+        self._compacting = False
+
+    def __getstate__(self):
+        # Флаг фонового сжатия не переживает перезапуск
+        return list(self.turns), self.turns.maxlen, self.summary, self.token_budget
+
+    def __setstate__(self, state):
+        turns, max_turns, summary, token_budget = state
+        self.__init__(max_turns, token_budget)
+        self.turns.extend(turns)
+        self.summary = summary
+
+    def add(self, role: str, content: str):
+        self.turns.append(Turn(role, content))
+
+    def clear(self):
+        self.turns.clear()
+        self.summary = ""
+
+    def nbytes(self) -> int:
+        """Примерный объем памяти, занятый репликами и кратким содержанием"""
+        return sys.getsizeof(self) + sys.getsizeof(self.turns) + sys.getsizeof(self.summary) + sum(
+            sys.getsizeof(turn) + sys.getsizeof(turn.content) for turn in self.turns
+        )
+
+    def total_tokens(self) -> int:
+        return sum(turn.tokens for turn in self.turns) + (count_tokens(self.summary) if self.summary else 0)
+
+    def build_history(self, user_message: str) -> List[dict]:
+        """
+        Собирает историю для запроса: краткое содержание и свежие реплики.
+
+        История ставится после статического системного промпта (личности),
+        поэтому начало запроса остается стабильным и кэш промптов на стороне
+        OpenAI продолжает срабатывать: сначала неизменный промпт, затем редко
+        меняющееся краткое содержание, затем свежие реплики.
+
+        Args:
+            user_message: Новое сообщение пользователя (учитывается в бюджете)
+
+        Returns:
+            Список сообщений в формате chat.completions
+        """
+        history = []
+        if self.summary:
+            history.append({
+                "role": "system",
+                "content": f"Краткое содержание предыдущей части диалога:\n{self.summary}"
+            })
+
+        # Свежие реплики, которые помещаются в бюджет (от новых к старым)
+        budget = self.token_budget - count_tokens(user_message)
+        if self.summary:
+            budget -= count_tokens(self.summary)
+        recent: List[Turn] = []
+        for turn in reversed(self.turns):
+            if turn.tokens > budget:
+                break
+            budget -= turn.tokens
+            recent.append(turn)
+
+        history.extend({"role": turn.role, "content": turn.content} for turn in reversed(recent))
+        return history
+
+    def schedule_compaction(self, summarize: Callable[[str, str], Awaitable[str]]):
+        """
+        Запускает фоновое сжатие старых реплик, если память превысила бюджет.
+
+        Args:
+            summarize: Корутина summarize(previous_summary, transcript) -> новое краткое содержание
+        """
+        if self._compacting or self.total_tokens() <= self.token_budget:
+            return
+
+        # Сжимаем самые старые реплики, пока остаток не опустится до целевой доли бюджета
+        target = self.token_budget * COMPACT_TARGET_RATIO
+        remaining = self.total_tokens()
+        old_turns: List[Turn] = []
+        for turn in self.turns:
+            if remaining <= target:
+                break
+            old_turns.append(turn)
+            remaining -= turn.tokens
+
+        if not old_turns:
+            return
+
+        self._compacting = True
+        task = asyncio.create_task(self._compact(old_turns, summarize))
+        _compaction_tasks.add(task)
+        task.add_done_callback(_compaction_done)
+
+    async def _compact(self, old_turns: List[Turn], summarize: Callable[[str, str], Awaitable[str]]):
+        transcript = "\n".join(
+            f"{'Пользователь' if turn.role == 'user' else 'Ассистент'}: {turn.content}"
+            for turn in old_turns
+        )
+        try:
+            self.summary = await summarize(self.summary, transcript)
+            # Удаляем именно сжатые реплики: за время сжатия могли добавиться новые
+            compacted = {id(turn) for turn in old_turns}
+            remaining = [turn for turn in self.turns if id(turn) not in compacted]
+            self.turns.clear()
+            self.turns.extend(remaining)
+        except Exception as e:
+            logger.error(f"Conversation compaction failed: {e}")
+        finally:
+            self._compacting = False
+
+
+def _compaction_done(task: asyncio.Task):
+    _compaction_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error(f"Conversation compaction task failed: {task.exception()}")
+
+
+def get_memory(session, key: str, max_turns: int, token_budget: int) -> ConversationMemory:
+    """Возвращает память диалога из атрибута сессии пользователя, создавая её при необходимости"""
+    memory = getattr(session, key)
+    if memory is None:
+        memory = ConversationMemory(max_turns, token_budget)
+        setattr(session, key, memory)
+    return memory
+
+
+async def chatgpt_summarize(previous_summary: str, transcript: str) -> str:
+    """
+    Сжатие реплик через ChatGPT.
+
+    Запрос ставится в фоновую очередь, а не в очередь пользователя: при
+    переполнении его очереди сжатие не должно вытеснять интерактивный запрос.
+    """
+    prompt = (
+        f"Текущий конспект:\n{previous_summary or '(пусто)'}\n\n"
+        f"Новые реплики:\n{transcript}"
+    )
+    return await OpenAIService.get_chatgpt_response(
+        prompt,
+        context=SUMMARY_PROMPT,
+        call_site="summary",
+        user_id=BACKGROUND_USER
+    )
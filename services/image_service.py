@@ -1,13 +1,40 @@
+import asyncio
+import json
 import os
-from typing import Optional
+from typing import Dict, Optional
 import logging
 
+from telegram import Bot, Message
+from telegram.error import BadRequest
+
+from config import (
+    TELEGRAM_FILE_ID_CACHE_PATH,
+    ASSET_CACHE_DIR,
+    ASSET_MAX_SIDE,
+    ASSET_JPEG_QUALITY,
+    ASSET_THUMBNAIL_SIDE,
+    ASSET_WATCH_INTERVAL,
+    ASSET_WORKERS
+)
+from services.assets import AssetIndex
+
 logger = logging.getLogger(__name__)
 
 # Путь к папке с изображениями
 IMAGE_FOLDER = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'images')
 
 
+asset_index = AssetIndex(
+    IMAGE_FOLDER,
+    ASSET_CACHE_DIR,
+    max_side=ASSET_MAX_SIDE,
+    quality=ASSET_JPEG_QUALITY,
+    thumbnail_side=ASSET_THUMBNAIL_SIDE,
+    watch_interval=ASSET_WATCH_INTERVAL,
+    workers=ASSET_WORKERS
+)
+
+
 def get_image(image_name: str) -> Optional[str]:
     """
     Возвращает путь к изображению по его названию.
@@ -16,21 +43,137 @@ def get_image(image_name: str) -> Optional[str]:
         image_name: Название изображения (без расширения)
 
     Returns:
-        Полный путь к файлу изображения или None, если файл не найден
+        Путь к оптимизированному варианту (или исходнику, пока вариант
+        не построен) либо None, если изображение не найдено
+    """
+    asset = asset_index.get(image_name)
+    if asset is None:
+        logger.warning(f"Image not found: {image_name}")
+        return None
+    return asset.path
+
+
+def get_thumbnail(image_name: str) -> Optional[str]:
+    """Возвращает путь к миниатюре изображения или None, если она еще не построена"""
+    asset = asset_index.get(image_name)
+    return asset.thumbnail_path if asset is not None else None
+
+
+class FileIdCache:
     """
-    try:
-        # Поддерживаемые форматы изображений
-        supported_formats = ['.jpg', '.jpeg', '.png']
+    Постоянное соответствие "изображение + хэш содержимого" -> file_id Telegram.
+
+    После первой загрузки фото Telegram возвращает file_id, по которому то же
+    фото можно отправлять повторно без передачи файла. Запись привязана к хэшу
+    содержимого, поэтому замена файла на диске автоматически ее инвалидирует.
+    file_id действителен только для бота, который его получил, поэтому ключ
+    включает id бота.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.hits = 0
+        self.uploads = 0
+        self._entries: Dict[str, dict] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._load()
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                self._entries = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.error(f"Failed to load file_id cache: {e}")
+
+    def _save(self):
+        if not self.path:
+            return
+        try:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self._entries, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.error(f"Failed to save file_id cache: {e}")
+
+    def get(self, bot_id: int, name: str, digest: str) -> Optional[str]:
+        entry = self._entries.get(f"{bot_id}:{name}")
+        if entry is None or entry["hash"] != digest:
+            return None
+        return entry["file_id"]
 
-        # Проверяем все форматы
-        for ext in supported_formats:
-            image_path = os.path.join(IMAGE_FOLDER, f"{image_name}{ext}")
-            if os.path.exists(image_path):
-                return image_path
+    def put(self, bot_id: int, name: str, digest: str, file_id: str):
+        self._entries[f"{bot_id}:{name}"] = {"hash": digest, "file_id": file_id}
+        self._save()
 
+    def invalidate(self, bot_id: int, name: str):
+        if self._entries.pop(f"{bot_id}:{name}", None) is not None:
+            self._save()
+
+    def lock(self, name: str) -> asyncio.Lock:
+        """Блокировка на первую загрузку, чтобы параллельные запросы не загружали файл повторно"""
+        lock = self._locks.get(name)
+        if lock is None:
+            lock = self._locks[name] = asyncio.Lock()
+        return lock
+
+    def stats(self) -> dict:
+        return {"entries": len(self._entries), "hits": self.hits, "uploads": self.uploads}
+
+
+file_id_cache = FileIdCache(TELEGRAM_FILE_ID_CACHE_PATH)
+
+
+async def send_cached_photo(bot: Bot, chat_id: int, image_name: str, **kwargs) -> Optional[Message]:
+    """
+    Отправляет изображение, повторно используя file_id предыдущей загрузки.
+
+    Args:
+        bot: Бот, от имени которого отправляется фото
+        chat_id: ID чата
+        image_name: Название изображения (без расширения)
+        **kwargs: Дополнительные параметры send_photo (caption, reply_markup, ...)
+
+    Returns:
+        Отправленное сообщение или None, если изображение не найдено
+    """
+    asset = asset_index.get(image_name)
+    if asset is None:
         logger.warning(f"Image not found: {image_name}")
         return None
 
-    except Exception as e:
-        logger.error(f"Error in get_image: {e}")
-        return None
\ No newline at end of file
+    # Хэш берется из индекса: на горячем пути нет обращений к файловой системе
+    image_path, digest = asset.path, asset.digest
+
+    file_id = file_id_cache.get(bot.id, image_name, digest)
+    if file_id is not None:
+        try:
+            message = await bot.send_photo(chat_id=chat_id, photo=file_id, **kwargs)
+            file_id_cache.hits += 1
+            return message
+        except BadRequest as e:
+            # file_id мог стать недействительным - загружаем файл заново
+            logger.warning(f"Cached file_id for {image_name} rejected: {e}")
+            file_id_cache.invalidate(bot.id, image_name)
+
+    async with file_id_cache.lock(image_name):
+        # Пока ждали, файл мог загрузить параллельный запрос
+        file_id = file_id_cache.get(bot.id, image_name, digest)
+        if file_id is not None:
+            file_id_cache.hits += 1
+            return await bot.send_photo(chat_id=chat_id, photo=file_id, **kwargs)
+
+        with open(image_path, 'rb') as photo:
+            message = await bot.send_photo(chat_id=chat_id, photo=photo, **kwargs)
+        file_id_cache.uploads += 1
+
+        # Берем самый крупный вариант: именно его Telegram показывает при повторной отправке
+        if message.photo:
+            file_id_cache.put(bot.id, image_name, digest, message.photo[-1].file_id)
+        return message
@@ -0,0 +1,302 @@
+import asyncio
+import logging
+import os
+import random
+import sqlite3
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from config import LEADERBOARD_PATH
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS scores ("
+    "chat_id INTEGER NOT NULL, user_id INTEGER NOT NULL, score INTEGER NOT NULL, stamp INTEGER NOT NULL, "
+    "name TEXT NOT NULL, PRIMARY KEY (chat_id, user_id)) WITHOUT ROWID",
+)
+
+
+class _Node:
+    __slots__ = ("key", "priority", "size", "left", "right")
+
+    def __init__(self, key):
+        self.key = key
+        self.priority = random.random()
+        self.size = 1
+        self.left: Optional["_Node"] = None
+        self.right: Optional["_Node"] = None
+
+
+def _size(node: Optional[_Node]) -> int:
+    return node.size if node is not None else 0
+
+
+def _update(node: _Node) -> _Node:
+    node.size = 1 + _size(node.left) + _size(node.right)
+    return node
+
+
+def _split(node: Optional[_Node], key) -> Tuple[Optional[_Node], Optional[_Node]]:
+    """Делит дерево на ключи < key и >= key"""
+    if node is None:
+        return None, None
+    if node.key < key:
+        node.right, right = _split(node.right, key)
+        return _update(node), right
+    left, node.left = _split(node.left, key)
+    return left, _update(node)
+
+
+def _merge(left: Optional[_Node], right: Optional[_Node]) -> Optional[_Node]:
+    """Сливает деревья, если все ключи left меньше ключей right"""
+    if left is None:
+        return right
+    if right is None:
+        return left
+    if left.priority > right.priority:
+        left.right = _merge(left.right, right)
+        return _update(left)
+    right.left = _merge(left, right.left)
+    return _update(right)
+
+
+def _remove(node: Optional[_Node], key) -> Optional[_Node]:
+    if node is None:
+        return None
+    if key == node.key:
+        return _merge(node.left, node.right)
+    if key < node.key:
+        node.left = _remove(node.left, key)
+    else:
+        node.right = _remove(node.right, key)
+    return _update(node)
+
+
+class OrderStatisticTree:
+    """
+    Декартово дерево (treap) с размерами поддеревьев.
+
+    Вставка, удаление, позиция ключа и k-й ключ - O(log n) в среднем,
+    первые N ключей по порядку - O(log n + N).
+    """
+
+    def __init__(self):
+        self._root: Optional[_Node] = None
+
+    def __len__(self) -> int:
+        return _size(self._root)
+
+    def insert(self, key):
+        left, right = _split(self._root, key)
+        self._root = _merge(_merge(left, _Node(key)), right)
+
+    def remove(self, key):
+        self._root = _remove(self._root, key)
+
+    def rank(self, key) -> int:
+        """Число ключей меньше key"""
+        node, rank = self._root, 0
+        while node is not None:
+            if node.key < key:
+                rank += _size(node.left) + 1
+                node = node.right
+            else:
+                node = node.left
+        return rank
+
+    def kth(self, index: int):
+        """Ключ с номером index (с нуля) в порядке возрастания"""
+        node = self._root
+        while node is not None:
+            left = _size(node.left)
+            if index < left:
+                node = node.left
+            elif index == left:
+                return node.key
+            else:
+                index -= left + 1
+                node = node.right
+        raise IndexError(index)
+
+    def first(self, count: int) -> Iterator:
+        """Первые count ключей по возрастанию"""
+        stack, node = [], self._root
+        while count > 0 and (stack or node is not None):
+            while node is not None:
+                stack.append(node)
+                node = node.left
+            node = stack.pop()
+            yield node.key
+            count -= 1
+            node = node.right
+
+
+class Entry(NamedTuple):
+    """Участник таблицы: очки, порядковый номер последнего начисления и имя"""
+    score: int
+    stamp: int
+    name: str
+
+
+class Leaderboard:
+    """
+    Таблица очков одного чата.
+
+    Участники упорядочены по очкам, при равенстве выше тот, кто набрал
+    их раньше. Ключ в дереве - (-очки, номер начисления, user_id), поэтому
+    начисление, место участника и первые N мест - O(log n), а не сортировка
+    всех участников на каждый запрос.
+
+    Измененные записи копятся в dirty и сохраняются в LeaderboardStore пачкой.
+    """
+
+    def __init__(self, chat_id: int, entries: Optional[Dict[int, Entry]] = None):
+        self.chat_id = chat_id
+        self._entries: Dict[int, Entry] = {}
+        self._tree = OrderStatisticTree()
+        self._stamp = 0
+        self.dirty: Dict[int, Entry] = {}
+        for user_id, entry in (entries or {}).items():
+            self._entries[user_id] = entry
+            self._tree.insert((-entry.score, entry.stamp, user_id))
+            self._stamp = max(self._stamp, entry.stamp)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def add(self, user_id: int, points: int, name: str) -> Entry:
+        """Начисляет очки и возвращает обновленную запись"""
+        old = self._entries.get(user_id)
+        if old is not None:
+            self._tree.remove((-old.score, old.stamp, user_id))
+        self._stamp += 1
+        entry = Entry((old.score if old is not None else 0) + points, self._stamp, name)
+        self._entries[user_id] = entry
+        self._tree.insert((-entry.score, entry.stamp, user_id))
+        self.dirty[user_id] = entry
+        return entry
+
+    def get(self, user_id: int) -> Optional[Entry]:
+        return self._entries.get(user_id)
+
+    def rank(self, user_id: int) -> Optional[int]:
+        """Место участника, начиная с 1"""
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return None
+        return self._tree.rank((-entry.score, entry.stamp, user_id)) + 1
+
+    def at(self, place: int) -> Tuple[int, Entry]:
+        """Участник на месте place (с 1)"""
+        _, _, user_id = self._tree.kth(place - 1)
+        return user_id, self._entries[user_id]
+
+    def top(self, count: int) -> List[Tuple[int, Entry]]:
+        """Первые count мест: (user_id, запись)"""
+        return [(user_id, self._entries[user_id]) for _, _, user_id in self._tree.first(count)]
+
+    def take_dirty(self) -> Dict[int, Entry]:
+        dirty, self.dirty = self.dirty, {}
+        return dirty
+
+
+class LeaderboardStore:
+    """
+    Таблицы очков чатов в SQLite.
+
+    Таблица чата читается целиком при первом обращении, а сохраняются только
+    изменившиеся записи: flush() пишет накопленные изменения всех чатов одной
+    транзакцией. Многопроцессный режим делит чаты между процессами, поэтому
+    таблица каждого чата живет в одном процессе.
+
+    База открывается в load() при запуске бота, а не при импорте.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = asyncio.Lock()
+        self._boards: Dict[int, Leaderboard] = {}
+        self.rows_written = 0
+
+    def load(self):
+        """Открывает базу (повторный вызов ничего не делает)"""
+        if self._conn is not None:
+            return
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        for statement in SCHEMA:
+            self._conn.execute(statement)
+
+    async def get(self, chat_id: int) -> Leaderboard:
+        board = self._boards.get(chat_id)
+        if board is not None:
+            return board
+
+        self.load()
+        async with self._lock:
+            rows = await asyncio.to_thread(
+                lambda: self._conn.execute(
+                    "SELECT user_id, score, stamp, name FROM scores WHERE chat_id = ?", (chat_id,)
+                ).fetchall()
+            )
+        # Пока шел запрос, таблицу мог загрузить другой обработчик
+        board = self._boards.get(chat_id)
+        if board is None:
+            board = self._boards[chat_id] = Leaderboard(
+                chat_id, {user_id: Entry(score, stamp, name) for user_id, score, stamp, name in rows}
+            )
+        return board
+
+    async def flush(self):
+        """Сохраняет изменившиеся записи всех таблиц"""
+        taken = [(board, board.take_dirty()) for board in self._boards.values()]
+        rows = [
+            (board.chat_id, user_id, entry.score, entry.stamp, entry.name)
+            for board, dirty in taken
+            for user_id, entry in dirty.items()
+        ]
+        if not rows:
+            return
+        self.load()
+
+        def write():
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO scores (chat_id, user_id, score, stamp, name) VALUES (?, ?, ?, ?, ?)",
+                    rows
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+        try:
+            async with self._lock:
+                await asyncio.to_thread(write)
+        except Exception:
+            # Не сохраненные записи вернутся в следующий flush (если не обновились снова)
+            for board, dirty in taken:
+                for user_id, entry in dirty.items():
+                    board.dirty.setdefault(user_id, entry)
+            raise
+        self.rows_written += len(rows)
+
+    async def close(self):
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.error(f"Failed to save leaderboards: {e}")
+        if self._conn is not None:
+            async with self._lock:
+                self._conn.close()
+            self._conn = None
+
+
+leaderboard_store = LeaderboardStore(LEADERBOARD_PATH)
@@ -0,0 +1,207 @@
+import asyncio
+import logging
+import time
+from datetime import timedelta
+from typing import Optional
+
+from telegram import Bot, Message, InlineKeyboardMarkup
+from telegram.error import BadRequest, RetryAfter
+
+logger = logging.getLogger(__name__)
+
+# Максимальная длина текста одного сообщения Telegram
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+# Минимальный интервал между правками одного сообщения (секунды).
+# Telegram ограничивает частоту edit_message_text примерно одной правкой в секунду на чат.
+DEFAULT_EDIT_INTERVAL = 1.0
+
+# Текст-заглушка, который отправляется сразу, до первых токенов ответа
+DEFAULT_PLACEHOLDER = "⏳ Думаю..."
+
+
+def retry_after_seconds(error: RetryAfter) -> float:
+    """Возвращает время ожидания из RetryAfter в секундах (int или timedelta)."""
+    retry_after = error.retry_after
+    if isinstance(retry_after, timedelta):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+
+def split_message_text(text: str, limit: int = TELEGRAM_MESSAGE_LIMIT) -> int:
+    """
+    Находит позицию разрыва текста, не превышающую лимит сообщения.
+
+    Предпочитает разрыв по переводу строки, затем по пробелу.
+
+    Args:
+        text: Текст, который не помещается в одно сообщение
+        limit: Максимальная длина сообщения
+
+    Returns:
+        Индекс, по которому нужно разрезать текст
+    """
+    if len(text) <= limit:
+        return len(text)
+
+    for separator in ("\n", " "):
+        cut = text.rfind(separator, limit // 2, limit)
+        if cut != -1:
+            return cut + 1
+
+    return limit
+
+
+class LiveMessage:
+    """
+    "Живое" сообщение Telegram, которое дополняется по мере генерации ответа.
+
+    Сразу отправляет заглушку, а затем редактирует её, объединяя накопившиеся
+    фрагменты в одну правку не чаще, чем раз в edit_interval секунд.
+    Если текст превышает лимит Telegram, текущее сообщение фиксируется
+    и продолжение пишется в новое.
+    """
+
+    def __init__(
+            self,
+            bot: Bot,
+            chat_id: int,
+            reply_markup: Optional[InlineKeyboardMarkup] = None,
+            placeholder: str = DEFAULT_PLACEHOLDER,
+            edit_interval: float = DEFAULT_EDIT_INTERVAL
+    ):
+        self._bot = bot
+        self._chat_id = chat_id
+        self._reply_markup = reply_markup
+        self._placeholder = placeholder
+        self._edit_interval = edit_interval
+
+        self._message: Optional[Message] = None
+        self._text = ""
+        self._shown_text = ""
+        self._next_edit_at = 0.0
+        self._lock = asyncio.Lock()
+        self._flush_task: Optional[asyncio.Task] = None
+
+    @property
+    def started(self) -> bool:
+        return self._message is not None
+
+    async def start(self):
+        """Отправляет сообщение-заглушку"""
+        self._message = await self._bot.send_message(
+            chat_id=self._chat_id,
+            text=self._placeholder
+        )
+        self._shown_text = self._placeholder
+        # Первая правка с текстом ответа должна уйти без задержки
+        self._next_edit_at = 0.0
+
+    async def append(self, delta: str):
+        """
+        Добавляет фрагмент ответа и планирует отложенную правку сообщения.
+
+        Args:
+            delta: Очередной фрагмент текста
+        """
+        if not self.started:
+            await self.start()
+
+        self._text += delta
+
+        if len(self._text) > TELEGRAM_MESSAGE_LIMIT:
+            await self._rollover()
+
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._delayed_flush())
+
+    async def finish(self):
+        """Выводит итоговый текст и прикрепляет клавиатуру к последнему сообщению"""
+        await self._cancel_flush()
+
+        if not self.started:
+            await self.start()
+
+        text = self._text or "Пустой ответ."
+        async with self._lock:
+            await self._edit(text, reply_markup=self._reply_markup, force=True)
+
+    async def fail(self, text: str):
+        """Заменяет незаконченный ответ сообщением об ошибке"""
+        await self._cancel_flush()
+
+        if not self.started:
+            await self._bot.send_message(chat_id=self._chat_id, text=text)
+            return
+
+        async with self._lock:
+            shown = f"{self._text}\n\n{text}" if self._text else text
+            if len(shown) > TELEGRAM_MESSAGE_LIMIT:
+                shown = text
+            await self._edit(shown, force=True)
+
+    async def _cancel_flush(self):
+        if self._flush_task and not self._flush_task.done():
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+        self._flush_task = None
+
+    async def _delayed_flush(self):
+        """Ждет окончания интервала и выводит все накопленные фрагменты одной правкой"""
+        delay = self._next_edit_at - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        async with self._lock:
+            await self._edit(self._text)
+
+    async def _rollover(self):
+        """Фиксирует заполненное сообщение и переносит остаток текста в новое"""
+        async with self._lock:
+            while len(self._text) > TELEGRAM_MESSAGE_LIMIT:
+                cut = split_message_text(self._text)
+                head, self._text = self._text[:cut], self._text[cut:]
+
+                await self._edit(head, force=True)
+
+                self._message = await self._bot.send_message(
+                    chat_id=self._chat_id,
+                    text=self._text[:TELEGRAM_MESSAGE_LIMIT] or self._placeholder
+                )
+                self._shown_text = self._message.text
+                self._next_edit_at = time.monotonic() + self._edit_interval
+
+    async def _edit(self, text: str, reply_markup: Optional[InlineKeyboardMarkup] = None,
+                    force: bool = False):
+        """
+        Редактирует текущее сообщение с учетом ограничений Telegram.
+
+        Args:
+            text: Новый текст сообщения
+            reply_markup: Клавиатура (только для финальной правки)
+            force: Повторять правку после RetryAfter вместо того, чтобы пропустить её
+        """
+        if not text or (text == self._shown_text and reply_markup is None):
+            return
+
+        while True:
+            try:
+                await self._message.edit_text(text=text, reply_markup=reply_markup)
+                self._shown_text = text
+                self._next_edit_at = time.monotonic() + self._edit_interval
+                return
+            except RetryAfter as e:
+                wait = retry_after_seconds(e)
+                self._next_edit_at = time.monotonic() + wait
+                if not force:
+                    # Промежуточную правку можно пропустить: следующая принесет больше текста
+                    logger.warning(f"Live message edit throttled for {wait}s in chat {self._chat_id}")
+                    return
+                await asyncio.sleep(wait)
+            except BadRequest as e:
+                if "not modified" in str(e).lower():
+                    return
+                raise
@@ -0,0 +1,103 @@
+import asyncio
+import logging
+from typing import Awaitable, Optional, TypeVar
+
+from telegram import Bot, CallbackQuery, InlineKeyboardMarkup, Message
+from telegram.constants import ChatAction
+
+from services.image_service import send_cached_photo
+from services.outbound import BULK
+
+logger = logging.getLogger(__name__)
+
+# Telegram показывает действие ~5 секунд, поэтому повторяем его чуть чаще
+CHAT_ACTION_INTERVAL = 4.5
+# Если ответ готов быстрее (например, взят из пула), действие не отправляется вовсе
+CHAT_ACTION_DELAY = 0.5
+
+T = TypeVar("T")
+
+
+async def keep_chat_action(bot: Bot, chat_id: int, action: str = ChatAction.TYPING):
+    """Показывает действие ("печатает...") до отмены задачи"""
+    await asyncio.sleep(CHAT_ACTION_DELAY)
+    while True:
+        try:
+            # Индикатор идет фоновой полосой, чтобы не задерживать ответы
+            await bot.send_chat_action(chat_id=chat_id, action=action, rate_limit_args={"priority": BULK})
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Действие - лишь индикатор, его сбой не должен мешать ответу
+            logger.debug(f"send_chat_action failed: {e}")
+        await asyncio.sleep(CHAT_ACTION_INTERVAL)
+
+
+async def _send_photo_safely(bot: Bot, chat_id: int, image_name: str, **kwargs) -> Optional[Message]:
+    try:
+        return await send_cached_photo(bot, chat_id, image_name, **kwargs)
+    except Exception as e:
+        logger.error(f"Error sending image {image_name}: {e}")
+        return None
+
+
+async def send_photo_then(bot: Bot, chat_id: int, image_name: str, work: Awaitable[T],
+                          action: Optional[str] = ChatAction.TYPING) -> T:
+    """
+    Отправляет изображение, параллельно выполняя основную работу (запрос к ChatGPT).
+
+    Фото, индикатор действия и работа стартуют одновременно, но результат
+    возвращается только после того, как фото доставлено: следующее
+    сообщение обработчика гарантированно окажется под картинкой.
+    Сбой отправки фото только логируется; исключение работы пробрасывается
+    после завершения фото, чтобы сообщение об ошибке тоже шло следом.
+
+    Args:
+        bot: Бот
+        chat_id: ID чата
+        image_name: Название изображения (без расширения)
+        work: Корутина основной работы
+        action: Действие чата на время работы (None - не показывать)
+
+    Returns:
+        Результат работы
+    """
+    photo_task = asyncio.create_task(_send_photo_safely(bot, chat_id, image_name))
+    work_task = asyncio.ensure_future(work)
+    action_task = asyncio.create_task(keep_chat_action(bot, chat_id, action)) if action else None
+
+    try:
+        await asyncio.wait((work_task,))
+        await photo_task
+        return work_task.result()
+    finally:
+        if action_task is not None:
+            action_task.cancel()
+        # При отмене обработчика не оставляем висящих задач
+        for task in (photo_task, work_task):
+            if not task.done():
+                task.cancel()
+
+
+async def send_photo_with_text(bot: Bot, chat_id: int, image_name: str, text: str,
+                               reply_markup: Optional[InlineKeyboardMarkup] = None) -> Message:
+    """
+    Отправляет изображение с текстом и клавиатурой одним сообщением.
+
+    Вместо двух последовательных запросов (фото, затем текст) - один,
+    поэтому пользователь не ждет полный круг загрузки фото. Если фото
+    отправить не удалось, отправляется обычное текстовое сообщение.
+    """
+    message = await _send_photo_safely(bot, chat_id, image_name, caption=text, reply_markup=reply_markup)
+    if message is None:
+        message = await bot.send_message(chat_id=chat_id, text=text, reply_markup=reply_markup)
+    return message
+
+
+async def edit_callback_message(query: CallbackQuery, text: str,
+                                reply_markup: Optional[InlineKeyboardMarkup] = None):
+    """Редактирует сообщение с кнопкой: подпись у фото, текст у обычного сообщения"""
+    if query.message is not None and query.message.photo:
+        await query.edit_message_caption(caption=text, reply_markup=reply_markup)
+    else:
+        await query.edit_message_text(text=text, reply_markup=reply_markup)
@@ -0,0 +1,212 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Сколько последних задержек хранить для перцентилей
+LATENCY_SAMPLES = 1000
+
+
+@dataclass(frozen=True)
+class ModelTarget:
+    """
+    Модель в маршруте.
+
+    Attributes:
+        model: Название модели
+        timeout: Жесткий таймаут запроса к этой модели в секундах
+    """
+    model: str
+    timeout: float = 30.0
+
+
+@dataclass(frozen=True)
+class Route:
+    """
+    Маршрут для места вызова.
+
+    Attributes:
+        targets: Упорядоченный список моделей: основная, затем запасные
+        hedge_after: Через сколько секунд без ответа отправлять страхующий
+            запрос следующей модели (None - только переход при ошибке)
+    """
+    targets: Tuple[ModelTarget, ...]
+    hedge_after: Optional[float] = None
+
+
+# Таблица маршрутов по местам вызова
+ROUTES: Dict[str, Route] = {
+    "gpt": Route(
+        (ModelTarget("gpt-4o-mini", 60.0), ModelTarget("gpt-3.5-turbo", 60.0)),
+    ),
+    "personality": Route(
+        (ModelTarget("gpt-4o-mini", 60.0), ModelTarget("gpt-3.5-turbo", 60.0)),
+    ),
+    "translator": Route(
+        (ModelTarget("gpt-4o-mini", 20.0), ModelTarget("gpt-3.5-turbo", 20.0)),
+        hedge_after=4.0
+    ),
+    "random_fact": Route(
+        (ModelTarget("gpt-3.5-turbo", 15.0), ModelTarget("gpt-4o-mini", 15.0)),
+        hedge_after=3.0
+    ),
+    "quiz": Route(
+        (ModelTarget("gpt-4o-mini", 20.0), ModelTarget("gpt-3.5-turbo", 20.0)),
+        hedge_after=5.0
+    ),
+    "prefetch": Route(
+        (ModelTarget("gpt-3.5-turbo", 60.0), ModelTarget("gpt-4o-mini", 60.0)),
+    ),
+    # Офлайн-сборка банка вопросов: модели с поддержкой JSON-режима
+    "quiz_bank": Route(
+        (ModelTarget("gpt-4o-mini", 120.0), ModelTarget("gpt-4o", 120.0)),
+    ),
+    "summary": Route(
+        (ModelTarget("gpt-4o-mini", 60.0), ModelTarget("gpt-3.5-turbo", 60.0)),
+    ),
+    "resume": Route(
+        (ModelTarget("gpt-4o", 90.0), ModelTarget("gpt-4o-mini", 90.0)),
+    ),
+}
+
+# Маршрут для мест вызова, которых нет в таблице
+DEFAULT_ROUTE = Route((ModelTarget("gpt-3.5-turbo", 60.0),))
+
+
+class _RouteStats:
+    __slots__ = ("requests", "hedges", "failures", "wins", "latencies")
+
+    def __init__(self):
+        self.requests = 0
+        self.hedges = 0
+        self.failures = 0
+        self.wins: Dict[str, int] = {}
+        self.latencies: Deque[float] = deque(maxlen=LATENCY_SAMPLES)
+
+    def snapshot(self) -> dict:
+        latencies = sorted(self.latencies)
+
+        def percentile(p: float) -> float:
+            return latencies[min(len(latencies) - 1, int(len(latencies) * p))] if latencies else 0.0
+
+        return {
+            "requests": self.requests,
+            "hedges": self.hedges,
+            "failures": self.failures,
+            "win_rates": {
+                model: wins / self.requests for model, wins in self.wins.items()
+            } if self.requests else {},
+            "latency_p50": percentile(0.5),
+            "latency_p99": percentile(0.99),
+        }
+
+
+class ModelRouter:
+    """
+    Выбор модели по месту вызова со страхующими (hedged) запросами.
+
+    Если основная модель не ответила за hedge_after секунд, параллельно
+    отправляется запрос следующей модели; побеждает первый успешный ответ,
+    проигравший запрос отменяется. При ошибке сразу пробуется следующая модель.
+    """
+
+    def __init__(self, routes: Dict[str, Route], default_route: Route = DEFAULT_ROUTE):
+        self.routes = routes
+        self.default_route = default_route
+        self._stats: Dict[str, _RouteStats] = {}
+
+    def get_route(self, call_site: Optional[str]) -> Route:
+        return self.routes.get(call_site, self.default_route) if call_site else self.default_route
+
+    def models(self, call_site: Optional[str]) -> List[ModelTarget]:
+        """Упорядоченный список моделей маршрута"""
+        return list(self.get_route(call_site).targets)
+
+    def _route_stats(self, call_site: Optional[str]) -> _RouteStats:
+        key = call_site or "default"
+        stats = self._stats.get(key)
+        if stats is None:
+            stats = self._stats[key] = _RouteStats()
+        return stats
+
+    def record(self, call_site: Optional[str], model: Optional[str], latency: float):
+        """Учитывает результат запроса, выполненного в обход run (например, потокового)"""
+        stats = self._route_stats(call_site)
+        stats.requests += 1
+        if model is None:
+            stats.failures += 1
+            return
+        stats.wins[model] = stats.wins.get(model, 0) + 1
+        stats.latencies.append(latency)
+
+    def record_hedge(self, call_site: Optional[str]):
+        """Учитывает страхующий запрос, отправленный в обход run"""
+        self._route_stats(call_site).hedges += 1
+
+    async def run(self, call_site: Optional[str],
+                  request: Callable[[str, float], Awaitable[Any]]) -> Any:
+        """
+        Выполняет запрос по маршруту места вызова.
+
+        Args:
+            call_site: Место вызова
+            request: Функция, выполняющая запрос к указанной модели с ее таймаутом
+                (таймаут применяет сам запрос, чтобы его истечение учел предохранитель)
+
+        Returns:
+            Результат первого успешного запроса
+        """
+        route = self.get_route(call_site)
+        stats = self._route_stats(call_site)
+        started = time.monotonic()
+
+        pending: Dict[asyncio.Task, str] = {}
+        remaining = list(route.targets)
+        last_error: Optional[BaseException] = None
+
+        def launch():
+            target = remaining.pop(0)
+            task = asyncio.ensure_future(request(target.model, target.timeout))
+            pending[task] = target.model
+
+        launch()
+        try:
+            while pending:
+                # Таймер страховки нужен, только если есть кем страховать
+                timeout = route.hedge_after if remaining and route.hedge_after is not None else None
+                done, _ = await asyncio.wait(
+                    pending.keys(), timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+                )
+
+                if not done:
+                    stats.hedges += 1
+                    logger.info(f"Route {call_site}: hedging {pending} with {remaining[0].model}")
+                    launch()
+                    continue
+
+                for task in done:
+                    model = pending.pop(task)
+                    if task.exception() is None:
+                        self.record(call_site, model, time.monotonic() - started)
+                        return task.result()
+
+                    last_error = task.exception()
+                    logger.warning(f"Route {call_site}: model {model} failed: {last_error!r}")
+
+                # Все завершившиеся упали - переходим к следующей модели
+                if remaining and not pending:
+                    launch()
+        finally:
+            for task in pending:
+                task.cancel()
+
+        self.record(call_site, None, time.monotonic() - started)
+        raise last_error
+
+    def stats(self) -> dict:
+        """Решения маршрутизации и доли побед моделей по местам вызова"""
+        return {call_site: stats.snapshot() for call_site, stats in self._stats.items()}
@@ -1,12 +1,139 @@
 import openai
-from config import CHATGPT_TOKEN
-from typing import Optional
+from config import (
+    CHATGPT_TOKEN,
+    RESPONSE_CACHE_MAX_ENTRIES,
+    RESPONSE_CACHE_MAX_BYTES,
+    RESPONSE_CACHE_DB,
+    OPENAI_DEFAULT_RPM,
+    OPENAI_DEFAULT_TPM,
+    OPENAI_MODEL_LIMITS,
+    OPENAI_QUEUE_TIMEOUT,
+    OPENAI_MAX_CONCURRENCY,
+    OPENAI_TARGET_LATENCY,
+    SCHEDULER_CONCURRENCY,
+    SCHEDULER_MAX_QUEUE_PER_USER,
+    SCHEDULER_OVERFLOW_POLICY,
+    OPENAI_BACKENDS,
+    BREAKER_WINDOW,
+    BREAKER_MIN_CALLS,
+    BREAKER_ERROR_RATE,
+    BREAKER_SLOW_CALL_SECONDS,
+    BREAKER_SLOW_CALL_RATE,
+    BREAKER_OPEN_SECONDS,
+    BREAKER_HALF_OPEN_CALLS
+)
+from services.response_cache import (
+    ResponseCache,
+    MemoryLRUStore,
+    SQLiteCacheStore,
+    get_cache_policy,
+    make_cache_key
+)
+from services.single_flight import SingleFlight, should_coalesce
+from services.rate_limiter import (
+    RateLimiter,
+    AdaptiveConcurrency,
+    estimate_tokens,
+    parse_retry_after
+)
+from services.scheduler import FairScheduler
+from services.model_router import ModelRouter, ModelTarget, ROUTES
+from services.backend_pool import BackendPool, BackendConfig
+from services.circuit_breaker import CircuitBreaker, CircuitOpenError
+from typing import AsyncIterator, Dict, Hashable, List, Optional, Tuple
+import asyncio
 import logging
+import random
+import time
 
 logger = logging.getLogger(__name__)
 
-# Инициализация клиента OpenAI
-client = openai.AsyncOpenAI(api_key=CHATGPT_TOKEN)
+# Сколько раз повторять запрос, получивший 429, прежде чем сдаться
+MAX_RATE_LIMIT_RETRIES = 2
+
+# Пул клиентов OpenAI: по умолчанию один бэкенд с CHATGPT_TOKEN
+backend_pool = BackendPool(
+    [BackendConfig(**backend) for backend in OPENAI_BACKENDS]
+    or [BackendConfig(name="openai", api_key=CHATGPT_TOKEN)]
+)
+
+# Контроль допуска запросов: квоты RPM/TPM по моделям и адаптивный параллелизм
+rate_limiter = RateLimiter(
+    default_limits=(OPENAI_DEFAULT_RPM, OPENAI_DEFAULT_TPM),
+    model_limits={model: tuple(limits) for model, limits in OPENAI_MODEL_LIMITS.items()},
+    concurrency=AdaptiveConcurrency(
+        maximum=OPENAI_MAX_CONCURRENCY,
+        target_latency=OPENAI_TARGET_LATENCY
+    ),
+    queue_timeout=OPENAI_QUEUE_TIMEOUT
+)
+
+# Справедливая очередь запросов пользователей перед обращением к API
+scheduler = FairScheduler(
+    concurrency=SCHEDULER_CONCURRENCY,
+    max_queue_per_user=SCHEDULER_MAX_QUEUE_PER_USER,
+    overflow_policy=SCHEDULER_OVERFLOW_POLICY
+)
+
+def is_backend_failure(error: Exception) -> bool:
+    """
+    Говорит ли ошибка о сбое OpenAI.
+
+    429 повторяет rate_limiter, а 4xx - ошибка конкретного запроса
+    (например, слишком длинный промпт): они не должны размыкать
+    предохранитель для всех пользователей.
+    """
+    if isinstance(error, openai.RateLimitError):
+        return False
+    if isinstance(error, openai.APIStatusError) and 400 <= error.status_code < 500:
+        return False
+    return True
+
+
+# Предохранитель: при сбоях OpenAI запросы отклоняются сразу, без ожидания таймаутов
+circuit_breaker = CircuitBreaker(
+    window=BREAKER_WINDOW,
+    min_calls=BREAKER_MIN_CALLS,
+    error_rate=BREAKER_ERROR_RATE,
+    slow_call_seconds=BREAKER_SLOW_CALL_SECONDS,
+    slow_call_rate=BREAKER_SLOW_CALL_RATE,
+    open_seconds=BREAKER_OPEN_SECONDS,
+    half_open_calls=BREAKER_HALF_OPEN_CALLS,
+    is_failure=is_backend_failure
+)
+
+# Выбор модели по месту вызова со страхующими запросами
+model_router = ModelRouter(ROUTES)
+
+# Ключ очереди для фоновых запросов, не привязанных к пользователю
+BACKGROUND_USER = "background"
+
+
+def build_messages(prompt: str, context: Optional[str], history: Optional[List[dict]] = None) -> list:
+    """Собирает сообщения для chat.completions: системный промпт, история, запрос"""
+    messages = []
+
+    if context:
+        messages.append({"role": "system", "content": context})
+
+    if history:
+        messages.extend(history)
+
+    messages.append({"role": "user", "content": prompt})
+    return messages
+
+
+# Кэш ответов (второй уровень в SQLite включается через RESPONSE_CACHE_DB)
+response_cache = ResponseCache(
+    memory=MemoryLRUStore(
+        max_entries=RESPONSE_CACHE_MAX_ENTRIES,
+        max_bytes=RESPONSE_CACHE_MAX_BYTES
+    ),
+    persistent=SQLiteCacheStore(RESPONSE_CACHE_DB) if RESPONSE_CACHE_DB else None
+)
+
+# Объединение одинаковых одновременных запросов
+single_flight = SingleFlight()
 
 
 class OpenAIService:
@@ -14,8 +141,12 @@ class OpenAIService:
     async def get_chatgpt_response(
             prompt: str,
             context: Optional[str] = None,
-            model: str = "gpt-3.5-turbo",
-            temperature: float = 0.7
+            model: Optional[str] = None,
+            temperature: float = 0.7,
+            call_site: Optional[str] = None,
+            user_id: Optional[Hashable] = None,
+            history: Optional[List[dict]] = None,
+            response_format: Optional[dict] = None
     ) -> str:
         """
         Получает ответ от ChatGPT через новое API (асинхронная версия).
@@ -23,28 +154,285 @@ class OpenAIService:
         Args:
             prompt: Текст запроса пользователя
             context: Контекст для системы (опционально)
-            model: Модель ChatGPT
+            model: Модель ChatGPT (по умолчанию выбирается маршрутом места вызова)
             temperature: Креативность ответов
+            call_site: Место вызова, определяет маршрут, политику кэширования и вес в очереди (опционально)
+            user_id: Пользователь, в чью очередь ставится запрос (опционально)
+            history: Предыдущие сообщения диалога между контекстом и запросом (опционально)
+            response_format: Формат ответа API, например {"type": "json_object"} (опционально)
 
         Returns:
             Ответ от ChatGPT
+
+        Raises:
+            CircuitOpenError: если OpenAI недоступен и закэшированного ответа нет
         """
-        try:
-            messages = []
+        policy = get_cache_policy(call_site)
+        cache_key = make_cache_key(model or f"route:{call_site}", temperature, context, prompt, history)
+
+        cached = await response_cache.lookup(cache_key, policy)
+        if cached is not None:
+            return cached
+
+        if circuit_breaker.is_open():
+            return await OpenAIService._degraded_response(cache_key)
 
-            if context:
-                messages.append({"role": "system", "content": context})
+        messages = build_messages(prompt, context, history)
 
-            messages.append({"role": "user", "content": prompt})
+        async def fetch() -> str:
+            async with scheduler.slot(
+                    user_id if user_id is not None else BACKGROUND_USER,
+                    call_site or "default",
+                    estimate_tokens(messages)
+            ):
+                if model is None:
+                    content = await model_router.run(
+                        call_site,
+                        lambda routed_model, timeout: OpenAIService._create_completion(
+                            messages, routed_model, temperature, response_format, timeout
+                        )
+                    )
+                else:
+                    content = await OpenAIService._create_completion(messages, model, temperature, response_format)
+            await response_cache.store(cache_key, content, policy)
+            return content
 
-            response = await client.chat.completions.create(
-                model=model,
-                messages=messages,
-                temperature=temperature,
-            )
+        if should_coalesce(call_site):
+            return await single_flight.do(cache_key, fetch)
+        return await fetch()
 
-            return response.choices[0].message.content
+    @staticmethod
+    async def _degraded_response(cache_key: str) -> str:
+        """
+        Ответ при разомкнутом предохранителе: любой ранее сохраненный вариант.
 
+        Для мест вызова с пулом вариантов подходит и неполный пул.
+        """
+        values = await response_cache.get(cache_key)
+        if values:
+            return random.choice(values)
+        raise CircuitOpenError("OpenAI недоступен, закэшированного ответа нет")
+
+    @staticmethod
+    async def _create_completion(
+            messages: list,
+            model: str,
+            temperature: float,
+            response_format: Optional[dict] = None,
+            timeout: Optional[float] = None
+    ) -> str:
+        """Выполняет запрос к API без кэширования, соблюдая квоты (timeout - на сам запрос, без очереди)"""
+        try:
+            for attempt in range(MAX_RATE_LIMIT_RETRIES + 1):
+                async with rate_limiter.acquire(model, estimate_tokens(messages)) as permit:
+                    try:
+                        async with circuit_breaker.guard(timeout=timeout):
+                            response = await backend_pool.call(
+                                lambda client: client.chat.completions.create(
+                                    model=model,
+                                    messages=messages,
+                                    temperature=temperature,
+                                    response_format=response_format or openai.NOT_GIVEN,
+                                )
+                            )
+                    except openai.RateLimitError as e:
+                        permit.record_rate_limited(parse_retry_after(e.response.headers))
+                        if attempt == MAX_RATE_LIMIT_RETRIES:
+                            raise
+                        continue
+
+                    if response.usage is not None:
+                        permit.record_usage(response.usage.total_tokens)
+
+                return response.choices[0].message.content
+
+        except CircuitOpenError:
+            raise
         except Exception as e:
             logger.error(f"OpenAI API error: {e}")
-            raise Exception(f"Не удалось получить ответ от ChatGPT. Ошибка: {str(e)}")
\ No newline at end of file
+            raise Exception(f"Не удалось получить ответ от ChatGPT. Ошибка: {str(e)}")
+
+    @staticmethod
+    async def stream_chatgpt_response(
+            prompt: str,
+            context: Optional[str] = None,
+            model: Optional[str] = None,
+            temperature: float = 0.7,
+            call_site: Optional[str] = None,
+            user_id: Optional[Hashable] = None,
+            history: Optional[List[dict]] = None
+    ) -> AsyncIterator[str]:
+        """
+        Получает ответ от ChatGPT в потоковом режиме.
+
+        Args:
+            prompt: Текст запроса пользователя
+            context: Контекст для системы (опционально)
+            model: Модель ChatGPT (по умолчанию выбирается маршрутом места вызова)
+            temperature: Креативность ответов
+            call_site: Место вызова, определяет маршрут, политику кэширования и вес в очереди (опционально)
+            user_id: Пользователь, в чью очередь ставится запрос (опционально)
+            history: Предыдущие сообщения диалога между контекстом и запросом (опционально)
+
+        Yields:
+            Очередные фрагменты (дельты) ответа по мере их генерации
+
+        Raises:
+            CircuitOpenError: если OpenAI недоступен и закэшированного ответа нет
+        """
+        policy = get_cache_policy(call_site)
+        cache_key = make_cache_key(model or f"route:{call_site}", temperature, context, prompt, history)
+
+        cached = await response_cache.lookup(cache_key, policy)
+        if cached is not None:
+            yield cached
+            return
+
+        if circuit_breaker.is_open():
+            yield await OpenAIService._degraded_response(cache_key)
+            return
+
+        messages = build_messages(prompt, context, history)
+
+        parts = []
+        try:
+            async with scheduler.slot(
+                    user_id if user_id is not None else BACKGROUND_USER,
+                    call_site or "default",
+                    estimate_tokens(messages)
+            ):
+                async for delta in OpenAIService._routed_stream(messages, model, temperature, call_site):
+                    parts.append(delta)
+                    yield delta
+
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+            logger.error(f"OpenAI API streaming error: {e}")
+            raise Exception(f"Не удалось получить ответ от ChatGPT. Ошибка: {str(e)}")
+
+        await response_cache.store(cache_key, "".join(parts), policy)
+
+    @staticmethod
+    async def _routed_stream(
+            messages: list,
+            model: Optional[str],
+            temperature: float,
+            call_site: Optional[str]
+    ) -> AsyncIterator[str]:
+        """
+        Потоковый запрос по маршруту места вызова.
+
+        Таймаут модели ограничивает ожидание первого фрагмента: поток, который
+        молчит дольше, закрывается и запрос уходит следующей модели. Если
+        первого фрагмента нет через hedge_after секунд, параллельно
+        открывается поток следующей модели, и пользователю идет тот, что
+        заговорил первым. После первого фрагмента страховать поток нельзя
+        без дублирования текста, поэтому ошибка дальше уже не обходится.
+        """
+        route = model_router.get_route(call_site)
+        if model is not None:
+            targets, hedge_after = [ModelTarget(model, route.targets[0].timeout)], None
+        else:
+            targets, hedge_after = list(route.targets), route.hedge_after
+        started = time.monotonic()
+
+        pending: Dict[asyncio.Task, Tuple[str, AsyncIterator[str]]] = {}
+        last_error: Optional[BaseException] = None
+        winner = None
+
+        def launch():
+            target = targets.pop(0)
+            stream = OpenAIService._create_stream(messages, target.model, temperature, target.timeout)
+            task = asyncio.ensure_future(stream.__anext__())
+            pending[task] = (target.model, stream)
+
+        launch()
+        try:
+            while pending and winner is None:
+                timeout = hedge_after if targets and hedge_after is not None else None
+                done, _ = await asyncio.wait(pending.keys(), timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+                if not done:
+                    model_router.record_hedge(call_site)
+                    logger.info(f"Stream route {call_site}: no first fragment yet, hedging with {targets[0].model}")
+                    launch()
+                    continue
+
+                for task in done:
+                    routed_model, stream = pending.pop(task)
+                    error = task.exception()
+                    if winner is None and (error is None or isinstance(error, StopAsyncIteration)):
+                        winner = (routed_model, stream, task.result() if error is None else None)
+                        continue
+                    await stream.aclose()
+                    if error is not None and not isinstance(error, StopAsyncIteration):
+                        last_error = error
+                        logger.warning(f"Stream route {call_site}: model {routed_model} failed: {error!r}")
+
+                if winner is None and targets and not pending:
+                    launch()
+        finally:
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending.keys(), return_exceptions=True)
+            for _, stream in pending.values():
+                await stream.aclose()
+
+        if winner is None:
+            model_router.record(call_site, None, time.monotonic() - started)
+            raise last_error
+
+        routed_model, stream, first = winner
+        try:
+            if first is not None:
+                yield first
+                async for delta in stream:
+                    yield delta
+        except Exception:
+            model_router.record(call_site, None, time.monotonic() - started)
+            raise
+        finally:
+            await stream.aclose()
+        model_router.record(call_site, routed_model, time.monotonic() - started)
+
+    @staticmethod
+    async def _create_stream(
+            messages: list,
+            model: str,
+            temperature: float,
+            first_chunk_timeout: Optional[float] = None
+    ) -> AsyncIterator[str]:
+        """Выполняет потоковый запрос к API, соблюдая квоты (first_chunk_timeout - на ожидание первого фрагмента)"""
+        for attempt in range(MAX_RATE_LIMIT_RETRIES + 1):
+            async with rate_limiter.acquire(model, estimate_tokens(messages)) as permit:
+                try:
+                    async with circuit_breaker.guard(
+                            track_latency=False, timeout=first_chunk_timeout
+                    ) as deadline, backend_pool.open(
+                            lambda client: client.chat.completions.create(
+                                model=model,
+                                messages=messages,
+                                temperature=temperature,
+                                stream=True,
+                                stream_options={"include_usage": True},
+                            )
+                    ) as stream:
+                        async for chunk in stream:
+                            # Дальше длина ответа не ограничена: генерация идет, сервис жив
+                            deadline.reschedule(None)
+                            permit.record_first_chunk()
+                            # Последний фрагмент содержит только usage
+                            if chunk.usage is not None:
+                                permit.record_usage(chunk.usage.total_tokens)
+                            if not chunk.choices:
+                                continue
+                            delta = chunk.choices[0].delta.content
+                            if delta:
+                                yield delta
+                except openai.RateLimitError as e:
+                    permit.record_rate_limited(parse_retry_after(e.response.headers))
+                    if attempt == MAX_RATE_LIMIT_RETRIES:
+                        raise
+                    continue
+            return
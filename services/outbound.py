@@ -0,0 +1,278 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import deque
+from typing import Any, Callable, Coroutine, Deque, Dict, List, Optional, Tuple, Union
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from services.live_message import retry_after_seconds
+from services.rate_limiter import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Полосы приоритета: интерактивные ответы обгоняют фоновые отправки
+INTERACTIVE = 0
+BULK = 1
+LANE_NAMES = {INTERACTIVE: "interactive", BULK: "bulk"}
+
+# Правки, из которых в очереди важна только последняя: более ранние поглощаются
+MERGEABLE_ENDPOINTS = frozenset({"editMessageText", "editMessageCaption", "editMessageReplyMarkup"})
+
+# Служебные действия чата: лимиты сообщений чата на них не распространяются
+CHAT_ACTION_ENDPOINTS = frozenset({"sendChatAction"})
+
+# Сколько последних ожиданий хранить для перцентилей
+WAIT_SAMPLES = 1000
+
+JSONResult = Union[bool, Dict[str, Any], List[Dict[str, Any]]]
+
+
+def _is_message_endpoint(endpoint: str) -> bool:
+    """Запросы, которые создают или меняют сообщения и учитываются в лимитах Telegram"""
+    return endpoint.startswith(("send", "edit", "copy", "forward")) and endpoint not in CHAT_ACTION_ENDPOINTS
+
+
+class _ChatState:
+    """Корзина, пауза после RetryAfter и очередность отправок одного чата"""
+    __slots__ = ("bucket", "lock", "paused_until")
+
+    def __init__(self, bucket: TokenBucket):
+        self.bucket = bucket
+        # asyncio.Lock выдается в порядке очереди: сообщения чата уходят в порядке вызова
+        self.lock = asyncio.Lock()
+        self.paused_until = 0.0
+
+    def idle(self) -> bool:
+        return not self.lock.locked() and self.bucket.tokens >= self.bucket.capacity \
+            and self.paused_until <= time.monotonic()
+
+
+class _PendingEdit:
+    """Правка, еще не отправленная в Telegram; более поздняя правка подменяет ее аргументы"""
+    __slots__ = ("callback", "args", "kwargs", "task", "started")
+
+    def __init__(self, callback, args, kwargs):
+        self.callback = callback
+        self.args = args
+        self.kwargs = kwargs
+        self.task: Optional[asyncio.Task] = None
+        self.started = False
+
+
+class OutboundRateLimiter(BaseRateLimiter[dict]):
+    """
+    Центральный диспетчер исходящих запросов бота с учетом flood control Telegram.
+
+    Подключается через Application.builder().rate_limiter(), поэтому через него
+    проходят все вызовы context.bot, reply_text и edit_message_text обработчиков.
+
+    - общая корзина (~30 сообщений в секунду на бота) раздается по полосам
+      приоритета: интерактивные ответы раньше фоновых;
+    - корзины на личный чат и на группу (~20 сообщений в минуту);
+    - сообщения одного чата отправляются строго по очереди;
+    - RetryAfter приостанавливает чат (или всего бота) на указанное время,
+      после чего запрос повторяется;
+    - несколько ожидающих правок одного сообщения схлопываются в одну
+      последнюю, все вызывающие получают ее результат.
+
+    Приоритет задается через rate_limit_args={"priority": BULK}.
+    """
+
+    def __init__(self, global_per_second: float = 30.0, chat_per_minute: float = 60.0,
+                 chat_burst: int = 3, group_per_minute: float = 20.0, max_retries: int = 3,
+                 max_chats: int = 10000):
+        self.chat_per_minute = chat_per_minute
+        self.chat_burst = chat_burst
+        self.group_per_minute = group_per_minute
+        self.max_retries = max_retries
+        self.max_chats = max_chats
+
+        self._global = TokenBucket(global_per_second * 60, capacity=global_per_second)
+        self._global_paused_until = 0.0
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._sequence = itertools.count()
+        self._dispatcher: Optional[asyncio.Task] = None
+
+        self._chats: Dict[Union[int, str], _ChatState] = {}
+        self._pending_edits: Dict[tuple, _PendingEdit] = {}
+
+        self.sent = 0
+        self.merged = 0
+        self.retried = 0
+        self._waits: Dict[int, Deque[float]] = {lane: deque(maxlen=WAIT_SAMPLES) for lane in LANE_NAMES}
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            self._dispatcher = None
+
+    # Корзины чатов
+
+    def _chat_state(self, chat_id: Union[int, str]) -> _ChatState:
+        state = self._chats.get(chat_id)
+        if state is None:
+            if len(self._chats) >= self.max_chats:
+                # Забываем чаты, корзины которых давно полны
+                for key in [key for key, chat in self._chats.items() if chat.idle()]:
+                    del self._chats[key]
+
+            # Отрицательный id или @username - группа или канал
+            is_group = isinstance(chat_id, str) or chat_id < 0
+            per_minute = self.group_per_minute if is_group else self.chat_per_minute
+            state = self._chats[chat_id] = _ChatState(
+                TokenBucket(per_minute, capacity=min(self.chat_burst, per_minute))
+            )
+        return state
+
+    @staticmethod
+    async def _wait_chat(state: _ChatState):
+        while True:
+            delay = max(state.bucket.time_until(1), state.paused_until - time.monotonic())
+            if delay <= 0:
+                state.bucket.consume(1)
+                return
+            await asyncio.sleep(delay)
+
+    # Общая корзина с полосами приоритета
+
+    async def _wait_global(self, priority: int):
+        started = time.monotonic()
+        if not self._waiters and self._global_paused_until <= started and self._global.time_until(1) == 0:
+            self._global.consume(1)
+        else:
+            future = asyncio.get_running_loop().create_future()
+            heapq.heappush(self._waiters, (priority, next(self._sequence), future))
+            if self._dispatcher is None or self._dispatcher.done():
+                self._dispatcher = asyncio.create_task(self._dispatch())
+            await future
+        self._waits[priority].append(time.monotonic() - started)
+
+    async def _dispatch(self):
+        """Выдает токены общей корзины ожидающим по приоритету, затем по порядку прихода"""
+        while self._waiters:
+            delay = max(self._global.time_until(1), self._global_paused_until - time.monotonic())
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+
+            _, _, future = heapq.heappop(self._waiters)
+            # Отмененные ожидающие токен не тратят
+            if not future.done():
+                self._global.consume(1)
+                future.set_result(None)
+
+    # Обработка запроса
+
+    async def process_request(
+            self,
+            callback: Callable[..., Coroutine[Any, Any, JSONResult]],
+            args: Any,
+            kwargs: Dict[str, Any],
+            endpoint: str,
+            data: Dict[str, Any],
+            rate_limit_args: Optional[dict]
+    ) -> JSONResult:
+        priority = (rate_limit_args or {}).get("priority", INTERACTIVE)
+        chat_id = data.get("chat_id")
+        if isinstance(chat_id, str) and chat_id.lstrip("-").isdigit():
+            chat_id = int(chat_id)
+
+        # getUpdates, answerCallbackQuery и прочие служебные запросы не ограничиваем
+        if endpoint in CHAT_ACTION_ENDPOINTS:
+            return await self._send(None, BULK, callback, args, kwargs)
+        if not _is_message_endpoint(endpoint):
+            return await callback(*args, **kwargs)
+
+        state = self._chat_state(chat_id) if chat_id is not None else None
+
+        if endpoint in MERGEABLE_ENDPOINTS:
+            merge_key = (endpoint, chat_id, data.get("message_id"), data.get("inline_message_id"))
+            edit = self._pending_edits.get(merge_key)
+            if edit is not None and not edit.started:
+                # Предыдущая правка еще ждет очереди - отправим вместо нее эту
+                edit.callback, edit.args, edit.kwargs = callback, args, kwargs
+                self.merged += 1
+            else:
+                edit = self._pending_edits[merge_key] = _PendingEdit(callback, args, kwargs)
+                # Правка выполняется отдельной задачей: отмена одного из вызывающих
+                # не должна отменять правку, результат которой ждут остальные
+                edit.task = asyncio.create_task(self._send_edit(merge_key, edit, state, priority))
+            return await asyncio.shield(edit.task)
+
+        return await self._send(state, priority, callback, args, kwargs)
+
+    async def _send_edit(self, merge_key: tuple, edit: _PendingEdit,
+                         state: Optional[_ChatState], priority: int) -> JSONResult:
+        def take():
+            edit.started = True
+            if self._pending_edits.get(merge_key) is edit:
+                del self._pending_edits[merge_key]
+            return edit.callback, edit.args, edit.kwargs
+
+        try:
+            return await self._send(state, priority, None, None, None, take=take)
+        finally:
+            if not edit.started:
+                take()
+
+    async def _send(self, state: Optional[_ChatState], priority: int, callback, args, kwargs,
+                    take: Optional[Callable[[], tuple]] = None) -> JSONResult:
+        if state is None:
+            return await self._call(None, priority, callback, args, kwargs, take)
+
+        async with state.lock:
+            await self._wait_chat(state)
+            return await self._call(state, priority, callback, args, kwargs, take)
+
+    async def _call(self, state: Optional[_ChatState], priority: int, callback, args, kwargs,
+                    take: Optional[Callable[[], tuple]]) -> JSONResult:
+        await self._wait_global(priority)
+        if take is not None:
+            # Аргументы правки фиксируются только сейчас: до этого их могла подменить более новая
+            callback, args, kwargs = take()
+
+        for attempt in range(self.max_retries + 1):
+            try:
+                result = await callback(*args, **kwargs)
+                self.sent += 1
+                return result
+            except RetryAfter as e:
+                if attempt == self.max_retries:
+                    raise
+
+                delay = retry_after_seconds(e)
+                self.retried += 1
+                logger.warning(f"Flood control: retry after {delay}s (chat scoped: {state is not None})")
+                paused_until = time.monotonic() + delay
+                if state is not None:
+                    state.paused_until = paused_until
+                    await self._wait_chat(state)
+                else:
+                    self._global_paused_until = paused_until
+                    await asyncio.sleep(delay)
+                await self._wait_global(priority)
+
+    def stats(self) -> dict:
+        """Отправлено, схлопнуто правок, повторов после RetryAfter и ожидание по полосам"""
+        lanes = {}
+        for lane, waits in self._waits.items():
+            ordered = sorted(waits)
+            lanes[LANE_NAMES[lane]] = {
+                "queued": sum(1 for priority, _, future in self._waiters if priority == lane and not future.done()),
+                "wait_avg": sum(ordered) / len(ordered) if ordered else 0.0,
+                "wait_p95": ordered[int(len(ordered) * 0.95)] if ordered else 0.0,
+            }
+        return {
+            "sent": self.sent,
+            "merged_edits": self.merged,
+            "retried": self.retried,
+            "chats": len(self._chats),
+            "lanes": lanes,
+        }
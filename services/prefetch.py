@@ -0,0 +1,197 @@
+import asyncio
+import json
+import logging
+import os
+import random
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from config import PREFETCH_STATE_PATH, PREFETCH_MAX_CONCURRENCY
+
+logger = logging.getLogger(__name__)
+
+# Пауза после неудачной генерации, чтобы не долбить API при сбоях (секунды)
+REFILL_ERROR_BACKOFF = 30.0
+
+
+class PrefetchPool:
+    """
+    Ограниченная очередь заранее сгенерированного контента.
+
+    Когда число элементов опускается ниже low_watermark, в фоне запускается
+    пополнение до high_watermark не более чем concurrency параллельными запросами.
+    """
+
+    def __init__(
+            self,
+            name: str,
+            producer: Callable[[], Awaitable[Any]],
+            low_watermark: int = 5,
+            high_watermark: int = 20,
+            concurrency: int = 1
+    ):
+        if not 0 <= low_watermark < high_watermark:
+            raise ValueError("low_watermark должен быть меньше high_watermark")
+
+        self.name = name
+        self.producer = producer
+        self.low_watermark = low_watermark
+        self.high_watermark = high_watermark
+        self.concurrency = concurrency
+
+        self.hits = 0
+        self.misses = 0
+        self._items: deque = deque(maxlen=high_watermark)
+        # Недавно выданные элементы - запас на случай недоступности API
+        self._served: deque = deque(maxlen=high_watermark)
+        self._refill_task: Optional[asyncio.Task] = None
+        self._manager: Optional["PrefetchManager"] = None
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def pop(self) -> Optional[Any]:
+        """
+        Забирает готовый элемент из пула.
+
+        Returns:
+            Элемент или None, если пул пуст (тогда нужна генерация на лету)
+        """
+        item = self._items.popleft() if self._items else None
+        if item is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self._served.append(item)
+
+        self.maybe_refill()
+        return item
+
+    def pop_stale(self) -> Optional[Any]:
+        """Возвращает один из ранее выданных элементов (деградация при сбое API)"""
+        return random.choice(self._served) if self._served else None
+
+    def maybe_refill(self):
+        """Запускает фоновое пополнение, если пул опустился ниже нижней границы"""
+        if self._manager is None or not self._manager.running:
+            return
+        if len(self._items) >= self.low_watermark:
+            return
+        if self._refill_task is not None and not self._refill_task.done():
+            return
+
+        self._refill_task = asyncio.create_task(self._refill())
+
+    async def _refill(self):
+        """Пополняет пул до верхней границы"""
+        async def worker():
+            while len(self._items) + in_progress[0] < self.high_watermark:
+                in_progress[0] += 1
+                try:
+                    async with self._manager.semaphore:
+                        item = await self.producer()
+                    self._items.append(item)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.warning(f"Prefetch pool {self.name}: producer failed: {e}")
+                    await asyncio.sleep(REFILL_ERROR_BACKOFF)
+                finally:
+                    in_progress[0] -= 1
+
+        in_progress = [0]
+        await asyncio.gather(*(worker() for _ in range(self.concurrency)))
+        logger.info(f"Prefetch pool {self.name} refilled to {len(self._items)} items")
+
+    def cancel(self):
+        if self._refill_task is not None:
+            self._refill_task.cancel()
+
+    def dump(self) -> list:
+        return list(self._items)
+
+    def load(self, items: list):
+        self._items.extend(items[:self.high_watermark - len(self._items)])
+
+
+class PrefetchManager:
+    """
+    Набор пулов предгенерированного контента.
+
+    Общий семафор ограничивает число одновременных фоновых запросов
+    по всем пулам, чтобы холодный старт не создавал всплеск нагрузки на API.
+    Содержимое пулов сохраняется в файл при остановке и загружается при старте.
+    """
+
+    def __init__(self, state_path: str, max_concurrency: int = 2):
+        self.state_path = state_path
+        self.max_concurrency = max_concurrency
+        self.pools: Dict[str, PrefetchPool] = {}
+        self.semaphore: Optional[asyncio.Semaphore] = None
+        self.running = False
+
+    def add_pool(self, pool: PrefetchPool) -> PrefetchPool:
+        """Регистрирует пул"""
+        pool._manager = self
+        self.pools[pool.name] = pool
+        return pool
+
+    async def start(self):
+        """Загружает сохраненные пулы и запускает их пополнение"""
+        self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        self.running = True
+        self._load_state()
+
+        for pool in self.pools.values():
+            pool.maybe_refill()
+
+        logger.info(f"Prefetch started: { {name: len(pool) for name, pool in self.pools.items()} }")
+
+    async def stop(self):
+        """Останавливает пополнение и сохраняет пулы на диск"""
+        self.running = False
+        for pool in self.pools.values():
+            pool.cancel()
+        self._save_state()
+
+    def stats(self) -> dict:
+        return {
+            name: {"size": len(pool), "hits": pool.hits, "misses": pool.misses}
+            for name, pool in self.pools.items()
+        }
+
+    def _load_state(self):
+        if not self.state_path or not os.path.exists(self.state_path):
+            return
+
+        try:
+            with open(self.state_path, encoding="utf-8") as f:
+                state = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.error(f"Failed to load prefetch state: {e}")
+            return
+
+        for name, items in state.items():
+            pool = self.pools.get(name)
+            if pool is not None:
+                pool.load(items)
+
+    def _save_state(self):
+        if not self.state_path:
+            return
+
+        try:
+            directory = os.path.dirname(self.state_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+
+            # Пишем во временный файл и атомарно подменяем, чтобы не потерять пулы при сбое
+            tmp_path = f"{self.state_path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({name: pool.dump() for name, pool in self.pools.items()}, f, ensure_ascii=False)
+            os.replace(tmp_path, self.state_path)
+        except OSError as e:
+            logger.error(f"Failed to save prefetch state: {e}")
+
+
+prefetch_manager = PrefetchManager(PREFETCH_STATE_PATH, max_concurrency=PREFETCH_MAX_CONCURRENCY)
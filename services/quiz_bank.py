@@ -0,0 +1,363 @@
+import hashlib
+import json
+import logging
+import os
+import random
+import re
+import sqlite3
+import uuid
+from collections import defaultdict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from config import QUIZ_BANK_PATH
+
+logger = logging.getLogger(__name__)
+
+OPTION_LETTERS = "ABCD"
+# ChatGPT иногда пишет кириллические А, В, С вместо похожих латинских букв
+CYRILLIC_TO_LATIN = str.maketrans("АВС", "ABC")
+
+MAX_QUESTION_LENGTH = 400
+MAX_OPTION_LENGTH = 150
+
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS questions ("
+    "topic TEXT NOT NULL, idx INTEGER NOT NULL, question TEXT NOT NULL, options TEXT NOT NULL, "
+    "answer TEXT NOT NULL, fingerprint BLOB NOT NULL, PRIMARY KEY (topic, idx)) WITHOUT ROWID",
+)
+
+# Сколько случайных проб делать, прежде чем искать непросмотренный вопрос по битовой карте
+SAMPLE_PROBES = 8
+
+# MinHash: 64 перестановки в 16 полосах по 4 строки. Пара попадает в кандидаты,
+# если совпала хотя бы одна полоса (вероятность ~50% при сходстве 0.5, ~98% при 0.8)
+MINHASH_PERMUTATIONS = 64
+MINHASH_BANDS = 16
+SHINGLE_SIZE = 4
+MERSENNE_PRIME = (1 << 61) - 1
+
+NON_WORD_RE = re.compile(r"[\W_]+")
+
+Question = Tuple[str, Tuple[str, ...], str]
+
+
+def normalize_text(text: str) -> str:
+    """Нижний регистр, ё -> е, без знаков препинания и лишних пробелов"""
+    return NON_WORD_RE.sub(" ", text.lower().replace("ё", "е")).strip()
+
+
+def format_question(question: str, options: Sequence[str]) -> str:
+    """Текст вопроса в том же виде, что и у вопросов, сгенерированных на лету"""
+    lines = [f"Вопрос: {question}"]
+    lines.extend(f"{letter}) {option}" for letter, option in zip(OPTION_LETTERS, options))
+    return "\n".join(lines)
+
+
+def validate_question(item) -> Optional[Question]:
+    """
+    Проверяет вопрос из JSON-ответа модели.
+
+    Args:
+        item: Объект {"question": str, "options": [4 строки], "answer": буква или текст варианта}
+
+    Returns:
+        (вопрос, варианты, буква ответа) или None, если вопрос некорректен
+    """
+    if not isinstance(item, dict):
+        return None
+    question, options, answer = item.get("question"), item.get("options"), item.get("answer")
+    if not isinstance(question, str) or not isinstance(options, list) or not isinstance(answer, str):
+        return None
+
+    question = question.strip()
+    options = tuple(option.strip() if isinstance(option, str) else "" for option in options)
+    if not question or len(question) > MAX_QUESTION_LENGTH or len(options) != len(OPTION_LETTERS):
+        return None
+    if not all(options) or any(len(option) > MAX_OPTION_LENGTH for option in options):
+        return None
+    if len({normalize_text(option) for option in options}) != len(options):
+        return None
+
+    letter = answer.strip().rstrip(")").upper().translate(CYRILLIC_TO_LATIN)
+    if letter not in OPTION_LETTERS:
+        # Вместо буквы модель могла вернуть текст правильного варианта
+        matches = [index for index, option in enumerate(options) if normalize_text(option) == normalize_text(answer)]
+        if len(matches) != 1:
+            return None
+        letter = OPTION_LETTERS[matches[0]]
+    return question, options, letter
+
+
+def shuffle_options(question: Question, rng: random.Random) -> Question:
+    """Перемешивает варианты: модели чаще ставят правильный ответ первым"""
+    text, options, answer = question
+    order = list(range(len(options)))
+    rng.shuffle(order)
+    return text, tuple(options[index] for index in order), OPTION_LETTERS[order.index(OPTION_LETTERS.index(answer))]
+
+
+def fingerprint(question: Question) -> bytes:
+    """Хэш нормализованного вопроса и набора вариантов (порядок вариантов не важен)"""
+    text, options, _ = question
+    key = "\x00".join([normalize_text(text), *sorted(normalize_text(option) for option in options)])
+    return hashlib.blake2b(key.encode(), digest_size=16).digest()
+
+
+class MinHasher:
+    """MinHash-сигнатуры по символьным шинглам нормализованного текста"""
+
+    def __init__(self, permutations: int = MINHASH_PERMUTATIONS, shingle_size: int = SHINGLE_SIZE, seed: int = 1):
+        rng = random.Random(seed)
+        self.permutations = permutations
+        self.shingle_size = shingle_size
+        self._params = [(rng.randrange(1, MERSENNE_PRIME), rng.randrange(MERSENNE_PRIME)) for _ in range(permutations)]
+
+    def signature(self, text: str) -> Tuple[int, ...]:
+        text = normalize_text(text)
+        size = self.shingle_size
+        shingles = {text[i:i + size] for i in range(max(1, len(text) - size + 1))}
+        hashes = [int.from_bytes(hashlib.blake2b(s.encode(), digest_size=8).digest(), "big") for s in shingles]
+        return tuple(min((a * h + b) % MERSENNE_PRIME for h in hashes) for a, b in self._params)
+
+
+def similarity(left: Tuple[int, ...], right: Tuple[int, ...]) -> float:
+    """Оценка коэффициента Жаккара по двум сигнатурам"""
+    return sum(a == b for a, b in zip(left, right)) / len(left)
+
+
+class QuestionDeduplicator:
+    """
+    Отсев повторов: точных (по fingerprint) и почти одинаковых (MinHash + LSH).
+
+    Почти одинаковыми считаются вопросы с одним правильным ответом и
+    перефразированным текстом: сравнивается текст вопроса вместе с правильным
+    вариантом. Кандидаты ищутся по полосам сигнатуры, поэтому добавление
+    не требует сравнения со всеми вопросами темы.
+    """
+
+    def __init__(self, threshold: float = 0.6, bands: int = MINHASH_BANDS):
+        self.threshold = threshold
+        self.bands = bands
+        self.hasher = MinHasher()
+        self._rows = self.hasher.permutations // bands
+        self._fingerprints = set()
+        self._buckets: Dict[tuple, List[Tuple[int, ...]]] = defaultdict(list)
+        self.exact_duplicates = 0
+        self.near_duplicates = 0
+
+    def _signature(self, question: Question) -> Tuple[int, ...]:
+        text, options, answer = question
+        return self.hasher.signature(f"{text} {options[OPTION_LETTERS.index(answer)]}")
+
+    def add(self, question: Question) -> bool:
+        """Добавляет вопрос в индекс; возвращает False, если это повтор"""
+        key = fingerprint(question)
+        if key in self._fingerprints:
+            self.exact_duplicates += 1
+            return False
+
+        signature = self._signature(question)
+        bands = [
+            (band, signature[band * self._rows:(band + 1) * self._rows])
+            for band in range(self.bands)
+        ]
+        for band in bands:
+            for other in self._buckets.get(band, ()):
+                if similarity(signature, other) >= self.threshold:
+                    self.near_duplicates += 1
+                    return False
+
+        self._fingerprints.add(key)
+        for band in bands:
+            self._buckets[band].append(signature)
+        return True
+
+
+class QuizBankWriter:
+    """
+    Сборка файла банка вопросов.
+
+    Вопросы копятся в памяти и записываются в новый файл целиком в commit(),
+    который затем атомарно подменяет старый: работающий бот не увидит
+    недописанный банк. В режиме append существующие вопросы сохраняют свои
+    номера и идентификатор банка, поэтому отметки о просмотренных вопросах
+    у пользователей остаются верными.
+    """
+
+    def __init__(self, path: str, append: bool = False, threshold: float = 0.6):
+        self.path = path
+        self.dedup = QuestionDeduplicator(threshold)
+        self.bank_id = uuid.uuid4().hex[:12]
+        self.questions: Dict[str, List[Question]] = defaultdict(list)
+        self.rejected = 0
+
+        if append and os.path.exists(path):
+            conn = sqlite3.connect(path)
+            try:
+                self.bank_id = dict(conn.execute("SELECT key, value FROM meta").fetchall())["bank_id"]
+                rows = conn.execute("SELECT topic, question, options, answer FROM questions ORDER BY topic, idx")
+                for topic, text, options, answer in rows:
+                    question = (text, tuple(json.loads(options)), answer)
+                    self.dedup.add(question)
+                    self.questions[topic].append(question)
+            finally:
+                conn.close()
+
+    def count(self, topic: str) -> int:
+        return len(self.questions[topic])
+
+    def add(self, topic: str, item, rng: random.Random) -> bool:
+        """Проверяет, перемешивает и добавляет вопрос; False - некорректен или повтор"""
+        question = validate_question(item)
+        if question is None:
+            self.rejected += 1
+            return False
+        question = shuffle_options(question, rng)
+        if not self.dedup.add(question):
+            return False
+        self.questions[topic].append(question)
+        return True
+
+    def commit(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        temp_path = f"{self.path}.{os.getpid()}.tmp"
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        conn = sqlite3.connect(temp_path)
+        try:
+            for statement in SCHEMA:
+                conn.execute(statement)
+            conn.execute("INSERT INTO meta (key, value) VALUES ('bank_id', ?)", (self.bank_id,))
+            conn.executemany(
+                "INSERT INTO questions (topic, idx, question, options, answer, fingerprint) VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (topic, index, question[0], json.dumps(question[1], ensure_ascii=False), question[2],
+                     fingerprint(question))
+                    for topic, questions in self.questions.items()
+                    for index, question in enumerate(questions)
+                ]
+            )
+            conn.commit()
+            conn.execute("VACUUM")
+        finally:
+            conn.close()
+        os.replace(temp_path, self.path)
+
+
+def pick_unseen(size: int, seen: int, rng: random.Random = random) -> Tuple[int, int]:
+    """
+    Выбирает случайный номер вопроса, которого нет в битовой карте seen.
+
+    Пока просмотрена меньшая часть темы, хватает одной-двух случайных проб;
+    иначе берется ближайший свободный бит после случайной позиции. Когда
+    просмотрены все вопросы, карта сбрасывается.
+
+    Returns:
+        (номер вопроса, битовая карта до его отметки)
+    """
+    full = (1 << size) - 1
+    if seen & full == full:
+        seen = 0
+
+    for _ in range(SAMPLE_PROBES):
+        index = rng.randrange(size)
+        if not seen >> index & 1:
+            return index, seen
+
+    free = ~seen & full
+    start = rng.randrange(size)
+    above = free >> start
+    if above:
+        return start + (above & -above).bit_length() - 1, seen
+    return (free & -free).bit_length() - 1, seen
+
+
+class QuizBank:
+    """
+    Готовые вопросы викторины из файла, собранного scripts/build_quiz_bank.py.
+
+    Вопросы загружаются в память при старте, выбор вопроса - обращение
+    к кортежу по случайному номеру. Просмотренные вопросы отмечаются
+    в битовой карте темы в сессии пользователя (бит на вопрос), поэтому
+    вопросы не повторяются, пока пользователь не пройдет всю тему.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.bank_id: Optional[str] = None
+        self._topics: Dict[str, Tuple[Tuple[str, Tuple[str, ...], str], ...]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def load(self) -> bool:
+        if not self.path or not os.path.exists(self.path):
+            logger.info(f"Quiz bank {self.path!r} not found, questions will be generated live")
+            return False
+
+        try:
+            conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True)
+            try:
+                bank_id = dict(conn.execute("SELECT key, value FROM meta").fetchall())["bank_id"]
+                topics: Dict[str, list] = defaultdict(list)
+                for topic, text, options, answer in conn.execute(
+                        "SELECT topic, question, options, answer FROM questions ORDER BY topic, idx"
+                ):
+                    options = tuple(json.loads(options))
+                    topics[topic].append((format_question(text, options), options, answer))
+            finally:
+                conn.close()
+        except (sqlite3.Error, KeyError, ValueError) as e:
+            logger.error(f"Failed to load quiz bank {self.path!r}, questions will be generated live: {e}")
+            return False
+
+        self.bank_id = bank_id
+        self._topics = {topic: tuple(questions) for topic, questions in topics.items()}
+        logger.info(f"Quiz bank {bank_id} loaded: { {topic: len(q) for topic, q in self._topics.items()} }")
+        return True
+
+    def has_topic(self, topic: str) -> bool:
+        return bool(self._topics.get(topic))
+
+    def sample(self, topic: str, session) -> Optional[dict]:
+        """
+        Случайный непросмотренный вопрос темы.
+
+        Args:
+            topic: Ключ темы
+            session: UserSession, в которой отмечается выданный вопрос
+
+        Returns:
+            {"text": ..., "options": ..., "answer": ...} или None, если вопросов темы в банке нет
+        """
+        questions = self._topics.get(topic)
+        if not questions:
+            self.misses += 1
+            return None
+
+        # Банк пересобран заново: прежние номера вопросов ничего не значат
+        if session.quiz_bank_id != self.bank_id or session.quiz_seen is None:
+            session.quiz_bank_id = self.bank_id
+            session.quiz_seen = {}
+
+        index, seen = pick_unseen(len(questions), session.quiz_seen.get(topic, 0))
+        session.quiz_seen[topic] = seen | (1 << index)
+        self.hits += 1
+
+        text, options, answer = questions[index]
+        return {"text": text, "options": options, "answer": answer}
+
+    def stats(self) -> dict:
+        return {
+            "bank_id": self.bank_id,
+            "topics": {topic: len(questions) for topic, questions in self._topics.items()},
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+quiz_bank = QuizBank(QUIZ_BANK_PATH)
+quiz_bank.load()
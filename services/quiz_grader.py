@@ -0,0 +1,147 @@
+import re
+from typing import NamedTuple, Optional, Sequence
+
+from services.quiz_bank import OPTION_LETTERS, normalize_text
+from config import QUIZ_MATCH_THRESHOLD, QUIZ_MATCH_MARGIN
+
+# Кириллические буквы, похожие на латинские A-D (в обоих регистрах)
+HOMOGLYPHS = str.maketrans("АВСавс", "ABCabc")
+
+# Ответ буквой: "b", "B)", "(c)", "D.", "ответ: a", "вариант С" (буква может быть кириллической)
+LETTER_RE = re.compile(r"^(?:(?:ответ|вариант)\s*:?\s*)?[(\[]?([a-dавс])\s*[)\].:]?$", re.IGNORECASE)
+
+# Буква с текстом варианта: "B) Нил", "c. 1945" - берется буква
+LETTER_PREFIX_RE = re.compile(r"^[(\[]?([a-dавс])\s*[)\].:]\s*\S", re.IGNORECASE)
+
+DIGITS_RE = re.compile(r"\d+")
+
+
+class Grade(NamedTuple):
+    """
+    Результат разбора ответа.
+
+    Attributes:
+        letter: Буква выбранного варианта или None, если ответ не распознан
+        method: Как распознан ответ: letter, exact, fuzzy или none
+        score: Сходство с выбранным вариантом (1.0 для буквы и точного совпадения)
+    """
+    letter: Optional[str]
+    method: str
+    score: float = 0.0
+
+
+NOT_RECOGNIZED = Grade(None, "none")
+
+
+def edit_distance(left: str, right: str, limit: int) -> int:
+    """
+    Расстояние Левенштейна с отсечением: если оно больше limit, возвращается limit + 1.
+
+    Считаются только диагонали в пределах limit от главной, поэтому
+    стоимость O(limit * len) вместо O(len * len).
+    """
+    if abs(len(left) - len(right)) > limit:
+        return limit + 1
+    if len(left) > len(right):
+        left, right = right, left
+
+    over = limit + 1
+    previous = [column if column <= limit else over for column in range(len(right) + 1)]
+    for row in range(1, len(left) + 1):
+        char = left[row - 1]
+        low, high = max(1, row - limit), min(len(right), row + limit)
+        current = [over] * (len(right) + 1)
+        current[0] = row if row <= limit else over
+        best = current[0]
+        for column in range(low, high + 1):
+            cost = previous[column - 1] + (char != right[column - 1])
+            cost = min(cost, previous[column] + 1, current[column - 1] + 1)
+            current[column] = cost if cost <= limit else over
+            best = min(best, current[column])
+        if best > limit:
+            return over
+        previous = current
+    return previous[len(right)]
+
+
+def similarity(answer: str, option: str, threshold: float) -> float:
+    """
+    Сходство нормализованного ответа с вариантом: большее из доли совпадающих
+    символов (по расстоянию Левенштейна) и доли слов ответа, найденных
+    в варианте ("тихий" для "Тихий океан"; слово, общее для нескольких
+    вариантов, отсеется по отрыву от второго варианта).
+
+    Числа должны совпадать точно: "1944" не засчитывается за "1945".
+    """
+    if DIGITS_RE.findall(answer) != DIGITS_RE.findall(option):
+        return 0.0
+
+    answer_words = set(answer.split())
+    overlap = len(answer_words & set(option.split())) / len(answer_words)
+
+    length = max(len(answer), len(option))
+    # Расстояние больше этого предела уже не даст порогового сходства
+    limit = int(length * (1 - threshold))
+    distance = edit_distance(answer, option, limit)
+    ratio = 1 - distance / length if distance <= limit else 0.0
+    return max(ratio, overlap)
+
+
+def grade_answer(
+        text: str,
+        options: Sequence[str],
+        threshold: float = QUIZ_MATCH_THRESHOLD,
+        margin: float = QUIZ_MATCH_MARGIN
+) -> Grade:
+    """
+    Определяет, какой вариант выбрал пользователь, без обращения к API.
+
+    Args:
+        text: Ответ пользователя: буква в любом написании или текст варианта
+        options: Тексты вариантов A-D (могут быть пустыми - тогда только буквы)
+        threshold: Минимальное сходство текста с вариантом
+        margin: На сколько лучший вариант должен опережать второй
+
+    Returns:
+        Grade с буквой варианта или NOT_RECOGNIZED
+    """
+    cleaned = text.strip()
+    match = LETTER_RE.match(cleaned)
+    if match:
+        return Grade(match.group(1).translate(HOMOGLYPHS).upper(), "letter", 1.0)
+
+    answer = normalize_text(cleaned)
+    normalized = [normalize_text(option) for option in options]
+    # Совпадение с вариантом проверяется до буквы с текстом: "А. С. Пушкин" - это вариант, а не буква А
+    for letter, option in zip(OPTION_LETTERS, normalized):
+        if answer and answer == option:
+            return Grade(letter, "exact", 1.0)
+
+    prefix = LETTER_PREFIX_RE.match(cleaned)
+    if prefix:
+        letter_grade = Grade(prefix.group(1).translate(HOMOGLYPHS).upper(), "letter", 1.0)
+        if not answer or not options:
+            return letter_grade
+        # Инициалы с опечаткой ("А. С. Пушкн") тоже похожи на букву с текстом: буква
+        # не берется, если весь ответ похож на вариант больше, чем текст после нее
+        whole = closest_option(answer, normalized, threshold, margin)
+        rest = normalize_text(cleaned[prefix.end() - 1:])
+        rest_score = max((similarity(rest, option, threshold) for option in normalized), default=0.0) if rest else 0.0
+        return whole if whole.letter is not None and whole.score > rest_score else letter_grade
+
+    if not answer or not options:
+        return NOT_RECOGNIZED
+    return closest_option(answer, normalized, threshold, margin)
+
+
+def closest_option(answer: str, normalized: Sequence[str], threshold: float, margin: float) -> Grade:
+    """Вариант, на который нормализованный ответ похож с порогом и отрывом от второго"""
+    scores = sorted(
+        ((similarity(answer, option, threshold), letter) for letter, option in zip(OPTION_LETTERS, normalized)),
+        reverse=True
+    )
+    best, letter = scores[0]
+    runner_up = scores[1][0] if len(scores) > 1 else 0.0
+    if best >= threshold and best - runner_up >= margin:
+        return Grade(letter, "fuzzy", best)
+    return NOT_RECOGNIZED
@@ -0,0 +1,305 @@
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Грубая оценка: около трех символов на токен для смеси русского и английского текста
+CHARS_PER_TOKEN = 3
+# Служебные токены на каждое сообщение в chat-формате
+TOKENS_PER_MESSAGE = 4
+# Ожидаемая длина ответа, которую резервируем до получения response.usage
+EXPECTED_COMPLETION_TOKENS = 300
+
+
+class RateLimitTimeout(Exception):
+    """Запрос не дождался своей очереди до дедлайна"""
+
+
+def parse_retry_after(headers) -> Optional[float]:
+    """Достает задержку из заголовков ответа 429 (retry-after-ms или retry-after)"""
+    if headers is None:
+        return None
+
+    try:
+        retry_after_ms = headers.get("retry-after-ms")
+        if retry_after_ms is not None:
+            return float(retry_after_ms) / 1000
+
+        retry_after = headers.get("retry-after")
+        if retry_after is not None:
+            return float(retry_after)
+    except ValueError:
+        pass
+
+    return None
+
+
+def estimate_tokens(messages: List[dict], completion_tokens: int = EXPECTED_COMPLETION_TOKENS) -> int:
+    """
+    Оценивает число токенов запроса до его отправки.
+
+    Args:
+        messages: Сообщения в формате chat.completions
+        completion_tokens: Резерв под ответ модели
+
+    Returns:
+        Оценка суммарного числа токенов (запрос + ответ)
+    """
+    prompt_tokens = sum(
+        TOKENS_PER_MESSAGE + len(message.get("content") or "") // CHARS_PER_TOKEN
+        for message in messages
+    )
+    return prompt_tokens + completion_tokens
+
+
+class TokenBucket:
+    """Корзина токенов с пополнением по минутной квоте"""
+
+    def __init__(self, per_minute: float, capacity: Optional[float] = None):
+        self.rate = per_minute / 60.0
+        self.capacity = capacity if capacity is not None else per_minute
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    @property
+    def tokens(self) -> float:
+        self._refill()
+        return self._tokens
+
+    def time_until(self, amount: float) -> float:
+        """Сколько секунд ждать, пока в корзине наберется amount"""
+        self._refill()
+        # Запрос больше емкости корзины пропускаем, как только она полна
+        amount = min(amount, self.capacity)
+        if self._tokens >= amount:
+            return 0.0
+        return (amount - self._tokens) / self.rate
+
+    def consume(self, amount: float):
+        """Списывает amount (может уйти в минус при поправке по факту)"""
+        self._refill()
+        self._tokens -= amount
+
+    def drain(self):
+        """Обнуляет корзину (после 429 от API)"""
+        self._refill()
+        self._tokens = min(self._tokens, 0.0)
+
+
+class AdaptiveConcurrency:
+    """
+    Адаптивный лимит параллельных запросов по схеме AIMD.
+
+    Лимит растет на единицу за "окно" успешных быстрых ответов и
+    уменьшается вдвое при перегрузке (429 или превышении целевой задержки),
+    но не чаще раза за target_latency: запросы, отправленные до снижения,
+    сообщают о той же перегрузке и не должны делить лимит повторно.
+    """
+
+    def __init__(self, initial: int = 8, minimum: int = 1, maximum: int = 64,
+                 target_latency: float = 10.0):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_latency = target_latency
+        self.in_flight = 0
+        self.decreases = 0
+        self._last_decrease = float("-inf")
+        self._condition = asyncio.Condition()
+
+    async def acquire(self, timeout: Optional[float]):
+        async with self._condition:
+            await asyncio.wait_for(
+                self._condition.wait_for(lambda: self.in_flight < int(self.limit)),
+                timeout
+            )
+            self.in_flight += 1
+
+    async def release(self):
+        async with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    def on_success(self, latency: float):
+        if latency <= self.target_latency:
+            self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+        else:
+            self._decrease()
+
+    def on_overload(self):
+        self._decrease()
+
+    def _decrease(self):
+        now = time.monotonic()
+        if now - self._last_decrease < self.target_latency:
+            return
+        self._last_decrease = now
+        self.decreases += 1
+        self.limit = max(self.minimum, self.limit / 2)
+
+
+class ModelLimiter:
+    """Ограничения RPM/TPM и параллелизма для одной модели"""
+
+    def __init__(self, rpm: int, tpm: int, concurrency: AdaptiveConcurrency):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.concurrency = concurrency
+        self.paused_until = 0.0
+        self.queued = 0
+        # Lock в asyncio честный (FIFO), он и задает порядок очереди
+        self._queue_lock = asyncio.Lock()
+
+    async def wait_for_capacity(self, estimated_tokens: int, deadline: float):
+        """Ждет квоты в корзинах в порядке очереди"""
+        self.queued += 1
+        try:
+            await asyncio.wait_for(self._queue_lock.acquire(), max(0.0, deadline - time.monotonic()))
+        except asyncio.TimeoutError:
+            raise RateLimitTimeout("Очередь к OpenAI не продвинулась до дедлайна")
+        finally:
+            self.queued -= 1
+
+        try:
+            while True:
+                now = time.monotonic()
+                wait = max(
+                    self.paused_until - now,
+                    self.requests.time_until(1),
+                    self.tokens.time_until(estimated_tokens)
+                )
+                if wait <= 0:
+                    break
+                if now >= deadline:
+                    raise RateLimitTimeout(f"Квота OpenAI освободится только через {wait:.1f} с")
+                # Перепроверяем не реже раза в секунду: поправки по usage могут вернуть токены раньше
+                await asyncio.sleep(min(wait, deadline - now, 1.0))
+
+            self.requests.consume(1)
+            self.tokens.consume(estimated_tokens)
+        finally:
+            self._queue_lock.release()
+
+
+class Permit:
+    """Разрешение на один запрос; позволяет поправить оценку токенов по факту"""
+
+    def __init__(self, limiter: ModelLimiter, estimated_tokens: int):
+        self._limiter = limiter
+        self._estimated_tokens = estimated_tokens
+        self.rate_limited = False
+        self.started = time.monotonic()
+        # Задержка для AIMD; у потоков - время до первого фрагмента
+        self.latency: Optional[float] = None
+
+    def record_first_chunk(self):
+        """
+        Отмечает первый фрагмент потокового ответа.
+
+        Длина генерации и паузы потребителя (правки сообщения в Telegram)
+        не говорят о перегрузке API, поэтому задержкой потока считается
+        время до первого фрагмента.
+        """
+        if self.latency is None:
+            self.latency = time.monotonic() - self.started
+
+    def record_usage(self, total_tokens: Optional[int]):
+        """Корректирует корзину TPM по response.usage"""
+        if total_tokens is None:
+            return
+        self._limiter.tokens.consume(total_tokens - self._estimated_tokens)
+        self._estimated_tokens = total_tokens
+
+    def record_rate_limited(self, retry_after: Optional[float]):
+        """Отмечает ответ 429: приостанавливает очередь и снижает параллелизм"""
+        self.rate_limited = True
+        pause = retry_after if retry_after is not None else 1.0
+        self._limiter.paused_until = max(self._limiter.paused_until, time.monotonic() + pause)
+        self._limiter.requests.drain()
+        self._limiter.concurrency.on_overload()
+        logger.warning(f"OpenAI rate limited, pausing for {pause}s, "
+                       f"concurrency limit {self._limiter.concurrency.limit:.1f}")
+
+
+class RateLimiter:
+    """
+    Контроль допуска запросов к OpenAI.
+
+    Для каждой модели держит корзины запросов и токенов в минуту и общий
+    адаптивный лимит параллельных запросов. Запросы, которым не хватает квоты,
+    ждут в очереди до своего дедлайна, а не падают сразу.
+    """
+
+    def __init__(self, default_limits: Tuple[int, int],
+                 model_limits: Optional[Dict[str, Tuple[int, int]]] = None,
+                 concurrency: Optional[AdaptiveConcurrency] = None,
+                 queue_timeout: float = 30.0):
+        self.default_limits = default_limits
+        self.model_limits = model_limits or {}
+        self.concurrency = concurrency or AdaptiveConcurrency()
+        self.queue_timeout = queue_timeout
+        self._models: Dict[str, ModelLimiter] = {}
+
+    def _get_model(self, model: str) -> ModelLimiter:
+        limiter = self._models.get(model)
+        if limiter is None:
+            rpm, tpm = self.model_limits.get(model, self.default_limits)
+            limiter = ModelLimiter(rpm, tpm, self.concurrency)
+            self._models[model] = limiter
+        return limiter
+
+    @asynccontextmanager
+    async def acquire(self, model: str, estimated_tokens: int,
+                      timeout: Optional[float] = None) -> AsyncIterator[Permit]:
+        """
+        Ждет квоты и свободного слота для запроса к модели.
+
+        Args:
+            model: Модель OpenAI
+            estimated_tokens: Оценка токенов запроса
+            timeout: Сколько максимум ждать в очереди (по умолчанию queue_timeout)
+
+        Raises:
+            RateLimitTimeout: если квота не освободилась до дедлайна
+        """
+        limiter = self._get_model(model)
+        deadline = time.monotonic() + (timeout if timeout is not None else self.queue_timeout)
+
+        await limiter.wait_for_capacity(estimated_tokens, deadline)
+
+        try:
+            await self.concurrency.acquire(max(0.0, deadline - time.monotonic()))
+        except asyncio.TimeoutError:
+            raise RateLimitTimeout("Нет свободных слотов для запроса к OpenAI")
+
+        permit = Permit(limiter, estimated_tokens)
+        try:
+            yield permit
+            if not permit.rate_limited:
+                latency = permit.latency if permit.latency is not None else time.monotonic() - permit.started
+                self.concurrency.on_success(latency)
+        finally:
+            await self.concurrency.release()
+
+    def stats(self) -> dict:
+        return {
+            "concurrency_limit": round(self.concurrency.limit, 2),
+            "concurrency_decreases": self.concurrency.decreases,
+            "in_flight": self.concurrency.in_flight,
+            "models": {
+                model: {
+                    "queued": limiter.queued,
+                    "requests_available": round(limiter.requests.tokens, 1),
+                    "tokens_available": round(limiter.tokens.tokens),
+                }
+                for model, limiter in self._models.items()
+            },
+        }
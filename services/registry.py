@@ -0,0 +1,256 @@
+import asyncio
+import json
+import logging
+import os
+import re
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Callable, Dict, List, Mapping, Optional, Tuple
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+from services.callback_router import callback_data, MENU, RANDOM, GPT, TALK, QUIZ, TRANSLATE, RESUME
+from config import PROMPTS_DIR, PROMPTS_WATCH_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+# Файлы справочников в PROMPTS_DIR
+PERSONALITIES_FILE = "personalities.json"
+QUIZ_TOPICS_FILE = "quiz_topics.json"
+LANGUAGES_FILE = "languages.json"
+MENU_FILE = "menu.json"
+FILES = (PERSONALITIES_FILE, QUIZ_TOPICS_FILE, LANGUAGES_FILE, MENU_FILE)
+
+# Ключи попадают в callback_data, поэтому ограничены по алфавиту и длине
+KEY_RE = re.compile(r"^[a-z0-9_-]{1,32}$")
+
+# Функции, которые можно открыть из главного меню
+MENU_FEATURES = {
+    "random": RANDOM,
+    "gpt": GPT,
+    "talk": TALK,
+    "quiz": QUIZ,
+    "translate": TRANSLATE,
+    "resume": RESUME,
+}
+
+
+@dataclass(frozen=True)
+class Persona:
+    key: str
+    name: str
+    emoji: str
+    prompt: str
+
+
+@dataclass(frozen=True)
+class QuizTopic:
+    key: str
+    name: str
+    emoji: str
+    prompt: str
+
+
+@dataclass(frozen=True)
+class Snapshot:
+    """
+    Неизменяемый снимок справочников вместе с готовыми клавиатурами.
+
+    Клавиатуры строятся один раз при загрузке: InlineKeyboardMarkup в PTB
+    неизменяем, поэтому один объект отправляется всем пользователям.
+    """
+    personalities: Mapping[str, Persona]
+    quiz_topics: Mapping[str, QuizTopic]
+    languages: Mapping[str, str]
+    main_menu_keyboard: InlineKeyboardMarkup
+    personality_keyboard: InlineKeyboardMarkup
+    quiz_topic_keyboard: InlineKeyboardMarkup
+    language_keyboard: InlineKeyboardMarkup
+    # Клавиатура после ответа на вопрос: "следующий вопрос" несет ключ темы
+    quiz_answer_keyboards: Mapping[str, InlineKeyboardMarkup]
+
+
+def _read(directory: str, filename: str):
+    with open(os.path.join(directory, filename), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _require(entry: dict, field: str, filename: str) -> str:
+    value = entry.get(field) if isinstance(entry, dict) else None
+    if not isinstance(value, str) or not value.strip():
+        raise ValueError(f"{filename}: поле {field!r} обязательно в {entry!r}")
+    return value
+
+
+def _load_entries(directory: str, filename: str, key_field: str, fields: Tuple[str, ...]) -> Dict[str, dict]:
+    entries = _read(directory, filename)
+    if not isinstance(entries, list) or not entries:
+        raise ValueError(f"{filename}: ожидается непустой список")
+
+    result: Dict[str, dict] = {}
+    for entry in entries:
+        key = _require(entry, key_field, filename)
+        if not KEY_RE.match(key):
+            raise ValueError(f"{filename}: недопустимый ключ {key!r} (a-z, 0-9, _ и -, до 32 символов)")
+        if key in result:
+            raise ValueError(f"{filename}: ключ {key!r} повторяется")
+        result[key] = {field: _require(entry, field, filename) for field in fields}
+    return result
+
+
+def _cancel_row() -> List[InlineKeyboardButton]:
+    return [InlineKeyboardButton("Отмена", callback_data=callback_data(MENU, "home"))]
+
+
+def load_snapshot(directory: str) -> Snapshot:
+    """
+    Загружает и проверяет справочники, строит клавиатуры.
+
+    Args:
+        directory: Каталог с JSON-файлами справочников
+
+    Returns:
+        Готовый снимок
+
+    Raises:
+        ValueError: Если файл не разбирается или данные некорректны
+        OSError: Если файла нет
+    """
+    personalities = {
+        key: Persona(key, **fields)
+        for key, fields in _load_entries(directory, PERSONALITIES_FILE, "key", ("name", "emoji", "prompt")).items()
+    }
+    quiz_topics = {
+        key: QuizTopic(key, **fields)
+        for key, fields in _load_entries(directory, QUIZ_TOPICS_FILE, "key", ("name", "emoji", "prompt")).items()
+    }
+    languages = {
+        code: fields["name"]
+        for code, fields in _load_entries(directory, LANGUAGES_FILE, "code", ("name",)).items()
+    }
+
+    menu_rows = _read(directory, MENU_FILE)
+    if not isinstance(menu_rows, list) or not all(isinstance(row, list) and row for row in menu_rows):
+        raise ValueError(f"{MENU_FILE}: ожидается список непустых рядов кнопок")
+    main_menu = []
+    for row in menu_rows:
+        buttons = []
+        for item in row:
+            feature = _require(item, "feature", MENU_FILE)
+            if feature not in MENU_FEATURES:
+                raise ValueError(f"{MENU_FILE}: неизвестная функция {feature!r}")
+            buttons.append(InlineKeyboardButton(
+                _require(item, "label", MENU_FILE),
+                callback_data=callback_data(MENU_FEATURES[feature], "open")
+            ))
+        main_menu.append(buttons)
+
+    return Snapshot(
+        personalities=MappingProxyType(personalities),
+        quiz_topics=MappingProxyType(quiz_topics),
+        languages=MappingProxyType(languages),
+        main_menu_keyboard=InlineKeyboardMarkup(main_menu),
+        personality_keyboard=InlineKeyboardMarkup([
+            *([InlineKeyboardButton(
+                f"{persona.name} {persona.emoji}",
+                callback_data=callback_data(TALK, "pick", key)
+            )] for key, persona in personalities.items()),
+            _cancel_row()
+        ]),
+        quiz_topic_keyboard=InlineKeyboardMarkup([
+            *([InlineKeyboardButton(
+                f"{topic.name} {topic.emoji}",
+                callback_data=callback_data(QUIZ, "topic", key)
+            )] for key, topic in quiz_topics.items()),
+            _cancel_row()
+        ]),
+        language_keyboard=InlineKeyboardMarkup([
+            *([InlineKeyboardButton(name, callback_data=callback_data(TRANSLATE, "lang", code))]
+              for code, name in languages.items()),
+            _cancel_row()
+        ]),
+        quiz_answer_keyboards=MappingProxyType({
+            key: InlineKeyboardMarkup([
+                [
+                    InlineKeyboardButton("Следующий вопрос", callback_data=callback_data(QUIZ, "next", key)),
+                    InlineKeyboardButton("Сменить тему", callback_data=callback_data(QUIZ, "change"))
+                ],
+                [InlineKeyboardButton("Закончить", callback_data=callback_data(QUIZ, "end"))]
+            ])
+            for key in quiz_topics
+        }),
+    )
+
+
+class Registry:
+    """
+    Справочники личностей, тем викторины, языков и главного меню.
+
+    Обработчики берут registry.current один раз на запрос и работают с
+    неизменяемым снимком. При изменении файлов новый снимок загружается и
+    проверяется целиком, а затем подменяет старый одной операцией
+    присваивания; если файлы некорректны, продолжает работать старый снимок.
+    """
+
+    def __init__(self, directory: str, watch_interval: float = 0.0):
+        self.directory = directory
+        self.watch_interval = watch_interval
+        self.current: Snapshot = load_snapshot(directory)
+        self._mtimes = self._scan_mtimes()
+        self._listeners: List[Callable[[Snapshot], None]] = []
+        self._watch_task: Optional[asyncio.Task] = None
+        self.reloads = 0
+
+    def _scan_mtimes(self) -> Tuple[float, ...]:
+        return tuple(
+            os.stat(os.path.join(self.directory, filename)).st_mtime_ns if
+            os.path.exists(os.path.join(self.directory, filename)) else 0
+            for filename in FILES
+        )
+
+    def subscribe(self, listener: Callable[[Snapshot], None]):
+        """Регистрирует функцию, вызываемую после подмены снимка"""
+        self._listeners.append(listener)
+
+    def reload(self) -> bool:
+        """Перечитывает файлы; возвращает True, если снимок подменен"""
+        try:
+            snapshot = load_snapshot(self.directory)
+        except (OSError, ValueError, TypeError) as e:
+            logger.error(f"Registry reload failed, keeping the previous snapshot: {e}")
+            return False
+
+        self.current = snapshot
+        self.reloads += 1
+        for listener in self._listeners:
+            try:
+                listener(snapshot)
+            except Exception as e:
+                logger.error(f"Registry listener failed: {e}")
+
+        logger.info(
+            f"Registry reloaded: {len(snapshot.personalities)} personalities, "
+            f"{len(snapshot.quiz_topics)} quiz topics, {len(snapshot.languages)} languages"
+        )
+        return True
+
+    async def start(self):
+        if self.watch_interval > 0 and self._watch_task is None:
+            self._watch_task = asyncio.create_task(self._watch())
+
+    async def stop(self):
+        if self._watch_task is not None:
+            self._watch_task.cancel()
+            self._watch_task = None
+
+    async def _watch(self):
+        """Следит за временем изменения файлов и перезагружает справочники"""
+        while True:
+            await asyncio.sleep(self.watch_interval)
+            mtimes = self._scan_mtimes()
+            if mtimes != self._mtimes:
+                self._mtimes = mtimes
+                self.reload()
+
+
+registry = Registry(PROMPTS_DIR, watch_interval=PROMPTS_WATCH_INTERVAL)
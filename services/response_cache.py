@@ -0,0 +1,273 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class CachePolicy:
+    """
+    Политика кэширования для места вызова (call site).
+
+    Attributes:
+        enabled: Кэшировать ли ответы
+        ttl: Время жизни записи в секундах
+        variants: Сколько разных ответов накапливать для одного запроса.
+            При variants > 1 ответ берется случайно из пула, пока пул не заполнен,
+            запросы продолжают уходить в API, пополняя его.
+    """
+    enabled: bool = True
+    ttl: float = 3600.0
+    variants: int = 1
+
+
+# Политика по умолчанию: без кэширования
+NO_CACHE = CachePolicy(enabled=False)
+
+# Политики для мест вызова OpenAIService
+CACHE_POLICIES: Dict[str, CachePolicy] = {
+    "gpt": CachePolicy(ttl=6 * 3600),
+    "translator": CachePolicy(ttl=7 * 24 * 3600),
+    # Факты должны быть разнообразными: отдаем случайный из пула вариантов
+    "random_fact": CachePolicy(ttl=24 * 3600, variants=30),
+    # Ответы личностей и резюме зависят от пользователя, их не кэшируем
+    "personality": NO_CACHE,
+    "quiz": NO_CACHE,
+    "summary": NO_CACHE,
+    "resume": NO_CACHE,
+    # Фоновая предгенерация всегда должна получать новый ответ
+    "prefetch": NO_CACHE,
+    "quiz_bank": NO_CACHE,
+}
+
+
+def get_cache_policy(call_site: Optional[str]) -> CachePolicy:
+    """Возвращает политику кэширования для места вызова"""
+    if call_site is None:
+        return NO_CACHE
+    return CACHE_POLICIES.get(call_site, NO_CACHE)
+
+
+def make_cache_key(model: str, temperature: float, context: Optional[str], prompt: str,
+                   history: Optional[List[dict]] = None) -> str:
+    """Строит ключ кэша из параметров запроса"""
+    payload = json.dumps(
+        [model, round(temperature, 3), context or "", prompt, history or []],
+        ensure_ascii=False,
+        separators=(",", ":")
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _values_size(values: List[str]) -> int:
+    return sum(len(value.encode("utf-8")) for value in values)
+
+
+class CacheEntry:
+    __slots__ = ("values", "expires_at", "size")
+
+    def __init__(self, values: List[str], expires_at: float):
+        self.values = values
+        self.expires_at = expires_at
+        self.size = _values_size(values)
+
+    def expired(self, now: float) -> bool:
+        return now >= self.expires_at
+
+
+class MemoryLRUStore:
+    """Ограниченный по числу записей и объему LRU-кэш в памяти"""
+
+    def __init__(self, max_entries: int = 10000, max_bytes: int = 32 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.bytes_held = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[str, CacheEntry]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        if entry.expired(time.time()):
+            self.delete(key)
+            return None
+
+        self._entries.move_to_end(key)
+        return entry
+
+    def set(self, key: str, entry: CacheEntry):
+        self.delete(key)
+        self._entries[key] = entry
+        self.bytes_held += entry.size
+
+        while self._entries and (
+                len(self._entries) > self.max_entries or self.bytes_held > self.max_bytes
+        ):
+            _, evicted = self._entries.popitem(last=False)
+            self.bytes_held -= evicted.size
+            self.evictions += 1
+
+    def delete(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.bytes_held -= entry.size
+
+
+class SQLiteCacheStore:
+    """Второй уровень кэша в SQLite, переживающий перезапуски бота"""
+
+    # Как часто (в записях) удалять просроченные строки
+    PRUNE_EVERY = 500
+
+    def __init__(self, path: str, max_entries: int = 200000):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS response_cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM response_cache WHERE key = ?", (key,)
+            ).fetchone()
+
+        if row is None or row[1] <= time.time():
+            return None
+        return CacheEntry(json.loads(row[0]), row[1])
+
+    def set(self, key: str, entry: CacheEntry):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO response_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(entry.values, ensure_ascii=False), entry.expires_at)
+            )
+            self._writes += 1
+            if self._writes % self.PRUNE_EVERY == 0:
+                self._prune()
+            self._conn.commit()
+
+    def _prune(self):
+        """Удаляет просроченные записи и самые старые сверх лимита"""
+        self._conn.execute("DELETE FROM response_cache WHERE expires_at <= ?", (time.time(),))
+        self._conn.execute(
+            "DELETE FROM response_cache WHERE key IN ("
+            "SELECT key FROM response_cache ORDER BY expires_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,)
+        )
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class ResponseCache:
+    """
+    Двухуровневый кэш ответов ChatGPT: LRU в памяти и (опционально) SQLite.
+
+    Хранит для каждого ключа список вариантов ответа, чтобы места вызова
+    с политикой variants > 1 могли отдавать разнообразные ответы.
+    """
+
+    def __init__(self, memory: MemoryLRUStore, persistent: Optional[SQLiteCacheStore] = None):
+        self.memory = memory
+        self.persistent = persistent
+        self.hits = 0
+        self.misses = 0
+        self.persistent_hits = 0
+
+    async def get(self, key: str) -> Optional[List[str]]:
+        """Возвращает варианты ответа по ключу или None"""
+        entry = self.memory.get(key)
+
+        if entry is None and self.persistent is not None:
+            entry = await asyncio.to_thread(self.persistent.get, key)
+            if entry is not None:
+                self.persistent_hits += 1
+                self.memory.set(key, entry)
+
+        return entry.values if entry is not None else None
+
+    async def lookup(self, key: str, policy: CachePolicy) -> Optional[str]:
+        """
+        Ищет ответ в кэше согласно политике места вызова.
+
+        Args:
+            key: Ключ запроса
+            policy: Политика кэширования
+
+        Returns:
+            Закэшированный ответ или None, если нужен запрос к API
+        """
+        if not policy.enabled:
+            return None
+
+        values = await self.get(key)
+        if values is None or len(values) < policy.variants:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return random.choice(values)
+
+    async def store(self, key: str, value: str, policy: CachePolicy):
+        """Сохраняет ответ, пополняя пул вариантов"""
+        if not policy.enabled:
+            return
+
+        entry = self.memory.get(key)
+        if entry is None and self.persistent is not None:
+            entry = await asyncio.to_thread(self.persistent.get, key)
+
+        if entry is not None and policy.variants > 1:
+            values = (entry.values + [value])[-policy.variants:]
+            expires_at = entry.expires_at
+        else:
+            values = [value]
+            expires_at = time.time() + policy.ttl
+
+        entry = CacheEntry(values, expires_at)
+        self.memory.set(key, entry)
+
+        if self.persistent is not None:
+            try:
+                await asyncio.to_thread(self.persistent.set, key, entry)
+            except sqlite3.Error as e:
+                logger.error(f"Response cache write error: {e}")
+
+    def stats(self) -> dict:
+        """Счетчики кэша для подбора его размера"""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "persistent_hits": self.persistent_hits,
+            "entries": len(self.memory),
+            "bytes_held": self.memory.bytes_held,
+            "evictions": self.memory.evictions,
+        }
@@ -0,0 +1,223 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Deque, Dict, Hashable, Optional
+
+logger = logging.getLogger(__name__)
+
+# Веса функций: чем больше вес, тем большую долю пропускной способности получает
+# очередь пользователя, когда в её голове стоит запрос этой функции
+FEATURE_WEIGHTS: Dict[str, float] = {
+    "gpt": 4.0,
+    "personality": 4.0,
+    "translator": 2.0,
+    "random_fact": 2.0,
+    "quiz": 2.0,
+    "resume": 1.0,
+    "summary": 1.0,
+    "prefetch": 0.5,
+    "quiz_bank": 0.5,
+}
+DEFAULT_WEIGHT = 1.0
+
+# Квант Deficit Round Robin в "токенах" стоимости запроса при весе 1
+QUANTUM = 500
+
+# Политики переполнения очереди пользователя
+DROP_OLDEST = "drop_oldest"
+REJECT_NEW = "reject_new"
+
+# Сколько последних ожиданий хранить для перцентилей
+WAIT_SAMPLES = 1000
+
+
+class QueueFullError(Exception):
+    """Очередь пользователя переполнена"""
+
+
+class _Job:
+    __slots__ = ("future", "feature", "cost", "enqueued_at")
+
+    def __init__(self, future: asyncio.Future, feature: str, cost: int):
+        self.future = future
+        self.feature = feature
+        self.cost = cost
+        self.enqueued_at = time.monotonic()
+
+
+class _FeatureMetrics:
+    __slots__ = ("queued", "dispatched", "dropped", "rejected", "waits")
+
+    def __init__(self):
+        self.queued = 0
+        self.dispatched = 0
+        self.dropped = 0
+        self.rejected = 0
+        self.waits: Deque[float] = deque(maxlen=WAIT_SAMPLES)
+
+    def snapshot(self) -> dict:
+        waits = sorted(self.waits)
+        return {
+            "queued": self.queued,
+            "dispatched": self.dispatched,
+            "dropped": self.dropped,
+            "rejected": self.rejected,
+            "wait_avg": sum(waits) / len(waits) if waits else 0.0,
+            "wait_p95": waits[int(len(waits) * 0.95)] if waits else 0.0,
+            "wait_max": waits[-1] if waits else 0.0,
+        }
+
+
+class FairScheduler:
+    """
+    Справедливое распределение запросов к LLM между пользователями.
+
+    У каждого пользователя своя очередь; очереди обслуживаются по схеме
+    Deficit Round Robin, где квант зависит от веса функции. Один пользователь
+    с потоком сообщений или огромным текстом не может занять всю пропускную
+    способность: остальные получают свою долю слотов.
+    """
+
+    def __init__(self, concurrency: int = 16, max_queue_per_user: int = 5,
+                 overflow_policy: str = DROP_OLDEST):
+        if overflow_policy not in (DROP_OLDEST, REJECT_NEW):
+            raise ValueError(f"Unknown overflow policy: {overflow_policy}")
+
+        self.concurrency = concurrency
+        self.max_queue_per_user = max_queue_per_user
+        self.overflow_policy = overflow_policy
+
+        self._free_slots = concurrency
+        self._queues: Dict[Hashable, Deque[_Job]] = {}
+        self._deficits: Dict[Hashable, float] = {}
+        self._active: Deque[Hashable] = deque()
+        self._metrics: Dict[str, _FeatureMetrics] = {}
+
+    @property
+    def in_flight(self) -> int:
+        return self.concurrency - self._free_slots
+
+    def _feature_metrics(self, feature: str) -> _FeatureMetrics:
+        metrics = self._metrics.get(feature)
+        if metrics is None:
+            metrics = self._metrics[feature] = _FeatureMetrics()
+        return metrics
+
+    @asynccontextmanager
+    async def slot(self, user_key: Hashable, feature: str, cost: int = QUANTUM) -> AsyncIterator[None]:
+        """
+        Ждет своей очереди и удерживает слот на время запроса.
+
+        Args:
+            user_key: Идентификатор пользователя (effective_user.id)
+            feature: Функция бота (gpt, translator, ...), определяет вес
+            cost: Стоимость запроса (оценка токенов)
+
+        Raises:
+            QueueFullError: если очередь пользователя переполнена
+        """
+        job = self._enqueue(user_key, feature, max(1, cost))
+        try:
+            await job.future
+        except asyncio.CancelledError:
+            # Если слот уже выдан, но ожидающий отменен, слот нужно вернуть
+            # (вытесненный запрос с QueueFullError слота не получал)
+            if job.future.done() and not job.future.cancelled() and job.future.exception() is None:
+                self._release()
+            else:
+                job.future.cancel()
+            raise
+
+        try:
+            yield
+        finally:
+            self._release()
+
+    def _enqueue(self, user_key: Hashable, feature: str, cost: int) -> _Job:
+        metrics = self._feature_metrics(feature)
+        queue = self._queues.get(user_key)
+        if queue is None:
+            queue = self._queues[user_key] = deque()
+
+        if len(queue) >= self.max_queue_per_user:
+            if self.overflow_policy == REJECT_NEW:
+                metrics.rejected += 1
+                raise QueueFullError("Слишком много запросов, дождитесь ответа на предыдущие")
+
+            oldest = queue.popleft()
+            oldest_metrics = self._feature_metrics(oldest.feature)
+            oldest_metrics.queued -= 1
+            oldest_metrics.dropped += 1
+            if not oldest.future.done():
+                oldest.future.set_exception(QueueFullError("Запрос вытеснен более новым"))
+
+        job = _Job(asyncio.get_running_loop().create_future(), feature, cost)
+        queue.append(job)
+        metrics.queued += 1
+
+        if user_key not in self._deficits:
+            self._deficits[user_key] = 0.0
+            self._active.append(user_key)
+
+        self._dispatch()
+        return job
+
+    def _release(self):
+        self._free_slots += 1
+        self._dispatch()
+
+    def _dispatch(self):
+        """Раздает свободные слоты по Deficit Round Robin"""
+        while self._free_slots > 0:
+            job = self._next_job()
+            if job is None:
+                return
+
+            metrics = self._feature_metrics(job.feature)
+            metrics.queued -= 1
+            metrics.dispatched += 1
+            metrics.waits.append(time.monotonic() - job.enqueued_at)
+
+            self._free_slots -= 1
+            job.future.set_result(None)
+
+    def _next_job(self) -> Optional[_Job]:
+        while self._active:
+            user_key = self._active[0]
+            queue = self._queues[user_key]
+
+            # Отмененные ожидающие просто выбрасываем из очереди
+            while queue and queue[0].future.done():
+                self._feature_metrics(queue.popleft().feature).queued -= 1
+
+            if not queue:
+                self._active.popleft()
+                del self._deficits[user_key]
+                del self._queues[user_key]
+                continue
+
+            job = queue[0]
+            if self._deficits[user_key] >= job.cost:
+                self._deficits[user_key] -= job.cost
+                queue.popleft()
+                if not queue:
+                    # Опустевшая очередь не копит дефицит (правило DRR)
+                    self._active.popleft()
+                    del self._deficits[user_key]
+                    del self._queues[user_key]
+                return job
+
+            self._deficits[user_key] += QUANTUM * FEATURE_WEIGHTS.get(job.feature, DEFAULT_WEIGHT)
+            self._active.rotate(-1)
+
+        return None
+
+    def stats(self) -> dict:
+        """Глубина очередей и время ожидания по классам запросов"""
+        return {
+            "in_flight": self.in_flight,
+            "users_waiting": len(self._active),
+            "features": {feature: metrics.snapshot() for feature, metrics in self._metrics.items()},
+        }
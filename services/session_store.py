@@ -0,0 +1,209 @@
+import asyncio
+import logging
+import os
+import sqlite3
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+
+class SessionStore(ABC):
+    """
+    Общее хранилище состояния сессий для нескольких процессов бота.
+
+    Значения - непрозрачные байты, сгруппированные по пространствам имен
+    (user_data, chat_data, conversations, ...). Сериализацией занимается
+    вызывающий код, поэтому бэкенды взаимозаменяемы.
+    """
+
+    @abstractmethod
+    async def get(self, namespace: str, key: str) -> Optional[bytes]:
+        ...
+
+    @abstractmethod
+    async def set(self, namespace: str, key: str, value: bytes):
+        ...
+
+    @abstractmethod
+    async def delete(self, namespace: str, key: str):
+        ...
+
+    @abstractmethod
+    async def items(self, namespace: str) -> Dict[str, bytes]:
+        ...
+
+    async def close(self):
+        pass
+
+
+class SQLiteSessionStore(SessionStore):
+    """Хранилище в файле SQLite (WAL): подходит для нескольких процессов на одной машине"""
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "namespace TEXT NOT NULL, key TEXT NOT NULL, value BLOB NOT NULL, "
+            "PRIMARY KEY (namespace, key))"
+        )
+        self._lock = asyncio.Lock()
+
+    async def _run(self, sql: str, params: tuple = ()) -> List[tuple]:
+        # Запросы идут в отдельном потоке, чтобы не блокировать цикл событий
+        async with self._lock:
+            return await asyncio.to_thread(lambda: self._conn.execute(sql, params).fetchall())
+
+    async def get(self, namespace: str, key: str) -> Optional[bytes]:
+        rows = await self._run("SELECT value FROM sessions WHERE namespace = ? AND key = ?", (namespace, key))
+        return rows[0][0] if rows else None
+
+    async def set(self, namespace: str, key: str, value: bytes):
+        await self._run(
+            "INSERT OR REPLACE INTO sessions (namespace, key, value) VALUES (?, ?, ?)",
+            (namespace, key, value)
+        )
+
+    async def delete(self, namespace: str, key: str):
+        await self._run("DELETE FROM sessions WHERE namespace = ? AND key = ?", (namespace, key))
+
+    async def items(self, namespace: str) -> Dict[str, bytes]:
+        rows = await self._run("SELECT key, value FROM sessions WHERE namespace = ?", (namespace,))
+        return dict(rows)
+
+    async def close(self):
+        async with self._lock:
+            self._conn.close()
+
+
+class RespError(Exception):
+    """Ошибка, которую вернул сервер по протоколу RESP"""
+
+
+class RespSessionStore(SessionStore):
+    """
+    Хранилище на сервере с протоколом Redis (RESP2): Redis, Valkey, KeyDB и т.п.
+
+    Каждое пространство имен - хэш {prefix}:{namespace}. Клиент минимальный,
+    без внешних зависимостей: одно соединение, команды выполняются по очереди.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 6379, db: int = 0,
+                 password: Optional[str] = None, prefix: str = "tgbot"):
+        self.host = host
+        self.port = port
+        self.db = db
+        self.password = password
+        self.prefix = prefix
+
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._lock = asyncio.Lock()
+
+    def _hash(self, namespace: str) -> str:
+        return f"{self.prefix}:{namespace}"
+
+    @staticmethod
+    def _encode(*parts) -> bytes:
+        chunks = [f"*{len(parts)}\r\n".encode()]
+        for part in parts:
+            data = part if isinstance(part, bytes) else str(part).encode()
+            chunks.append(f"${len(data)}\r\n".encode())
+            chunks.append(data + b"\r\n")
+        return b"".join(chunks)
+
+    async def _read_reply(self):
+        line = await self._reader.readline()
+        if not line:
+            raise ConnectionError("RESP server closed the connection")
+
+        kind, payload = line[:1], line[1:-2]
+        if kind == b"+":
+            return payload.decode()
+        if kind == b"-":
+            raise RespError(payload.decode())
+        if kind == b":":
+            return int(payload)
+        if kind == b"$":
+            length = int(payload)
+            if length < 0:
+                return None
+            data = await self._reader.readexactly(length + 2)
+            return data[:-2]
+        if kind == b"*":
+            count = int(payload)
+            if count < 0:
+                return None
+            return [await self._read_reply() for _ in range(count)]
+        raise RespError(f"Unexpected RESP reply: {line!r}")
+
+    async def _connect(self):
+        self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+        if self.password:
+            await self._roundtrip("AUTH", self.password)
+        if self.db:
+            await self._roundtrip("SELECT", self.db)
+
+    async def _roundtrip(self, *parts):
+        self._writer.write(self._encode(*parts))
+        await self._writer.drain()
+        return await self._read_reply()
+
+    async def _command(self, *parts):
+        async with self._lock:
+            for attempt in range(2):
+                try:
+                    if self._writer is None:
+                        await self._connect()
+                    return await self._roundtrip(*parts)
+                except (ConnectionError, asyncio.IncompleteReadError, OSError) as e:
+                    # Переподключаемся один раз: сервер мог закрыть простаивающее соединение
+                    self._writer = None
+                    if attempt:
+                        raise
+                    logger.warning(f"RESP connection lost ({e}), reconnecting")
+
+    async def get(self, namespace: str, key: str) -> Optional[bytes]:
+        return await self._command("HGET", self._hash(namespace), key)
+
+    async def set(self, namespace: str, key: str, value: bytes):
+        await self._command("HSET", self._hash(namespace), key, value)
+
+    async def delete(self, namespace: str, key: str):
+        await self._command("HDEL", self._hash(namespace), key)
+
+    async def items(self, namespace: str) -> Dict[str, bytes]:
+        reply = await self._command("HGETALL", self._hash(namespace)) or []
+        return {reply[i].decode(): reply[i + 1] for i in range(0, len(reply), 2)}
+
+    async def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+def create_session_store(url: str) -> SessionStore:
+    """
+    Создает хранилище по URL.
+
+    Args:
+        url: sqlite:///путь/к/файлу.sqlite3 или redis://[:пароль@]хост:порт/номер_бд
+
+    Returns:
+        Хранилище сессий
+    """
+    parsed = urlparse(url)
+    if parsed.scheme == "sqlite":
+        # sqlite:///data/x.sqlite3 - относительный путь, sqlite:////abs/x.sqlite3 - абсолютный
+        return SQLiteSessionStore(url[len("sqlite:///"):])
+    if parsed.scheme == "redis":
+        db = int(parsed.path.lstrip("/") or 0)
+        return RespSessionStore(parsed.hostname or "127.0.0.1", parsed.port or 6379, db, parsed.password)
+    raise ValueError(f"Unsupported session store URL: {url}")
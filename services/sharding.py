@@ -0,0 +1,340 @@
+import asyncio
+import bisect
+import hashlib
+import itertools
+import json
+import logging
+import multiprocessing
+import queue
+import signal
+from typing import Callable, Dict, Hashable, Iterable, List, Optional, Set
+
+from telegram import Bot, Update
+from telegram.ext import Application
+
+from services.update_processor import PerChatUpdateProcessor
+from services.webhook_server import WebhookServer, application_running, check_secret, stop_event_on_signals
+
+logger = logging.getLogger(__name__)
+
+# Виртуальных узлов на рабочий процесс: сглаживает распределение чатов по кольцу
+VIRTUAL_NODES = 64
+
+# Сколько ждать сброса состояния рабочими при перебалансировке (секунды)
+FLUSH_TIMEOUT = 60.0
+
+# Как часто проверять, живы ли рабочие процессы (секунды)
+HEALTH_CHECK_INTERVAL = 5.0
+
+# Команды рабочему процессу
+UPDATE = "update"
+FLUSH = "flush"
+STOP = "stop"
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """
+    Консистентное хэширование ключей (chat_id) на рабочие процессы.
+
+    При добавлении или удалении процесса переезжает только доля ключей,
+    соседних с его точками на кольце, а не все ключи.
+    """
+
+    def __init__(self, nodes: Iterable[int], vnodes: int = VIRTUAL_NODES):
+        self.nodes = sorted(set(nodes))
+        self.vnodes = vnodes
+        points = sorted((_hash(f"{node}:{i}"), node) for node in self.nodes for i in range(vnodes))
+        self._points = [point for point, _ in points]
+        self._owners = [node for _, node in points]
+
+    def owner_of_point(self, point: int) -> int:
+        index = bisect.bisect_left(self._points, point)
+        return self._owners[index % len(self._owners)]
+
+    def node_for(self, key: Hashable) -> int:
+        return self.owner_of_point(_hash(str(key)))
+
+    def gaining_nodes(self, new_ring: "HashRing") -> Set[int]:
+        """Узлы, которые при переходе на new_ring получают ключи от других узлов"""
+        gaining = set()
+        # Владелец постоянен на каждом отрезке между соседними точками двух колец,
+        # поэтому достаточно сравнить владельцев в самих точках
+        for point in set(self._points) | set(new_ring._points):
+            old_owner, new_owner = self.owner_of_point(point), new_ring.owner_of_point(point)
+            if old_owner != new_owner and new_owner in self.nodes:
+                gaining.add(new_owner)
+        return gaining
+
+
+def _worker_main(index: int, factory: Callable[[int], Application],
+                 inbox: multiprocessing.Queue, outbox: multiprocessing.Queue):
+    """Точка входа рабочего процесса"""
+    # Останавливает рабочих фронт, а не Ctrl+C из терминала
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(_serve_worker(index, factory(index), inbox, outbox))
+
+
+async def _serve_worker(index: int, application: Application,
+                        inbox: multiprocessing.Queue, outbox: multiprocessing.Queue):
+    loop = asyncio.get_running_loop()
+    async with application_running(application):
+        logger.info(f"Worker {index} started")
+        while True:
+            command, payload = await loop.run_in_executor(None, inbox.get)
+
+            if command == UPDATE:
+                await application.update_queue.put(Update.de_json(json.loads(payload), application.bot))
+            elif command == FLUSH:
+                # Дожидаемся обработки уже принятых обновлений и сбрасываем состояние в хранилище
+                await application.update_queue.join()
+                await application.update_persistence()
+                outbox.put((index, payload))
+            elif command == STOP:
+                await application.update_queue.join()
+                break
+
+    logger.info(f"Worker {index} stopped")
+
+
+class ShardRouter:
+    """
+    Фронт многопроцессного режима: распределяет обновления по рабочим процессам.
+
+    Ключ обновления (чат, а без чата - пользователь) хэшируется на кольцо,
+    поэтому все обновления одного чата обрабатывает один процесс и их порядок
+    сохраняется. Состояние user_data/chat_data/диалогов рабочие держат в общем
+    SessionStore через StorePersistence.
+
+    Перебалансировка (resize) безопасна: на время нее прием приостанавливается,
+    процессы, теряющие чаты, сбрасывают состояние в хранилище, а процессы,
+    получающие чужие чаты, перезапускаются и читают состояние заново
+    (состояние ConversationHandler загружается только при старте).
+    """
+
+    def __init__(self, factory: Callable[[int], Application], workers: int, queue_size: int = 1000):
+        self.factory = factory
+        self.queue_size = queue_size
+
+        self._context = multiprocessing.get_context("spawn")
+        self._outbox = self._context.Queue()
+        self._inboxes: Dict[int, multiprocessing.Queue] = {}
+        self._processes: Dict[int, multiprocessing.Process] = {}
+        self._ring = HashRing(range(workers))
+        self._paused = False
+        self._resize_lock = asyncio.Lock()
+        self._flush_tokens = itertools.count()
+        self._health_task: Optional[asyncio.Task] = None
+
+        self.routed: Dict[int, int] = {}
+        self.rejected = 0
+
+    @property
+    def workers(self) -> List[int]:
+        return list(self._ring.nodes)
+
+    def _spawn(self, index: int):
+        inbox = self._inboxes.get(index)
+        if inbox is None:
+            # Очередь переживает перезапуск процесса: принятые обновления не теряются
+            inbox = self._inboxes[index] = self._context.Queue(maxsize=self.queue_size)
+        process = self._context.Process(
+            target=_worker_main,
+            args=(index, self.factory, inbox, self._outbox),
+            name=f"bot-worker-{index}",
+            daemon=True
+        )
+        process.start()
+        self._processes[index] = process
+
+    async def _stop_worker(self, index: int):
+        self._inboxes[index].put((STOP, None))
+        process = self._processes.pop(index)
+        await asyncio.get_running_loop().run_in_executor(None, process.join)
+
+    def start(self):
+        for index in self._ring.nodes:
+            self._spawn(index)
+        self._health_task = asyncio.create_task(self._health_check())
+
+    async def stop(self):
+        if self._health_task is not None:
+            self._health_task.cancel()
+        await asyncio.gather(*(self._stop_worker(index) for index in list(self._processes)))
+
+    async def _health_check(self):
+        """Перезапускает упавшие рабочие процессы с тем же номером (кольцо не меняется)"""
+        while True:
+            await asyncio.sleep(HEALTH_CHECK_INTERVAL)
+            for index, process in list(self._processes.items()):
+                if not process.is_alive() and not self._resize_lock.locked():
+                    logger.error(f"Worker {index} exited with code {process.exitcode}, restarting")
+                    self._spawn(index)
+
+    # Маршрутизация
+
+    def worker_for(self, update: Update) -> int:
+        key = PerChatUpdateProcessor.chat_key(update)
+        return self._ring.node_for(key) if key is not None else self._ring.nodes[0]
+
+    def submit_nowait(self, update: Update, payload: bytes) -> bool:
+        """Неблокирующая передача обновления (webhook): False при переполнении или перебалансировке"""
+        if self._paused:
+            self.rejected += 1
+            return False
+
+        index = self.worker_for(update)
+        try:
+            self._inboxes[index].put_nowait((UPDATE, payload.decode()))
+        except queue.Full:
+            self.rejected += 1
+            return False
+        self.routed[index] = self.routed.get(index, 0) + 1
+        return True
+
+    async def submit(self, update: Update, payload: str):
+        """Передача обновления с ожиданием места в очереди процесса (polling)"""
+        # Перебалансировка ждет, пока обновление встанет в очередь своего процесса
+        async with self._resize_lock:
+            index = self.worker_for(update)
+            await asyncio.get_running_loop().run_in_executor(None, self._inboxes[index].put, (UPDATE, payload))
+        self.routed[index] = self.routed.get(index, 0) + 1
+
+    # Перебалансировка
+
+    async def resize(self, workers: int):
+        """
+        Меняет число рабочих процессов.
+
+        Args:
+            workers: Новое число процессов
+        """
+        async with self._resize_lock:
+            new_ring = HashRing(range(workers))
+            old_nodes = set(self._ring.nodes)
+            new_nodes = set(new_ring.nodes)
+            gaining = self._ring.gaining_nodes(new_ring)
+            removed = old_nodes - new_nodes
+            flushing = old_nodes - removed - gaining
+
+            self._paused = True
+            try:
+                # Команды встают в очереди после уже принятых обновлений
+                restarting = removed | gaining
+                await asyncio.gather(*(self._stop_worker(index) for index in restarting))
+                await self._flush(flushing)
+
+                for index in removed:
+                    self._inboxes.pop(index)
+                for index in sorted(gaining | (new_nodes - old_nodes)):
+                    self._spawn(index)
+
+                self._ring = new_ring
+            finally:
+                self._paused = False
+
+            logger.info(
+                f"Rebalanced to {workers} workers: restarted {sorted(gaining)}, "
+                f"added {sorted(new_nodes - old_nodes)}, removed {sorted(removed)}"
+            )
+
+    async def _flush(self, indexes: Set[int]):
+        token = f"flush-{next(self._flush_tokens)}"
+        for index in indexes:
+            self._inboxes[index].put((FLUSH, token))
+
+        loop = asyncio.get_running_loop()
+        waiting = set(indexes)
+        while waiting:
+            try:
+                index, reply = await loop.run_in_executor(None, self._outbox.get, True, FLUSH_TIMEOUT)
+            except queue.Empty:
+                logger.error(f"Workers {sorted(waiting)} did not flush in {FLUSH_TIMEOUT}s")
+                return
+            if reply == token:
+                waiting.discard(index)
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "alive": sorted(index for index, process in self._processes.items() if process.is_alive()),
+            "routed": dict(self.routed),
+            "rejected": self.rejected,
+        }
+
+
+def _resize_signals(router: ShardRouter):
+    """SIGUSR1 добавляет рабочий процесс, SIGUSR2 убирает"""
+    loop = asyncio.get_running_loop()
+
+    def resize(delta: int):
+        workers = max(1, len(router.workers) + delta)
+        asyncio.ensure_future(router.resize(workers))
+
+    for sig, delta in (("SIGUSR1", 1), ("SIGUSR2", -1)):
+        if hasattr(signal, sig):
+            loop.add_signal_handler(getattr(signal, sig), resize, delta)
+
+
+async def serve_sharded_polling(token: str, router: ShardRouter):
+    """Фронт в режиме polling: получает обновления и раздает их рабочим процессам"""
+    stop_event = stop_event_on_signals()
+    router.start()
+    _resize_signals(router)
+
+    async with Bot(token) as bot:
+        await bot.delete_webhook()
+        offset: Optional[int] = None
+        try:
+            while not stop_event.is_set():
+                poll = asyncio.ensure_future(
+                    bot.get_updates(offset=offset, timeout=30, allowed_updates=Update.ALL_TYPES)
+                )
+                stopping = asyncio.ensure_future(stop_event.wait())
+                await asyncio.wait((poll, stopping), return_when=asyncio.FIRST_COMPLETED)
+                stopping.cancel()
+                if not poll.done():
+                    poll.cancel()
+                    break
+
+                try:
+                    updates = poll.result()
+                except Exception as e:
+                    logger.error(f"getUpdates failed: {e}")
+                    await asyncio.sleep(1)
+                    continue
+
+                for update in updates:
+                    await router.submit(update, update.to_json())
+                    offset = update.update_id + 1
+        finally:
+            await router.stop()
+            # Подтверждаем полученные обновления, чтобы после перезапуска они не пришли снова
+            if offset is not None:
+                await bot.get_updates(offset=offset, timeout=0)
+
+
+async def serve_sharded_webhook(router: ShardRouter, server: WebhookServer, token: str, webhook_url: str = ""):
+    """Фронт в режиме webhook: принимает обновления и раздает их рабочим процессам"""
+    check_secret(server, webhook_url)
+    stop_event = stop_event_on_signals()
+    router.start()
+    _resize_signals(router)
+
+    if webhook_url:
+        async with Bot(token) as bot:
+            await bot.set_webhook(
+                url=webhook_url,
+                secret_token=server.secret_token,
+                allowed_updates=Update.ALL_TYPES
+            )
+
+    await server.start()
+    try:
+        await stop_event.wait()
+    finally:
+        await server.stop()
+        await router.stop()
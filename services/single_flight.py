@@ -0,0 +1,74 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Места вызова, где одинаковые одновременные запросы можно объединять.
+# Ответы личностей, резюме и фоновая предгенерация должны оставаться независимыми,
+# а /gpt отвечает потоком, который не объединяется.
+COALESCED_CALL_SITES = {"translator", "random_fact"}
+
+
+def should_coalesce(call_site: Optional[str]) -> bool:
+    """Можно ли объединять одновременные запросы этого места вызова"""
+    return call_site in COALESCED_CALL_SITES
+
+
+class SingleFlight:
+    """
+    Объединение одинаковых запросов, выполняющихся одновременно.
+
+    Первый вызывающий с данным ключом запускает общую задачу, остальные
+    ждут её же результат. Отмена одного ожидающего не отменяет общую задачу,
+    а исключение получают все ожидающие.
+    """
+
+    def __init__(self):
+        self.started = 0
+        self.shared = 0
+        self._calls: Dict[str, asyncio.Task] = {}
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._calls)
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Выполняет fn один раз для всех одновременных вызовов с ключом key.
+
+        Args:
+            key: Ключ запроса (например, ключ кэша)
+            fn: Фабрика корутины, выполняющей запрос
+
+        Returns:
+            Результат общей задачи
+        """
+        task = self._calls.get(key)
+
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda done, key=key: self._forget(key, done))
+            self.started += 1
+        else:
+            self.shared += 1
+
+        # shield не дает отмене одного ожидающего отменить запрос для остальных
+        return await asyncio.shield(task)
+
+    def _forget(self, key: str, task: asyncio.Task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+
+        # Забираем исключение, даже если все ожидающие уже отменились,
+        # чтобы asyncio не писал "exception was never retrieved"
+        if not task.cancelled() and task.exception() is not None:
+            logger.debug(f"Shared request {key} failed: {task.exception()}")
+
+    def stats(self) -> dict:
+        return {
+            "started": self.started,
+            "shared": self.shared,
+            "in_flight": self.in_flight,
+        }
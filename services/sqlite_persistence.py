@@ -0,0 +1,255 @@
+import asyncio
+import json
+import logging
+import os
+import pickle
+import sqlite3
+import time
+import zlib
+from typing import Dict, List, Optional, Set, Tuple
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+from services.user_session import restore_into
+
+logger = logging.getLogger(__name__)
+
+# Значения длиннее порога сжимаются zlib, если это дает выигрыш
+COMPRESS_THRESHOLD = 512
+
+# Префикс формата значения: обычный pickle или сжатый
+RAW = b"p"
+COMPRESSED = b"z"
+
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS user_data (id INTEGER PRIMARY KEY, data BLOB NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS chat_data (id INTEGER PRIMARY KEY, data BLOB NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS bot_data (id INTEGER PRIMARY KEY CHECK (id = 0), data BLOB NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS conversations ("
+    "name TEXT NOT NULL, key TEXT NOT NULL, state BLOB NOT NULL, PRIMARY KEY (name, key)) WITHOUT ROWID",
+)
+
+
+def dumps(data) -> bytes:
+    """Компактная сериализация: pickle последней версии, крупные значения сжимаются"""
+    raw = pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+    if len(raw) > COMPRESS_THRESHOLD:
+        compressed = zlib.compress(raw, 1)
+        if len(compressed) < len(raw):
+            return COMPRESSED + compressed
+    return RAW + raw
+
+
+def loads(value: bytes):
+    if value[:1] == COMPRESSED:
+        return pickle.loads(zlib.decompress(value[1:]))
+    return pickle.loads(value[1:])
+
+
+class SQLitePersistence(BasePersistence):
+    """
+    Инкрементальная persistence PTB в файле SQLite.
+
+    В отличие от PicklePersistence, которая при каждом сохранении
+    перезаписывает весь файл, здесь пишутся только изменившиеся записи:
+    PTB передает в update_* лишь пользователей и чаты, затронутые с прошлого
+    сохранения, а все вызовы одного прогона update_persistence собираются
+    в одну транзакцию.
+
+    user_data и chat_data не загружаются при старте: запись читается из базы
+    при первом обращении (PTB вызывает refresh_* перед обработкой обновления),
+    поэтому старт не зависит от числа пользователей.
+    """
+
+    def __init__(self, path: str, update_interval: float = 60.0):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=True, chat_data=True, user_data=True, callback_data=False),
+            update_interval=update_interval
+        )
+        self.path = path
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        for statement in SCHEMA:
+            self._conn.execute(statement)
+
+        self._lock = asyncio.Lock()
+        # Записи, уже прочитанные из базы (или созданные в этом процессе)
+        self._loaded_users: Set[int] = set()
+        self._loaded_chats: Set[int] = set()
+        self._bot_data: Optional[bytes] = None
+
+        # Изменения текущего прогона: (таблица, ключ) -> значение или None (удаление)
+        self._pending: Dict[Tuple[str, object], Optional[bytes]] = {}
+        self._batch: Optional[asyncio.Future] = None
+
+        self.batches = 0
+        self.rows_written = 0
+        self.lazy_loads = 0
+        self.last_batch_seconds = 0.0
+
+    async def _query(self, sql: str, params: tuple = ()) -> List[tuple]:
+        async with self._lock:
+            return await asyncio.to_thread(lambda: self._conn.execute(sql, params).fetchall())
+
+    # Пакетная запись
+
+    def _write(self, table: str, key, value: Optional[bytes]) -> asyncio.Future:
+        """Ставит запись в текущий пакет и возвращает future его сохранения"""
+        self._pending[(table, key)] = value
+        if self._batch is None:
+            self._batch = asyncio.get_running_loop().create_future()
+            asyncio.create_task(self._commit_batch(self._batch))
+        return self._batch
+
+    async def _commit_batch(self, batch: asyncio.Future):
+        # Даем остальным update_* того же прогона update_persistence попасть в пакет
+        await asyncio.sleep(0)
+        pending, self._pending = self._pending, {}
+        self._batch = None
+        try:
+            async with self._lock:
+                await asyncio.to_thread(self._commit, pending)
+            batch.set_result(None)
+        except Exception as e:
+            logger.error(f"Failed to persist {len(pending)} records: {e}")
+            batch.set_exception(e)
+            # Исключение получат вызвавшие update_*, здесь оно уже залогировано
+            batch.exception()
+
+    def _commit(self, pending: Dict[Tuple[str, object], Optional[bytes]]):
+        started = time.perf_counter()
+        upserts: Dict[str, list] = {}
+        deletes: Dict[str, list] = {}
+        for (table, key), value in pending.items():
+            if value is None:
+                deletes.setdefault(table, []).append(key)
+            else:
+                upserts.setdefault(table, []).append((key, value))
+
+        conn = self._conn
+        conn.execute("BEGIN")
+        try:
+            for table, rows in upserts.items():
+                if table == "conversations":
+                    conn.executemany(
+                        "INSERT OR REPLACE INTO conversations (name, key, state) VALUES (?, ?, ?)",
+                        [(name, key, value) for (name, key), value in rows]
+                    )
+                else:
+                    conn.executemany(f"INSERT OR REPLACE INTO {table} (id, data) VALUES (?, ?)", rows)
+            for table, keys in deletes.items():
+                if table == "conversations":
+                    conn.executemany("DELETE FROM conversations WHERE name = ? AND key = ?", keys)
+                else:
+                    conn.executemany(f"DELETE FROM {table} WHERE id = ?", [(key,) for key in keys])
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+        self.batches += 1
+        self.rows_written += len(pending)
+        self.last_batch_seconds = time.perf_counter() - started
+
+    # Загрузка
+
+    async def get_user_data(self) -> Dict[int, object]:
+        # Загружается лениво в refresh_user_data
+        return {}
+
+    async def get_chat_data(self) -> Dict[int, dict]:
+        return {}
+
+    async def get_bot_data(self) -> dict:
+        rows = await self._query("SELECT data FROM bot_data WHERE id = 0")
+        if not rows:
+            return {}
+        self._bot_data = rows[0][0]
+        return loads(self._bot_data)
+
+    async def get_callback_data(self) -> None:
+        return None
+
+    async def get_conversations(self, name: str) -> Dict[tuple, object]:
+        rows = await self._query("SELECT key, state FROM conversations WHERE name = ?", (name,))
+        return {tuple(json.loads(key)): loads(state) for key, state in rows}
+
+    async def _load_once(self, table: str, loaded: Set[int], key: int, data: dict):
+        if key in loaded:
+            return
+        loaded.add(key)
+        rows = await self._query(f"SELECT data FROM {table} WHERE id = ?", (key,))
+        if rows:
+            self.lazy_loads += 1
+            restore_into(data, loads(rows[0][0]))
+
+    async def refresh_user_data(self, user_id: int, user_data) -> None:
+        await self._load_once("user_data", self._loaded_users, user_id, user_data)
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict) -> None:
+        await self._load_once("chat_data", self._loaded_chats, chat_id, chat_data)
+
+    async def refresh_bot_data(self, bot_data: dict) -> None:
+        pass
+
+    # Сохранение
+
+    async def update_user_data(self, user_id: int, data) -> None:
+        self._loaded_users.add(user_id)
+        await self._write("user_data", user_id, dumps(data))
+
+    async def update_chat_data(self, chat_id: int, data: dict) -> None:
+        self._loaded_chats.add(chat_id)
+        await self._write("chat_data", chat_id, dumps(data))
+
+    async def update_bot_data(self, data: dict) -> None:
+        # PTB сохраняет bot_data на каждом прогоне - пишем только при изменении
+        value = dumps(data)
+        if value == self._bot_data:
+            return
+        self._bot_data = value
+        await self._write("bot_data", 0, value)
+
+    async def update_callback_data(self, data) -> None:
+        pass
+
+    async def update_conversation(self, name: str, key: tuple, new_state: Optional[object]) -> None:
+        value = dumps(new_state) if new_state is not None else None
+        await self._write("conversations", (name, json.dumps(list(key))), value)
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._loaded_users.discard(user_id)
+        await self._write("user_data", user_id, None)
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        self._loaded_chats.discard(chat_id)
+        await self._write("chat_data", chat_id, None)
+
+    def forget_user_data(self, user_id: int) -> None:
+        """Сессия выгружена из памяти: при следующем обращении запись прочитается заново"""
+        self._loaded_users.discard(user_id)
+
+    async def flush(self) -> None:
+        if self._batch is not None:
+            try:
+                await self._batch
+            except Exception:
+                pass
+        async with self._lock:
+            self._conn.close()
+        logger.info(f"Persistence closed: {self.stats()}")
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "rows_written": self.rows_written,
+            "lazy_loads": self.lazy_loads,
+            "loaded_users": len(self._loaded_users),
+            "last_batch_ms": round(self.last_batch_seconds * 1000, 2),
+        }
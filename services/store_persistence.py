@@ -0,0 +1,124 @@
+import json
+import logging
+import pickle
+from typing import Dict, Optional, Tuple
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+from services.session_store import SessionStore
+from services.user_session import restore_into
+
+logger = logging.getLogger(__name__)
+
+USER_DATA = "user_data"
+CHAT_DATA = "chat_data"
+BOT_DATA = "bot_data"
+CONVERSATIONS = "conversations"
+
+
+class StorePersistence(BasePersistence):
+    """
+    Persistence PTB поверх общего SessionStore.
+
+    Несколько рабочих процессов читают и пишут одно хранилище. Перед каждым
+    обновлением PTB вызывает refresh_*: если запись в хранилище изменил другой
+    процесс (например, чат переехал на этот процесс при перебалансировке),
+    локальная копия заменяется. Если в хранилище лежит то, что этот процесс
+    сам записал или прочитал, локальная копия остается как есть - в ней могут
+    быть еще не сброшенные изменения.
+    """
+
+    def __init__(self, store: SessionStore, update_interval: float = 5.0):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=True, chat_data=True, user_data=True, callback_data=False),
+            update_interval=update_interval
+        )
+        self.store = store
+        # Последнее известное этому процессу содержимое записей
+        self._known: Dict[Tuple[str, str], bytes] = {}
+
+    async def _load(self, namespace: str, key: str) -> Optional[bytes]:
+        value = await self.store.get(namespace, key)
+        if value is not None:
+            self._known[(namespace, key)] = value
+        return value
+
+    async def _save(self, namespace: str, key: str, data) -> None:
+        value = pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+        if self._known.get((namespace, key)) == value:
+            return
+        await self.store.set(namespace, key, value)
+        self._known[(namespace, key)] = value
+
+    async def _drop(self, namespace: str, key: str) -> None:
+        await self.store.delete(namespace, key)
+        self._known.pop((namespace, key), None)
+
+    async def _refresh(self, namespace: str, key: str, data) -> None:
+        value = await self.store.get(namespace, key)
+        if value is None or self._known.get((namespace, key)) == value:
+            return
+        self._known[(namespace, key)] = value
+        restore_into(data, pickle.loads(value))
+
+    async def get_user_data(self) -> Dict[int, object]:
+        # Загружается лениво в refresh_user_data при первом обновлении от пользователя
+        return {}
+
+    async def get_chat_data(self) -> Dict[int, dict]:
+        return {}
+
+    async def get_bot_data(self) -> dict:
+        value = await self._load(BOT_DATA, "")
+        return pickle.loads(value) if value is not None else {}
+
+    async def get_callback_data(self) -> None:
+        return None
+
+    async def get_conversations(self, name: str) -> Dict[tuple, object]:
+        namespace = f"{CONVERSATIONS}:{name}"
+        return {
+            tuple(json.loads(key)): pickle.loads(value)
+            for key, value in (await self.store.items(namespace)).items()
+        }
+
+    async def update_conversation(self, name: str, key: tuple, new_state: Optional[object]) -> None:
+        namespace = f"{CONVERSATIONS}:{name}"
+        if new_state is None:
+            await self.store.delete(namespace, json.dumps(list(key)))
+        else:
+            await self.store.set(namespace, json.dumps(list(key)), pickle.dumps(new_state))
+
+    async def update_user_data(self, user_id: int, data) -> None:
+        await self._save(USER_DATA, str(user_id), data)
+
+    async def update_chat_data(self, chat_id: int, data: dict) -> None:
+        await self._save(CHAT_DATA, str(chat_id), data)
+
+    async def update_bot_data(self, data: dict) -> None:
+        await self._save(BOT_DATA, "", data)
+
+    async def update_callback_data(self, data) -> None:
+        pass
+
+    async def drop_user_data(self, user_id: int) -> None:
+        await self._drop(USER_DATA, str(user_id))
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        await self._drop(CHAT_DATA, str(chat_id))
+
+    def forget_user_data(self, user_id: int) -> None:
+        """Сессия выгружена из памяти: при следующем обращении запись восстановится из хранилища"""
+        self._known.pop((USER_DATA, str(user_id)), None)
+
+    async def refresh_user_data(self, user_id: int, user_data) -> None:
+        await self._refresh(USER_DATA, str(user_id), user_data)
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict) -> None:
+        await self._refresh(CHAT_DATA, str(chat_id), chat_data)
+
+    async def refresh_bot_data(self, bot_data: dict) -> None:
+        await self._refresh(BOT_DATA, "", bot_data)
+
+    async def flush(self) -> None:
+        await self.store.close()
@@ -0,0 +1,442 @@
+import asyncio
+import hashlib
+import itertools
+import logging
+import os
+import re
+import sqlite3
+import time
+from collections import Counter, OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from services.quiz_grader import DIGITS_RE, edit_distance
+from config import (
+    TRANSLATION_MEMORY_PATH,
+    TRANSLATION_MEMORY_MAX_SEGMENTS,
+    TRANSLATION_MEMORY_FUZZY_THRESHOLD
+)
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS segments ("
+    "lang TEXT NOT NULL, key BLOB NOT NULL, source TEXT NOT NULL, translation TEXT NOT NULL, "
+    "used_at REAL NOT NULL, PRIMARY KEY (lang, key)) WITHOUT ROWID",
+    "CREATE INDEX IF NOT EXISTS segments_used_at ON segments (used_at)",
+)
+
+# Предложение: до конца строки или до знака конца предложения, после которого
+# идет конец текста или не строчная буква ("т. е. так" не делится на предложения)
+SEGMENT_RE = re.compile(
+    r"\S[^\n]*?(?:[.!?…]+[\"'»”)\]]*(?=[ \t]*(?:\n|$)|[ \t]+[^\sa-zа-яё])|(?=[ \t]*(?:\n|$)))"
+)
+WHITESPACE_RE = re.compile(r"\s+")
+
+# Точка после сокращения или инициала не заканчивает предложение ("Mr. Smith",
+# "А. С. Пушкин", "и т.д. и т.п."): такой отрезок склеивается со следующим
+ABBREVIATION_RE = re.compile(
+    r"(?:^|[\s(«\"'])(?:\w|\w+\.\w+|mr|mrs|ms|dr|prof|st|jr|sr|vs|fig|"
+    r"гг|ул|им|проф|акад|др|см|стр|рис|тыс|млн|млрд|руб|коп)\.$",
+    re.IGNORECASE
+)
+
+# Нечеткий поиск: по триграммам символов, только для предложений такой длины
+# (в коротких одна буква часто меняет смысл: "готов" и "готова")
+NGRAM_SIZE = 3
+MIN_FUZZY_LENGTH = 20
+MAX_FUZZY_LENGTH = 300
+# Предел просматриваемых номеров записей на один поиск: если даже редкие триграммы
+# встречаются в тысячах записей, поиск похожего не стоит задержки ответа
+MAX_FUZZY_POSTINGS = 20000
+# Сколько кандидатов с наибольшим числом общих редких триграмм проверять расстоянием Левенштейна
+FUZZY_CANDIDATES = 16
+
+# Способы получения перевода предложения
+EXACT = "exact"
+FUZZY = "fuzzy"
+COPY = "copy"
+
+
+def normalize_segment(text: str) -> str:
+    """Нижний регистр, ё -> е, одинарные пробелы; знаки препинания сохраняются"""
+    return WHITESPACE_RE.sub(" ", text.lower().replace("ё", "е")).strip()
+
+
+def segment_key(normalized: str) -> bytes:
+    return hashlib.blake2b(normalized.encode("utf-8"), digest_size=16).digest()
+
+
+def ngrams(normalized: str) -> set:
+    return {normalized[i:i + NGRAM_SIZE] for i in range(len(normalized) - NGRAM_SIZE + 1)}
+
+
+def split_segments(text: str) -> Tuple[List[str], List[str]]:
+    """
+    Делит текст на предложения.
+
+    Returns:
+        (предложения, промежутки): промежутков на один больше, текст
+        собирается обратно как gaps[0] + segments[0] + gaps[1] + ... + gaps[-1]
+    """
+    segments, gaps, position = [], [], 0
+    for match in SEGMENT_RE.finditer(text):
+        gap = text[position:match.start()]
+        if segments and "\n" not in gap and ABBREVIATION_RE.search(segments[-1]):
+            segments[-1] += gap + match.group()
+        else:
+            gaps.append(gap)
+            segments.append(match.group())
+        position = match.end()
+    gaps.append(text[position:])
+    return segments, gaps
+
+
+def match_case(source: str, stored_source: str, translation: str) -> str:
+    """Переносит регистр первой буквы запроса на перевод, найденный для другого регистра"""
+    first = next((char for char in source if char.isalpha()), "")
+    stored = next((char for char in stored_source if char.isalpha()), "")
+    if not first or first.isupper() == stored.isupper():
+        return translation
+    for index, char in enumerate(translation):
+        if char.isalpha():
+            changed = char.upper() if first.isupper() else char.lower()
+            return translation[:index] + changed + translation[index + 1:]
+    return translation
+
+
+class _Entry:
+    __slots__ = ("id", "source", "translation")
+
+    def __init__(self, entry_id: int, source: str, translation: str):
+        self.id = entry_id
+        self.source = source
+        self.translation = translation
+
+
+class TranslationPlan:
+    """
+    Текст, разобранный на предложения, с переводами, найденными в памяти.
+
+    Attributes:
+        lang: Код языка перевода
+        segments: Предложения текста
+        translations: Переводы предложений (None - нужно перевести)
+        methods: Как получен перевод: exact, copy, fuzzy (перевод нужен,
+            но есть образец) или None
+        references: Для fuzzy - похожее предложение из памяти и его перевод
+    """
+
+    def __init__(self, lang: str, segments: List[str], gaps: List[str]):
+        self.lang = lang
+        self.segments = segments
+        self.gaps = gaps
+        self.translations: List[Optional[str]] = [None] * len(segments)
+        self.methods: List[Optional[str]] = [None] * len(segments)
+        self.references: List[Optional[Tuple[str, str]]] = [None] * len(segments)
+
+    @property
+    def missing(self) -> List[int]:
+        """Номера предложений, которых нет в памяти"""
+        return [index for index, translation in enumerate(self.translations) if translation is None]
+
+    def count(self, method: Optional[str]) -> int:
+        return self.methods.count(method)
+
+    def assemble(self) -> str:
+        parts = [self.gaps[0]]
+        for translation, gap in zip(self.translations, self.gaps[1:]):
+            parts.append(translation)
+            parts.append(gap)
+        return "".join(parts).strip()
+
+
+class TranslationMemory:
+    """
+    Память переводов /translate: переводы отдельных предложений по языкам.
+
+    Точное совпадение ищется по хэшу нормализованного предложения, близкое -
+    через инвертированный индекс триграмм с проверкой расстоянием
+    Левенштейна (и совпадением чисел). В API уходят только предложения,
+    которых нет в памяти; перевод близкого предложения не подставляется
+    как есть (отличие в одно слово может быть отрицанием), а передается
+    модели образцом. Записи держатся в памяти в порядке использования
+    и вытесняются сверх max_segments; SQLite хранит ту же выборку между
+    перезапусками: новые записи, отметки использования и вытеснения
+    сохраняются одной транзакцией.
+    """
+
+    def __init__(self, path: str, max_segments: int = 20000, fuzzy_threshold: float = 0.9):
+        self.path = path
+        self.max_segments = max_segments
+        self.fuzzy_threshold = fuzzy_threshold
+
+        self._entries: "OrderedDict[Tuple[str, bytes], _Entry]" = OrderedDict()
+        self._by_id: Dict[int, Tuple[str, bytes]] = {}
+        # Язык -> триграмма -> номера записей; номера вытесненных записей
+        # удаляются при перестройке индекса
+        self._index: Dict[str, Dict[str, List[int]]] = {}
+        self._dead_postings = 0
+        self._ids = itertools.count()
+
+        self._dirty: Dict[Tuple[str, bytes], _Entry] = {}
+        self._evicted: List[Tuple[str, bytes]] = []
+        self._lock = asyncio.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+        self.texts = 0
+        self.full_text_hits = 0
+        self.segments = 0
+        self.segment_hits = 0
+        self.fuzzy_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def load(self):
+        """Открывает базу и загружает последние использованные записи (пустой путь - только память)"""
+        if not self.path:
+            return
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        try:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            for statement in SCHEMA:
+                self._conn.execute(statement)
+            rows = self._conn.execute(
+                "SELECT lang, key, source, translation, used_at FROM segments ORDER BY used_at DESC LIMIT ?",
+                (self.max_segments,)
+            ).fetchall()
+            # Записи сверх лимита (например, после его уменьшения) больше не понадобятся
+            if len(rows) == self.max_segments:
+                self._conn.execute("DELETE FROM segments WHERE used_at < ?", (rows[-1][4],))
+        except sqlite3.Error as e:
+            logger.error(f"Failed to open translation memory {self.path!r}, using memory only: {e}")
+            self._conn = None
+            return
+
+        for lang, key, source, translation, _ in reversed(rows):
+            self._insert(lang, bytes(key), source, translation)
+        logger.info(f"Translation memory loaded: {len(self._entries)} segments")
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def lookup(self, text: str, lang: str) -> TranslationPlan:
+        """
+        Разбирает текст на предложения и подставляет переводы из памяти.
+
+        Args:
+            text: Текст для перевода
+            lang: Код языка перевода
+
+        Returns:
+            TranslationPlan; предложения из plan.missing нужно перевести
+            и передать в remember()
+        """
+        plan = TranslationPlan(lang, *split_segments(text))
+        for index, segment in enumerate(plan.segments):
+            # Числа, эмодзи и знаки препинания переводить не нужно
+            if not any(char.isalpha() for char in segment):
+                plan.translations[index], plan.methods[index] = segment, COPY
+                continue
+
+            self.segments += 1
+            normalized = normalize_segment(segment)
+            key = (lang, segment_key(normalized))
+            entry = self._entries.get(key)
+            if entry is not None:
+                self.segment_hits += 1
+                plan.translations[index] = match_case(segment, entry.source, entry.translation)
+                plan.methods[index] = EXACT
+            else:
+                entry = self._find_similar(lang, normalized)
+                if entry is None:
+                    self.misses += 1
+                    continue
+                # Предложение переводит модель, перевод похожего служит ей образцом
+                self.fuzzy_hits += 1
+                plan.references[index] = (entry.source, entry.translation)
+                plan.methods[index] = FUZZY
+                key = self._by_id[entry.id]
+
+            self._entries.move_to_end(key)
+            self._dirty[key] = entry
+
+        self.texts += 1
+        if not plan.missing:
+            self.full_text_hits += 1
+        return plan
+
+    def _edit_limit(self, length: int) -> int:
+        """Наибольшее число правок, при котором сходство еще не ниже fuzzy_threshold"""
+        # Без поправки 40 * (1 - 0.9) дает 3.999... и предел занижается
+        return int(length * (1 - self.fuzzy_threshold) + 1e-9)
+
+    def _find_similar(self, lang: str, normalized: str) -> Optional[_Entry]:
+        """Запись, сходство которой с предложением не ниже fuzzy_threshold"""
+        index = self._index.get(lang)
+        if not index or self.fuzzy_threshold >= 1 or not MIN_FUZZY_LENGTH <= len(normalized) <= MAX_FUZZY_LENGTH:
+            return None
+
+        # Одна правка меняет не больше NGRAM_SIZE триграмм, поэтому у подходящей записи
+        # есть хотя бы одна из NGRAM_SIZE * limit + 1 самых редких триграмм предложения:
+        # кандидаты ищутся только по ним, частые триграммы (" и ", "ени") не просматриваются
+        limit = self._edit_limit(len(normalized))
+        grams = ngrams(normalized)
+        required = len(grams) - NGRAM_SIZE * limit
+        postings = sorted((index.get(gram, ()) for gram in grams), key=len)
+        prefix = postings[:NGRAM_SIZE * limit + 1]
+        if sum(map(len, prefix)) > MAX_FUZZY_POSTINGS:
+            return None
+        shared = Counter()
+        for entry_ids in prefix:
+            shared.update(entry_ids)
+
+        digits = DIGITS_RE.findall(normalized)
+        best, best_ratio = None, 0.0
+        for entry_id, _ in shared.most_common(FUZZY_CANDIDATES):
+            key = self._by_id.get(entry_id)
+            if key is None:
+                continue
+            entry = self._entries[key]
+            candidate = normalize_segment(entry.source)
+            # Дешевые проверки до расстояния Левенштейна: длина, общие триграммы и числа
+            if abs(len(candidate) - len(normalized)) > limit or len(grams & ngrams(candidate)) < required:
+                continue
+            if DIGITS_RE.findall(candidate) != digits:
+                continue
+            length = max(len(normalized), len(candidate))
+            distance = edit_distance(normalized, candidate, self._edit_limit(length))
+            ratio = 1 - distance / length
+            if ratio >= self.fuzzy_threshold and ratio > best_ratio:
+                best, best_ratio = entry, ratio
+        return best
+
+    def _insert(self, lang: str, key: bytes, source: str, translation: str) -> _Entry:
+        entry = self._entries.get((lang, key))
+        if entry is not None:
+            entry.source, entry.translation = source, translation
+            self._entries.move_to_end((lang, key))
+            return entry
+
+        entry = _Entry(next(self._ids), source, translation)
+        self._entries[(lang, key)] = entry
+        self._by_id[entry.id] = (lang, key)
+        normalized = normalize_segment(source)
+        if MIN_FUZZY_LENGTH <= len(normalized) <= MAX_FUZZY_LENGTH:
+            index = self._index.setdefault(lang, {})
+            for gram in ngrams(normalized):
+                index.setdefault(gram, []).append(entry.id)
+
+        while len(self._entries) > self.max_segments:
+            evicted_key, evicted = self._entries.popitem(last=False)
+            del self._by_id[evicted.id]
+            self._dirty.pop(evicted_key, None)
+            self._evicted.append(evicted_key)
+            self._dead_postings += 1
+            self.evictions += 1
+        if self._dead_postings > len(self._entries):
+            self._rebuild_index()
+        return entry
+
+    def _rebuild_index(self):
+        """Убирает из индекса номера вытесненных записей"""
+        self._index = {}
+        for (lang, _), entry in self._entries.items():
+            normalized = normalize_segment(entry.source)
+            if MIN_FUZZY_LENGTH <= len(normalized) <= MAX_FUZZY_LENGTH:
+                index = self._index.setdefault(lang, {})
+                for gram in ngrams(normalized):
+                    index.setdefault(gram, []).append(entry.id)
+        self._dead_postings = 0
+
+    async def remember(self, plan: TranslationPlan, translations: Sequence[str]):
+        """
+        Подставляет переводы недостающих предложений в план и сохраняет их.
+
+        Args:
+            plan: План из lookup()
+            translations: Переводы предложений plan.missing в том же порядке
+        """
+        for index, translation in zip(plan.missing, translations):
+            segment = plan.segments[index]
+            plan.translations[index] = translation
+            key = segment_key(normalize_segment(segment))
+            self._dirty[(plan.lang, key)] = self._insert(plan.lang, key, segment, translation)
+
+        try:
+            await self.flush()
+        except sqlite3.Error as e:
+            logger.error(f"Translation memory write error: {e}")
+
+    async def flush(self):
+        """Сохраняет новые и использованные записи и удаляет вытесненные"""
+        dirty, self._dirty = self._dirty, {}
+        evicted, self._evicted = self._evicted, []
+        if self._conn is None or not (dirty or evicted):
+            return
+        # Запись могла быть вытеснена и добавлена снова до сохранения
+        evicted = [key for key in evicted if key not in dirty]
+        now = time.time()
+        rows = [(lang, key, entry.source, entry.translation, now) for (lang, key), entry in dirty.items()]
+
+        def write():
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO segments (lang, key, source, translation, used_at) VALUES (?, ?, ?, ?, ?)",
+                    rows
+                )
+                self._conn.executemany("DELETE FROM segments WHERE lang = ? AND key = ?", evicted)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+        try:
+            async with self._lock:
+                await asyncio.to_thread(write)
+        except Exception:
+            # Не сохраненные изменения уйдут со следующей записью
+            for key, entry in dirty.items():
+                self._dirty.setdefault(key, entry)
+            self._evicted.extend(evicted)
+            raise
+
+    async def close(self):
+        try:
+            await self.flush()
+        except sqlite3.Error as e:
+            logger.error(f"Failed to save translation memory: {e}")
+        if self._conn is not None:
+            async with self._lock:
+                self._conn.close()
+            self._conn = None
+        logger.info(f"Translation memory closed: {self.stats()}")
+
+    def stats(self) -> dict:
+        """Доли текстов, целиком взятых из памяти, и предложений с точным совпадением и с образцом"""
+        return {
+            "texts": self.texts,
+            "full_text_hits": self.full_text_hits,
+            "full_text_hit_rate": self.full_text_hits / self.texts if self.texts else 0.0,
+            "segments": self.segments,
+            "segment_hits": self.segment_hits,
+            "segment_hit_rate": self.segment_hits / self.segments if self.segments else 0.0,
+            "fuzzy_hits": self.fuzzy_hits,
+            "fuzzy_hit_rate": self.fuzzy_hits / self.segments if self.segments else 0.0,
+            "misses": self.misses,
+            "entries": len(self._entries),
+            "evictions": self.evictions,
+        }
+
+
+translation_memory = TranslationMemory(
+    TRANSLATION_MEMORY_PATH,
+    max_segments=TRANSLATION_MEMORY_MAX_SEGMENTS,
+    fuzzy_threshold=TRANSLATION_MEMORY_FUZZY_THRESHOLD
+)
+translation_memory.load()
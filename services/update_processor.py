@@ -0,0 +1,145 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Hashable, Optional
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+# Сколько последних ожиданий хранить для перцентилей
+WAIT_SAMPLES = 1000
+
+
+class _ChatQueue:
+    """Очередь обновлений одного чата"""
+    __slots__ = ("lock", "pending")
+
+    def __init__(self):
+        # asyncio.Lock выдается в порядке очереди, поэтому обновления чата идут по порядку
+        self.lock = asyncio.Lock()
+        self.pending = 0
+
+
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """
+    Параллельная обработка обновлений с сохранением порядка внутри чата.
+
+    Обновления разных чатов выполняются одновременно (не больше concurrency),
+    обновления одного чата - строго по одному и в порядке поступления, поэтому
+    состояния ConversationHandler не гоняются друг с другом.
+
+    Семафор базового класса ограничивает общее число принятых обновлений
+    (max_pending): лишние ждут места, не занимая слотов обработки. Если в
+    очереди одного чата накопилось больше max_queued_per_chat обновлений
+    (например, пользователь судорожно жмет кнопки), новые отбрасываются.
+
+    Обновления, для которых unordered(update) истинно (ответы на вопрос
+    групповой викторины от сотен участников), не ждут очереди чата и не
+    упираются в ее лимит: их обработчик не зависит от порядка.
+    """
+
+    def __init__(self, concurrency: int = 32, max_pending: int = 1024, max_queued_per_chat: int = 20,
+                 unordered: Optional[Callable[[object], bool]] = None):
+        super().__init__(max_concurrent_updates=max_pending)
+        self.concurrency = concurrency
+        self.max_queued_per_chat = max_queued_per_chat
+        self.unordered = unordered
+
+        self._slots = asyncio.Semaphore(concurrency)
+        self._chats: Dict[Hashable, _ChatQueue] = {}
+
+        self.in_flight = 0
+        self.queued = 0
+        self.processed = 0
+        self.shed = 0
+        self.unordered_count = 0
+        self._waits: Deque[float] = deque(maxlen=WAIT_SAMPLES)
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    @staticmethod
+    def chat_key(update: object) -> Optional[Hashable]:
+        """Ключ упорядочивания: чат обновления, а без чата - пользователь"""
+        if not isinstance(update, Update):
+            return None
+        if update.effective_chat is not None:
+            return update.effective_chat.id
+        if update.effective_user is not None:
+            return f"user:{update.effective_user.id}"
+        return None
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        key = self.chat_key(update)
+        if key is not None and self.unordered is not None and self.unordered(update):
+            self.unordered_count += 1
+            key = None
+        if key is None:
+            await self._run(None, coroutine)
+            return
+
+        chat = self._chats.get(key)
+        if chat is None:
+            chat = self._chats[key] = _ChatQueue()
+
+        if chat.pending >= self.max_queued_per_chat:
+            self.shed += 1
+            logger.warning(f"Chat {key}: {chat.pending} updates pending, dropping update")
+            # Корутина обработки так и не запустится - закрываем, чтобы не было предупреждения
+            coroutine.close()
+            return
+
+        chat.pending += 1
+        try:
+            await self._run(chat, coroutine)
+        finally:
+            chat.pending -= 1
+            if chat.pending == 0 and self._chats.get(key) is chat:
+                del self._chats[key]
+
+    async def _run(self, chat: Optional[_ChatQueue], coroutine: Awaitable[Any]):
+        enqueued_at = time.monotonic()
+        self.queued += 1
+        started = False
+        try:
+            # Сначала очередь чата, затем общий слот: ждущие своей очереди в чате слот не занимают
+            if chat is not None:
+                await chat.lock.acquire()
+            try:
+                async with self._slots:
+                    self.queued -= 1
+                    started = True
+                    self._waits.append(time.monotonic() - enqueued_at)
+                    self.in_flight += 1
+                    try:
+                        await coroutine
+                    finally:
+                        self.in_flight -= 1
+                        self.processed += 1
+            finally:
+                if chat is not None:
+                    chat.lock.release()
+        finally:
+            if not started:
+                self.queued -= 1
+
+    def stats(self) -> dict:
+        """Обновления в работе и в очередях, отброшенные и время ожидания"""
+        waits = sorted(self._waits)
+        return {
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "accepted": self.current_concurrent_updates,
+            "chats_waiting": len(self._chats),
+            "processed": self.processed,
+            "shed": self.shed,
+            "unordered": self.unordered_count,
+            "wait_p95": waits[int(len(waits) * 0.95)] if waits else 0.0,
+            "wait_max": waits[-1] if waits else 0.0,
+        }
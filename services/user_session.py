@@ -0,0 +1,232 @@
+import asyncio
+import logging
+import sys
+import time
+from typing import Dict, Mapping, Optional, Tuple
+
+from telegram import Update
+from telegram.ext import Application, ContextTypes
+
+from services.conversation_memory import ConversationMemory
+from config import SESSION_IDLE_TTL, SESSION_RETENTION_TTL, SESSION_SWEEP_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+
+def _str_bytes(value: Optional[str]) -> int:
+    return sys.getsizeof(value) if value else 0
+
+
+class ResumeDraft:
+    """Ответы пользователя в диалоге /resume"""
+    __slots__ = ("name", "education", "experience", "skills")
+
+    def __init__(self):
+        self.name = ""
+        self.education = ""
+        self.experience = ""
+        self.skills = ""
+
+    def __getstate__(self):
+        return self.name, self.education, self.experience, self.skills
+
+    def __setstate__(self, state):
+        self.name, self.education, self.experience, self.skills = state
+
+    def nbytes(self) -> int:
+        return sys.getsizeof(self) + sum(_str_bytes(value) for value in self.__getstate__())
+
+
+class UserSession:
+    """
+    Состояние пользователя (context.user_data).
+
+    Вместо словаря с копиями справочников хранит только ключи личности
+    и темы (services.registry), счет и короткие значения, поэтому занимает сотню-другую
+    байт. Память диалогов и черновик резюме создаются только когда нужны
+    и очищаются по завершении.
+    """
+    __slots__ = (
+        "personality", "quiz_topic", "quiz_score", "quiz_answer",
+        "target_language", "resume", "gpt_memory", "talk_memory", "last_seen",
+        "quiz_seen", "quiz_bank_id", "quiz_options", "quiz_question"
+    )
+
+    def __init__(self):
+        self.personality: Optional[str] = None
+        self.quiz_topic: Optional[str] = None
+        self.quiz_score = 0
+        self.quiz_answer = ""
+        self.target_language: Optional[str] = None
+        self.resume: Optional[ResumeDraft] = None
+        self.gpt_memory: Optional[ConversationMemory] = None
+        self.talk_memory: Optional[ConversationMemory] = None
+        self.last_seen = time.time()
+        # Битовые карты просмотренных вопросов банка по темам и идентификатор банка
+        self.quiz_seen: Optional[Dict[str, int]] = None
+        self.quiz_bank_id: Optional[str] = None
+        # Варианты текущего вопроса (для ответа текстом) и его номер (для кнопок ответа)
+        self.quiz_options: Tuple[str, ...] = ()
+        self.quiz_question = 0
+
+    def __getstate__(self):
+        # Кортеж в порядке __slots__ компактнее словаря при сериализации
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __setstate__(self, state):
+        self.__init__()
+        # Новые поля в конце __slots__ получают значения по умолчанию
+        for name, value in zip(self.__slots__, state):
+            setattr(self, name, value)
+
+    def touch(self):
+        self.last_seen = time.time()
+
+    def get_resume(self) -> ResumeDraft:
+        if self.resume is None:
+            self.resume = ResumeDraft()
+        return self.resume
+
+    def clear_resume(self):
+        self.resume = None
+
+    def memory_usage(self) -> Dict[str, int]:
+        """
+        Байты, занятые состоянием каждой функции бота.
+
+        Ключи личности, темы и языка - ссылки на строки справочников,
+        общие для всех сессий, поэтому в расчет не входят.
+        """
+        return {
+            "session": sys.getsizeof(self),
+            "gpt": self.gpt_memory.nbytes() if self.gpt_memory is not None else 0,
+            "talk": self.talk_memory.nbytes() if self.talk_memory is not None else 0,
+            "quiz": _str_bytes(self.quiz_answer) + sum(_str_bytes(option) for option in self.quiz_options) + (
+                sum(sys.getsizeof(bitmap) for bitmap in self.quiz_seen.values()) if self.quiz_seen else 0
+            ),
+            "resume": self.resume.nbytes() if self.resume is not None else 0,
+        }
+
+
+# Ключи прежнего словаря user_data, которые переносятся в UserSession
+LEGACY_FIELDS = {
+    "current_topic_key": "quiz_topic",
+    "quiz_score": "quiz_score",
+    "correct_answer": "quiz_answer",
+    "target_language": "target_language",
+}
+
+
+def restore_into(target, loaded):
+    """
+    Переносит загруженное из хранилища состояние в объект, который PTB
+    уже выдал обработчикам (user_data нельзя подменить, только заполнить).
+    """
+    if isinstance(target, dict):
+        target.clear()
+        target.update(loaded)
+    elif isinstance(loaded, dict):
+        # Запись сохранена до перехода на UserSession
+        for old, new in LEGACY_FIELDS.items():
+            if old in loaded:
+                setattr(target, new, loaded[old])
+    else:
+        target.__setstate__(loaded.__getstate__())
+
+
+def memory_report(sessions: Mapping[int, UserSession]) -> dict:
+    """Сводка памяти по всем сессиям: число сессий и байты по функциям"""
+    totals: Dict[str, int] = {}
+    for session in sessions.values():
+        for feature, size in session.memory_usage().items():
+            totals[feature] = totals.get(feature, 0) + size
+    return {"sessions": len(sessions), "bytes": totals, "total_bytes": sum(totals.values())}
+
+
+# Типы контекста: context.user_data - UserSession вместо словаря
+CONTEXT_TYPES = ContextTypes(user_data=UserSession)
+
+
+async def touch_session(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Отмечает активность пользователя (обработчик в группе -1, до всех остальных)"""
+    if update.effective_user is not None:
+        context.user_data.touch()
+
+
+class SessionReaper:
+    """
+    Вытеснение неактивных сессий.
+
+    Раз в sweep_interval выгружает из памяти сессии пользователей, не писавших
+    боту дольше ttl, и пустые chat_data их личных чатов. Запись в persistence
+    остается: при следующем сообщении сессия лениво загрузится заново. Так
+    число сессий в памяти ограничено активными пользователями, а не всеми,
+    кто когда-либо писал боту.
+
+    Из persistence сессия удаляется, только если задан retention и при
+    вытеснении она простаивала дольше него.
+    """
+
+    def __init__(self, ttl: float, sweep_interval: float = 300.0, retention: float = 0.0):
+        self.ttl = ttl
+        self.sweep_interval = sweep_interval
+        self.retention = retention
+        self._task: Optional[asyncio.Task] = None
+        self.evicted = 0
+        self.dropped = 0
+        self.last_report: dict = {}
+
+    def start(self, application: Application):
+        if self.ttl > 0 and self._task is None:
+            self._task = asyncio.create_task(self._run(application))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self, application: Application):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                self.sweep(application)
+            except Exception as e:
+                logger.error(f"Session sweep failed: {e}")
+
+    @staticmethod
+    def _evict(application: Application, user_id: int):
+        """Выгружает сессию из памяти, не трогая ее запись в persistence"""
+        application._user_data.pop(user_id, None)
+        if application.persistence is not None:
+            application.persistence.forget_user_data(user_id)
+
+    def sweep(self, application: Application) -> int:
+        """Выгружает неактивные сессии и возвращает их число"""
+        now = time.time()
+        deadline = now - self.ttl
+        retention_deadline = now - self.retention if self.retention > 0 else None
+        # Несохраненные изменения PTB запишет по user_data[user_id] - такие сессии ждут следующего прохода
+        pending = application._user_ids_to_be_updated_in_persistence
+        idle = [
+            (user_id, session) for user_id, session in application.user_data.items()
+            if session.last_seen < deadline and user_id not in pending
+        ]
+        dropped = 0
+        for user_id, session in idle:
+            if retention_deadline is not None and session.last_seen < retention_deadline:
+                application.drop_user_data(user_id)
+                dropped += 1
+            else:
+                self._evict(application, user_id)
+            if user_id in application.chat_data and not application.chat_data[user_id]:
+                application.drop_chat_data(user_id)
+
+        self.evicted += len(idle)
+        self.dropped += dropped
+        self.last_report = memory_report(application.user_data)
+        logger.info(f"Evicted {len(idle)} idle sessions ({dropped} dropped from persistence), "
+                    f"memory: {self.last_report}")
+        return len(idle)
+
+
+session_reaper = SessionReaper(SESSION_IDLE_TTL, SESSION_SWEEP_INTERVAL, SESSION_RETENTION_TTL)
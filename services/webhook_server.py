@@ -0,0 +1,322 @@
+import asyncio
+import hmac
+import json
+import logging
+import secrets
+import signal
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Deque, Dict, Optional, Tuple
+
+from telegram import Update
+from telegram.ext import Application
+
+logger = logging.getLogger(__name__)
+
+SECRET_TOKEN_HEADER = "x-telegram-bot-api-secret-token"
+
+# Telegram присылает обновления размером в единицы килобайт
+MAX_BODY_SIZE = 1024 * 1024
+MAX_HEADER_LINES = 100
+
+# Сколько ждать следующего запроса в keep-alive соединении (секунды)
+KEEP_ALIVE_TIMEOUT = 75.0
+
+# Сколько последних задержек подтверждения хранить для перцентилей
+ACK_SAMPLES = 1000
+
+REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    403: "Forbidden",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+    503: "Service Unavailable",
+}
+
+
+class _BadRequest(Exception):
+    def __init__(self, status: int):
+        super().__init__(status)
+        self.status = status
+
+
+async def _read_request(reader: asyncio.StreamReader) -> Optional[Tuple[str, str, Dict[str, str], bytes]]:
+    """Читает один HTTP/1.1 запрос: метод, путь, заголовки (в нижнем регистре) и тело"""
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+
+    try:
+        method, path, _ = request_line.decode("latin-1").split(" ", 2)
+    except ValueError:
+        raise _BadRequest(400)
+
+    headers: Dict[str, str] = {}
+    for _ in range(MAX_HEADER_LINES):
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    else:
+        raise _BadRequest(400)
+
+    try:
+        length = int(headers.get("content-length", "0"))
+    except ValueError:
+        raise _BadRequest(400)
+    if length > MAX_BODY_SIZE:
+        raise _BadRequest(413)
+
+    body = await reader.readexactly(length) if length else b""
+    return method, path.split("?", 1)[0], headers, body
+
+
+class WebhookServer:
+    """
+    Прием обновлений Telegram через webhook.
+
+    Минимальный HTTP-сервер на asyncio.start_server: проверяет секретный
+    токен из заголовка X-Telegram-Bot-Api-Secret-Token (запросы без него
+    не принимаются никогда; если токен не задан, генерируется случайный
+    и передается Telegram в setWebhook), кладет обновление
+    в ограниченную очередь и сразу отвечает 200, не дожидаясь обработки.
+    Если очередь заполнена, отвечает 503 - Telegram повторит доставку позже.
+
+    Диспетчер забирает обновления из очереди по порядку и передает их
+    обработчику обновлений приложения (PerChatUpdateProcessor), не запуская
+    больше обновлений, чем тот готов принять: при перегрузке очередь
+    наполняется, и сервер начинает отказывать вместо накопления задач в памяти.
+
+    Вместо приложения можно передать sink(update, body) -> bool: тогда сервер
+    только принимает обновления и отдает их наружу (фронт многопроцессного
+    режима), а False от sink означает переполнение и ответ 503.
+    """
+
+    def __init__(self, application: Optional[Application] = None, host: str = "0.0.0.0", port: int = 8443,
+                 path: str = "/telegram", secret_token: str = "", queue_size: int = 1000,
+                 sink: Optional[Callable[[Update, bytes], bool]] = None):
+        if (application is None) == (sink is None):
+            raise ValueError("Нужно передать либо application, либо sink")
+
+        self.application = application
+        self.sink = sink
+        self.host = host
+        self.port = port
+        self.path = path
+        # Сгенерированный токен известен только этому процессу: годится, лишь если webhook регистрирует бот
+        self.generated_secret = not secret_token
+        self.secret_token = secret_token or secrets.token_urlsafe(32)
+
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self._in_flight: Optional[asyncio.Semaphore] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+
+        self.accepted = 0
+        self.rejected = 0
+        self.unauthorized = 0
+        self._ack_times: Deque[float] = deque(maxlen=ACK_SAMPLES)
+
+    async def start(self):
+        if self.application is not None:
+            self._in_flight = asyncio.Semaphore(self.application.update_processor.max_concurrent_updates)
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        logger.info(f"Webhook server listening on {self.host}:{self.port}{self.path}")
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            self._dispatcher = None
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(_read_request(reader), KEEP_ALIVE_TIMEOUT)
+                except _BadRequest as e:
+                    await self._respond(writer, e.status, close=True)
+                    return
+                if request is None:
+                    return
+
+                started = time.monotonic()
+                method, path, headers, body = request
+                status = self._accept(method, path, headers, body)
+                close = headers.get("connection", "").lower() == "close"
+                await self._respond(writer, status, close=close)
+                self._ack_times.append(time.monotonic() - started)
+                if close:
+                    return
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    def _accept(self, method: str, path: str, headers: Dict[str, str], body: bytes) -> int:
+        """Проверяет запрос и ставит обновление в очередь; возвращает HTTP-статус"""
+        if path != self.path:
+            return 404
+        if method != "POST":
+            return 405
+        if not hmac.compare_digest(
+                headers.get(SECRET_TOKEN_HEADER, "").encode(), self.secret_token.encode()):
+            self.unauthorized += 1
+            return 403
+
+        try:
+            bot = self.application.bot if self.application is not None else None
+            update = Update.de_json(json.loads(body), bot)
+        except (ValueError, TypeError, KeyError) as e:
+            logger.warning(f"Malformed webhook payload: {e}")
+            return 400
+
+        if self.sink is not None:
+            accepted = self.sink(update, body)
+        else:
+            try:
+                self._queue.put_nowait(update)
+                accepted = True
+            except asyncio.QueueFull:
+                accepted = False
+
+        if not accepted:
+            self.rejected += 1
+            return 503
+
+        self.accepted += 1
+        return 200
+
+    @staticmethod
+    async def _respond(writer: asyncio.StreamWriter, status: int, close: bool = False):
+        writer.write(
+            f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+            f"Content-Length: 0\r\n"
+            f"Connection: {'close' if close else 'keep-alive'}\r\n\r\n".encode("latin-1")
+        )
+        await writer.drain()
+
+    async def _dispatch(self):
+        """Передает обновления в обработку по порядку поступления"""
+        processor = self.application.update_processor
+        while True:
+            update = await self._queue.get()
+            await self._in_flight.acquire()
+            # Задачи стартуют в порядке очереди, поэтому порядок обновлений чата сохраняется
+            self.application.create_task(self._process(processor, update), update=update)
+
+    async def _process(self, processor, update: Update):
+        try:
+            await processor.process_update(update, self.application.process_update(update))
+        finally:
+            self._in_flight.release()
+
+    def stats(self) -> dict:
+        acks = sorted(self._ack_times)
+        return {
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "unauthorized": self.unauthorized,
+            "queued": self._queue.qsize(),
+            "ack_p99": acks[min(len(acks) - 1, int(len(acks) * 0.99))] if acks else 0.0,
+        }
+
+
+def stop_event_on_signals() -> asyncio.Event:
+    """Событие, которое устанавливается по SIGINT/SIGTERM"""
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            # Windows: остановка по KeyboardInterrupt
+            pass
+    return stop_event
+
+
+@asynccontextmanager
+async def application_running(application: Application) -> AsyncIterator[Application]:
+    """
+    Запускает приложение без встроенного Updater.
+
+    Повторяет жизненный цикл run_polling: initialize, post_init, start,
+    затем stop, post_shutdown и shutdown.
+    """
+    await application.initialize()
+    try:
+        if application.post_init:
+            await application.post_init(application)
+
+        await application.start()
+        try:
+            yield application
+        finally:
+            await application.stop()
+    finally:
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+        await application.shutdown()
+
+
+def check_secret(server: WebhookServer, webhook_url: str):
+    """
+    Проверяет, что Telegram узнает секретный токен сервера.
+
+    Raises:
+        ValueError: если токен сгенерирован, а webhook регистрируется не ботом (webhook_url пуст)
+    """
+    if server.generated_secret and not webhook_url:
+        raise ValueError(
+            "Без WEBHOOK_URL webhook настраивается заранее - задайте тот же WEBHOOK_SECRET_TOKEN"
+        )
+
+
+async def serve_webhook(application: Application, server: WebhookServer, webhook_url: str = ""):
+    """
+    Запускает приложение в режиме webhook до SIGINT/SIGTERM.
+
+    Args:
+        application: Приложение бота
+        server: Настроенный webhook-сервер
+        webhook_url: Публичный URL для setWebhook (пусто - webhook настроен заранее с тем же секретным токеном)
+    """
+    check_secret(server, webhook_url)
+    stop_event = stop_event_on_signals()
+
+    async with application_running(application):
+        if webhook_url:
+            await application.bot.set_webhook(
+                url=webhook_url,
+                secret_token=server.secret_token,
+                allowed_updates=Update.ALL_TYPES
+            )
+
+        await server.start()
+        try:
+            await stop_event.wait()
+        finally:
+            await server.stop()
+
+
+def run_webhook(application: Application, server: WebhookServer, webhook_url: str = "",
+                use_uvloop: bool = True):
+    """Запускает webhook-режим, по возможности на цикле событий uvloop"""
+    loop_factory = None
+    if use_uvloop:
+        try:
+            import uvloop
+            loop_factory = uvloop.new_event_loop
+        except ImportError:
+            logger.info("uvloop is not installed, using the default event loop")
+
+    with asyncio.Runner(loop_factory=loop_factory) as runner:
+        runner.run(serve_webhook(application, server, webhook_url))
@@ -0,0 +1,7 @@
+import os
+
+# config.py требует токены, а сервисы с файлами не должны трогать data/cache во время тестов
+os.environ.setdefault("TG_BOT_TOKEN", "test")
+os.environ.setdefault("CHATGPT_TOKEN", "test")
+os.environ.setdefault("RESPONSE_CACHE_DB", "")
+os.environ.setdefault("TRANSLATION_MEMORY_PATH", "")
@@ -0,0 +1,97 @@
+import asyncio
+import json
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Ответ заглушки: код, тело и дополнительные заголовки
+Reply = Tuple[int, dict, Dict[str, str]]
+
+REASONS = {200: "OK", 429: "Too Many Requests", 500: "Internal Server Error"}
+
+
+def completion(content: str = "ok", model: str = "stub-model") -> dict:
+    """Тело успешного ответа chat.completions"""
+    return {
+        "id": "chatcmpl-stub",
+        "object": "chat.completion",
+        "created": 0,
+        "model": model,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+    }
+
+
+def error(status: int, message: str = "stub error") -> dict:
+    return {"error": {"message": message, "type": "stub", "code": status}}
+
+
+class StubOpenAIServer:
+    """
+    Локальный HTTP-сервер, отвечающий как OpenAI chat.completions.
+
+    Ответ на каждый запрос выбирает responder (по умолчанию - успешный
+    ответ с именем сервера), delay задерживает ответ, чтобы запросы
+    оставались незавершенными. Полученные запросы копятся в requests.
+    """
+
+    def __init__(self, name: str, responder: Optional[Callable[[dict], Reply]] = None, delay: float = 0.0):
+        self.name = name
+        self.responder = responder or (lambda request: (200, completion(self.name), {}))
+        self.delay = delay
+        self.requests: List[dict] = []
+        self.in_flight = 0
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    @property
+    def base_url(self) -> str:
+        port = self._server.sockets[0].getsockname()[1]
+        return f"http://127.0.0.1:{port}/v1"
+
+    async def start(self) -> "StubOpenAIServer":
+        self._server = await asyncio.start_server(self._serve, "127.0.0.1", 0)
+        return self
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            # Клиент держит соединение открытым и шлет по нему следующие запросы
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                headers = dict(
+                    line.split(": ", 1) for line in head.decode("latin-1").split("\r\n")[1:] if ": " in line
+                )
+                length = int({key.lower(): value for key, value in headers.items()}.get("content-length", 0))
+                body = json.loads(await reader.readexactly(length)) if length else {}
+                await self._respond(writer, body)
+        except (asyncio.IncompleteReadError, ConnectionResetError):
+            pass
+        finally:
+            writer.close()
+
+    async def _respond(self, writer: asyncio.StreamWriter, body: dict):
+        self.requests.append(body)
+        self.in_flight += 1
+        try:
+            if self.delay:
+                await asyncio.sleep(self.delay)
+            status, payload, extra = self.responder(body)
+        finally:
+            self.in_flight -= 1
+
+        data = json.dumps(payload).encode()
+        headers = {"Content-Type": "application/json", "Content-Length": str(len(data)), **extra}
+        head = f"HTTP/1.1 {status} {REASONS.get(status, 'Status')}\r\n"
+        head += "".join(f"{key}: {value}\r\n" for key, value in headers.items())
+        writer.write(head.encode("latin-1") + b"\r\n" + data)
+        await writer.drain()
+
+
+async def closed_port_url() -> str:
+    """Адрес, по которому никто не слушает (для ошибки соединения)"""
+    server = await asyncio.start_server(lambda reader, writer: None, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    server.close()
+    await server.wait_closed()
+    return f"http://127.0.0.1:{port}/v1"
@@ -0,0 +1,126 @@
+import asyncio
+import unittest
+
+import openai
+
+from services import backend_pool as pool_module
+from services.backend_pool import BackendConfig, BackendPool
+from tests.stub_openai import StubOpenAIServer, closed_port_url, error
+
+
+def ask(client: openai.AsyncOpenAI):
+    return client.chat.completions.create(model="stub-model", messages=[{"role": "user", "content": "hi"}])
+
+
+class BackendPoolTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.servers = []
+        self.pool = None
+
+    async def asyncTearDown(self):
+        if self.pool is not None:
+            await self.pool.close()
+        for server in self.servers:
+            await server.stop()
+
+    async def start_server(self, *args, **kwargs) -> StubOpenAIServer:
+        server = await StubOpenAIServer(*args, **kwargs).start()
+        self.servers.append(server)
+        return server
+
+    def make_pool(self, *urls: str) -> BackendPool:
+        self.pool = BackendPool([
+            BackendConfig(name=f"b{index}", api_key="test", base_url=url) for index, url in enumerate(urls)
+        ])
+        return self.pool
+
+    async def test_least_outstanding_backend_is_picked(self):
+        first = await self.start_server("first", delay=0.3)
+        second = await self.start_server("second", delay=0.3)
+        pool = self.make_pool(first.base_url, second.base_url)
+
+        slow = asyncio.create_task(pool.call(ask))
+        await asyncio.sleep(0.1)
+        self.assertEqual(pool.stats()["b0"]["outstanding"], 1)
+
+        # Первый бэкенд занят, следующий запрос уходит на свободный
+        answers = await asyncio.gather(slow, pool.call(ask))
+        self.assertEqual([answer.choices[0].message.content for answer in answers], ["first", "second"])
+        self.assertEqual((len(first.requests), len(second.requests)), (1, 1))
+        self.assertEqual(pool.stats()["b0"]["outstanding"], 0)
+
+    async def test_weight_shifts_load(self):
+        light = await self.start_server("light", delay=0.2)
+        heavy = await self.start_server("heavy", delay=0.2)
+        self.pool = BackendPool([
+            BackendConfig(name="light", api_key="test", base_url=light.base_url, weight=1),
+            BackendConfig(name="heavy", api_key="test", base_url=heavy.base_url, weight=3),
+        ])
+
+        await asyncio.gather(*(self.pool.call(ask) for _ in range(8)))
+        self.assertEqual((len(light.requests), len(heavy.requests)), (2, 6))
+
+    async def test_failing_backend_is_ejected(self):
+        broken = await self.start_server("broken", responder=lambda request: (500, error(500), {}))
+        healthy = await self.start_server("healthy")
+        pool = self.make_pool(broken.base_url, healthy.base_url)
+
+        for _ in range(pool_module.HEALTH_MIN_REQUESTS):
+            with self.assertRaises(openai.InternalServerError):
+                await pool.call(ask)
+        self.assertFalse(pool.stats()["b0"]["healthy"])
+        self.assertEqual(pool.stats()["b0"]["ejections"], 1)
+
+        answer = await pool.call(ask)
+        self.assertEqual(answer.choices[0].message.content, "healthy")
+        self.assertEqual(len(broken.requests), pool_module.HEALTH_MIN_REQUESTS)
+
+    async def test_connection_error_fails_over(self):
+        healthy = await self.start_server("healthy")
+        pool = self.make_pool(await closed_port_url(), healthy.base_url)
+
+        answer = await pool.call(ask)
+        self.assertEqual(answer.choices[0].message.content, "healthy")
+        self.assertEqual(pool.stats()["b0"]["outstanding"], 0)
+
+    async def test_connection_error_on_every_backend_is_raised(self):
+        pool = self.make_pool(await closed_port_url(), await closed_port_url())
+        with self.assertRaises(openai.APIConnectionError):
+            await pool.call(ask)
+
+    async def test_timeout_is_not_retried_on_another_backend(self):
+        slow = await self.start_server("slow", delay=1.0)
+        spare = await self.start_server("spare")
+        pool = self.make_pool(slow.base_url, spare.base_url)
+
+        with self.assertRaises(openai.APITimeoutError):
+            await pool.call(lambda client: ask(client.with_options(timeout=0.2, max_retries=0)))
+        # Запрос мог выполниться на первом бэкенде - второму он не дублируется
+        self.assertEqual((len(slow.requests), len(spare.requests)), (1, 0))
+        self.assertEqual(pool.stats()["b0"]["outstanding"], 0)
+
+    async def test_rate_limited_key_fails_over_and_cools_down(self):
+        limited = await self.start_server(
+            "limited", responder=lambda request: (429, error(429), {"retry-after": "30"})
+        )
+        spare = await self.start_server("spare")
+        pool = self.make_pool(limited.base_url, spare.base_url)
+
+        for _ in range(3):
+            answer = await pool.call(ask)
+            self.assertEqual(answer.choices[0].message.content, "spare")
+
+        # Ключ с 429 не запрашивается до истечения retry-after и не исключается как сбойный
+        self.assertEqual(len(limited.requests), 1)
+        self.assertEqual(pool.stats()["b0"]["rate_limited"], 1)
+        self.assertTrue(pool.stats()["b0"]["healthy"])
+
+    async def test_rate_limit_on_every_key_is_raised(self):
+        limited = await self.start_server("limited", responder=lambda request: (429, error(429), {}))
+        pool = self.make_pool(limited.base_url)
+        with self.assertRaises(openai.RateLimitError):
+            await pool.call(ask)
+
+
+if __name__ == "__main__":
+    unittest.main()
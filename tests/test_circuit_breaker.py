@@ -0,0 +1,90 @@
+import asyncio
+import unittest
+
+import httpx
+import openai
+
+from services.circuit_breaker import CircuitBreaker, OPEN, CLOSED
+from services.model_router import ModelRouter, ModelTarget, Route
+from services.openai_service import is_backend_failure
+
+
+def status_error(error_class, status: int) -> openai.APIStatusError:
+    response = httpx.Response(status, request=httpx.Request("POST", "http://stub/v1/chat/completions"))
+    return error_class("stub error", response=response, body=None)
+
+
+class CircuitBreakerTest(unittest.IsolatedAsyncioTestCase):
+    def make_breaker(self) -> CircuitBreaker:
+        return CircuitBreaker(min_calls=4, error_rate=0.5, is_failure=is_backend_failure)
+
+    async def fail(self, breaker: CircuitBreaker, error: Exception, times: int):
+        for _ in range(times):
+            with self.assertRaises(type(error)):
+                async with breaker.guard():
+                    raise error
+
+    async def test_server_errors_open_the_breaker(self):
+        breaker = self.make_breaker()
+        await self.fail(breaker, status_error(openai.InternalServerError, 500), 4)
+        self.assertEqual(breaker.state, OPEN)
+
+    async def test_rate_limits_are_not_failures(self):
+        breaker = self.make_breaker()
+        await self.fail(breaker, status_error(openai.RateLimitError, 429), 10)
+        self.assertEqual(breaker.state, CLOSED)
+        self.assertEqual(breaker.stats()["window_calls"], 0)
+        self.assertEqual(breaker.stats()["ignored_errors"], 10)
+
+    async def test_client_errors_are_not_failures(self):
+        breaker = self.make_breaker()
+        await self.fail(breaker, status_error(openai.BadRequestError, 400), 10)
+        self.assertEqual(breaker.state, CLOSED)
+
+    async def test_connection_errors_are_failures(self):
+        breaker = self.make_breaker()
+        error = openai.APIConnectionError(request=httpx.Request("POST", "http://stub/v1/chat/completions"))
+        await self.fail(breaker, error, 4)
+        self.assertEqual(breaker.state, OPEN)
+
+    async def hang(self, breaker: CircuitBreaker, timeout: float):
+        async with breaker.guard(timeout=timeout):
+            await asyncio.sleep(10)
+
+    async def test_timeouts_open_the_breaker(self):
+        breaker = self.make_breaker()
+        for _ in range(4):
+            with self.assertRaises(TimeoutError):
+                await self.hang(breaker, 0.01)
+        self.assertEqual(breaker.state, OPEN)
+        self.assertEqual(breaker.stats()["window_errors"], 4)
+
+    async def test_route_timeouts_are_failures(self):
+        breaker = self.make_breaker()
+        router = ModelRouter({"slow": Route((ModelTarget("primary", 0.01), ModelTarget("fallback", 0.01)))})
+        for _ in range(2):
+            with self.assertRaises(TimeoutError):
+                await router.run("slow", lambda model, timeout: self.hang(breaker, timeout))
+        self.assertEqual(breaker.state, OPEN)
+        self.assertEqual(breaker.stats()["window_calls"], 4)
+
+    async def test_cancelled_hedge_loser_is_not_counted(self):
+        breaker = self.make_breaker()
+        task = asyncio.create_task(self.hang(breaker, 5))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+        self.assertEqual(breaker.stats()["window_calls"], 0)
+
+    async def test_first_chunk_lifts_the_timeout(self):
+        breaker = self.make_breaker()
+        async with breaker.guard(timeout=0.05) as deadline:
+            deadline.reschedule(None)
+            await asyncio.sleep(0.1)
+        self.assertEqual(breaker.stats()["window_errors"], 0)
+        self.assertEqual(breaker.stats()["window_calls"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,57 @@
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from telegram.ext import ConversationHandler
+
+from handlers import basic, chatgpt_interface
+from main import (
+    create_gpt_conversation,
+    create_personality_conversation,
+    create_quiz_conversation,
+    create_resume_conversation,
+    create_translator_conversation
+)
+
+CONVERSATIONS = [
+    create_gpt_conversation,
+    create_personality_conversation,
+    create_quiz_conversation,
+    create_translator_conversation,
+    create_resume_conversation,
+]
+
+
+class GptConversationTest(unittest.IsolatedAsyncioTestCase):
+    async def test_finish_button_shows_menu_and_ends(self):
+        update = SimpleNamespace(callback_query=object())
+        with mock.patch.object(basic, "menu_callback", mock.AsyncMock()) as menu:
+            state = await chatgpt_interface.gpt_finish(update, None)
+        menu.assert_awaited_once()
+        self.assertEqual(state, ConversationHandler.END)
+
+    async def test_start_command_ends(self):
+        update = SimpleNamespace(callback_query=None)
+        with mock.patch.object(basic, "start", mock.AsyncMock()) as start:
+            state = await basic.menu_fallback(update, None)
+        start.assert_awaited_once()
+        self.assertEqual(state, ConversationHandler.END)
+
+    def test_every_fallback_ends_the_conversation(self):
+        for create in CONVERSATIONS:
+            conversation = create()
+            callbacks = []
+            for handler in conversation.fallbacks:
+                routes = getattr(handler, "routes", None)
+                callbacks.extend(routes.values() if routes else [handler.callback])
+            commands = {command for handler in conversation.fallbacks for command in getattr(handler, "commands", ())}
+            with self.subTest(conversation=conversation.name):
+                self.assertIn("start", commands)
+                self.assertTrue(callbacks)
+                self.assertTrue(all(
+                    callback in (basic.menu_fallback, chatgpt_interface.gpt_finish) for callback in callbacks
+                ))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,83 @@
+import os
+import random
+import tempfile
+import unittest
+
+from services.leaderboard import Leaderboard, LeaderboardStore, OrderStatisticTree
+
+
+class OrderStatisticTreeTest(unittest.TestCase):
+    def test_matches_sorted_reference(self):
+        rng = random.Random(24)
+        tree, reference = OrderStatisticTree(), []
+        for step in range(3000):
+            if reference and rng.random() < 0.4:
+                key = reference.pop(rng.randrange(len(reference)))
+                tree.remove(key)
+            else:
+                key = (rng.randrange(-50, 0), step, rng.randrange(1000))
+                tree.insert(key)
+                reference.append(key)
+            reference.sort()
+
+            self.assertEqual(len(tree), len(reference))
+            if step % 50 == 0 and reference:
+                for index in (0, len(reference) // 2, len(reference) - 1, rng.randrange(len(reference))):
+                    self.assertEqual(tree.kth(index), reference[index])
+                probe = (rng.randrange(-50, 0), rng.randrange(step + 1), 0)
+                self.assertEqual(tree.rank(probe), sum(1 for key in reference if key < probe))
+                self.assertEqual(list(tree.first(10)), reference[:10])
+
+        with self.assertRaises(IndexError):
+            tree.kth(len(reference))
+
+
+class LeaderboardTest(unittest.TestCase):
+    def test_rank_at_and_top_match_sorted_scores(self):
+        rng = random.Random(7)
+        board, scores, stamps = Leaderboard(chat_id=1), {}, {}
+        for stamp in range(1, 2001):
+            user_id = rng.randrange(200)
+            points = rng.randrange(1, 4)
+            board.add(user_id, points, f"user{user_id}")
+            scores[user_id] = scores.get(user_id, 0) + points
+            stamps[user_id] = stamp
+
+        # Больше очков - выше; при равенстве выше тот, кто набрал их раньше
+        expected = sorted(scores, key=lambda user_id: (-scores[user_id], stamps[user_id]))
+        self.assertEqual([user_id for user_id, _ in board.top(20)], expected[:20])
+        for place, user_id in enumerate(expected, start=1):
+            self.assertEqual(board.rank(user_id), place)
+            self.assertEqual(board.at(place)[0], user_id)
+            self.assertEqual(board.get(user_id).score, scores[user_id])
+        self.assertIsNone(board.rank(10_000))
+
+    def test_tie_keeps_earlier_scorer_ahead(self):
+        board = Leaderboard(chat_id=1)
+        board.add(1, 1, "first")
+        board.add(2, 1, "second")
+        self.assertEqual([user_id for user_id, _ in board.top(2)], [1, 2])
+
+
+class LeaderboardStoreTest(unittest.IsolatedAsyncioTestCase):
+    async def test_scores_survive_reopen(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "leaderboards.sqlite3")
+            store = LeaderboardStore(path)
+            self.assertFalse(os.path.exists(path))
+
+            board = await store.get(5)
+            board.add(1, 3, "one")
+            board.add(2, 1, "two")
+            await store.close()
+
+            reopened = LeaderboardStore(path)
+            board = await reopened.get(5)
+            self.assertEqual([(user_id, entry.score) for user_id, entry in board.top(2)], [(1, 3), (2, 1)])
+            board.add(2, 5, "two")
+            self.assertEqual(board.rank(2), 1)
+            await reopened.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
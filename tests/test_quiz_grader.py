@@ -0,0 +1,37 @@
+import unittest
+
+from services.quiz_grader import grade_answer
+
+RIVERS = ["Нил", "Амазонка", "Янцзы", "Миссисипи"]
+POETS = ["Л. Н. Толстой", "А. С. Пушкин", "Ф. М. Достоевский", "Н. В. Гоголь"]
+WRITERS = ["C. S. Lewis", "J. K. Rowling", "J. R. R. Tolkien", "G. R. R. Martin"]
+
+
+class GradeAnswerTest(unittest.TestCase):
+    def assertGrade(self, text, options, letter, method):
+        grade = grade_answer(text, options)
+        self.assertEqual((grade.letter, grade.method), (letter, method), text)
+
+    def test_letters(self):
+        for text, letter in [("a", "A"), ("В", "B"), ("(c)", "C"), ("ответ: d", "D"), ("вариант С", "C")]:
+            self.assertGrade(text, RIVERS, letter, "letter")
+
+    def test_letter_with_option_text(self):
+        self.assertGrade("B) Амазонка", RIVERS, "B", "letter")
+        self.assertGrade("B) Нил", RIVERS, "B", "letter")
+        self.assertGrade("B) А. С. Пушкин", POETS, "B", "letter")
+
+    def test_initials_are_not_a_letter(self):
+        self.assertGrade("А. С. Пушкин", POETS, "B", "exact")
+        self.assertGrade("а.с. пушкин", POETS, "B", "exact")
+        self.assertGrade("C. S. Lewis", WRITERS, "A", "exact")
+        self.assertGrade("А. С. Пушкн", POETS, "B", "fuzzy")
+
+    def test_option_text(self):
+        self.assertGrade("амазонка", RIVERS, "B", "exact")
+        self.assertGrade("Амазонкаа", RIVERS, "B", "fuzzy")
+        self.assertGrade("Волга", RIVERS, None, "none")
+
+
+if __name__ == "__main__":
+    unittest.main()
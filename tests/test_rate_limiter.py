@@ -0,0 +1,42 @@
+import asyncio
+import unittest
+
+from services.rate_limiter import AdaptiveConcurrency, RateLimiter
+
+
+class AdaptiveConcurrencyTest(unittest.IsolatedAsyncioTestCase):
+    def make_limiter(self) -> RateLimiter:
+        return RateLimiter(
+            default_limits=(1000, 1_000_000),
+            concurrency=AdaptiveConcurrency(initial=8, target_latency=0.05)
+        )
+
+    async def test_slow_stream_does_not_shrink_limit(self):
+        limiter = self.make_limiter()
+        for _ in range(3):
+            async with limiter.acquire("stub-model", 10) as permit:
+                permit.record_first_chunk()
+                # Долгая генерация и медленный потребитель после первого фрагмента
+                await asyncio.sleep(0.1)
+        self.assertGreaterEqual(limiter.concurrency.limit, 8)
+        self.assertEqual(limiter.concurrency.decreases, 0)
+
+    async def test_slow_completion_shrinks_limit(self):
+        limiter = self.make_limiter()
+        async with limiter.acquire("stub-model", 10):
+            await asyncio.sleep(0.1)
+        self.assertEqual(limiter.concurrency.limit, 4)
+
+    async def test_decrease_once_per_window(self):
+        concurrency = AdaptiveConcurrency(initial=8, target_latency=0.05)
+        for _ in range(3):
+            concurrency.on_overload()
+        self.assertEqual(concurrency.limit, 4)
+
+        await asyncio.sleep(0.06)
+        concurrency.on_overload()
+        self.assertEqual(concurrency.limit, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
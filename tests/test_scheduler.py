@@ -0,0 +1,52 @@
+import asyncio
+import unittest
+
+from services.scheduler import FairScheduler, QueueFullError
+
+
+class FairSchedulerTest(unittest.IsolatedAsyncioTestCase):
+    async def hold(self, scheduler: FairScheduler, user_key, entered: asyncio.Event, release: asyncio.Event):
+        async with scheduler.slot(user_key, "gpt"):
+            entered.set()
+            await release.wait()
+
+    async def test_cancelled_dropped_waiter_does_not_return_a_slot(self):
+        scheduler = FairScheduler(concurrency=1, max_queue_per_user=1)
+        entered, release = asyncio.Event(), asyncio.Event()
+        busy = asyncio.create_task(self.hold(scheduler, "other", entered, release))
+        await entered.wait()
+
+        dropped = asyncio.create_task(self.hold(scheduler, "user", asyncio.Event(), release))
+        await asyncio.sleep(0)
+        newer = asyncio.create_task(self.hold(scheduler, "user", asyncio.Event(), release))
+        await asyncio.sleep(0)
+        # Вытесненный ожидающий отменяется раньше, чем проснется с QueueFullError
+        dropped.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await dropped
+        self.assertEqual(scheduler.in_flight, 1)
+
+        release.set()
+        await asyncio.gather(busy, newer)
+        self.assertEqual(scheduler.in_flight, 0)
+        self.assertEqual(scheduler._free_slots, scheduler.concurrency)
+
+    async def test_dropped_waiter_gets_queue_full(self):
+        scheduler = FairScheduler(concurrency=1, max_queue_per_user=1)
+        entered, release = asyncio.Event(), asyncio.Event()
+        busy = asyncio.create_task(self.hold(scheduler, "other", entered, release))
+        await entered.wait()
+
+        dropped = asyncio.create_task(self.hold(scheduler, "user", asyncio.Event(), release))
+        await asyncio.sleep(0)
+        newer = asyncio.create_task(self.hold(scheduler, "user", asyncio.Event(), release))
+        with self.assertRaises(QueueFullError):
+            await dropped
+
+        release.set()
+        await asyncio.gather(busy, newer)
+        self.assertEqual(scheduler._free_slots, scheduler.concurrency)
+
+
+if __name__ == "__main__":
+    unittest.main()
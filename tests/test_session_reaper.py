@@ -0,0 +1,68 @@
+import os
+import tempfile
+import time
+import unittest
+
+from telegram.ext import ApplicationBuilder
+
+from services.sqlite_persistence import SQLitePersistence
+from services.user_session import CONTEXT_TYPES, SessionReaper
+
+
+class SessionReaperTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.persistence = SQLitePersistence(os.path.join(self.directory.name, "state.sqlite3"))
+        self.application = (
+            ApplicationBuilder().token("123:test").context_types(CONTEXT_TYPES)
+            .persistence(self.persistence).updater(None).build()
+        )
+
+    async def asyncTearDown(self):
+        await self.persistence.flush()
+        self.directory.cleanup()
+
+    async def store_idle_session(self, user_id: int, idle: float):
+        await self.persistence.refresh_user_data(user_id, self.application._user_data[user_id])
+        session = self.application.user_data[user_id]
+        session.last_seen = time.time() - idle
+        session.target_language = "en"
+        await self.persistence.update_user_data(user_id, session)
+
+    async def reload(self, user_id: int):
+        session = self.application._user_data[user_id]
+        await self.persistence.refresh_user_data(user_id, session)
+        return session
+
+    async def test_idle_session_is_evicted_from_memory_only(self):
+        await self.store_idle_session(1, idle=120)
+        reaper = SessionReaper(ttl=60)
+
+        self.assertEqual(reaper.sweep(self.application), 1)
+        self.assertNotIn(1, self.application.user_data)
+
+        # Запись осталась в persistence и лениво загружается при следующем обращении
+        session = await self.reload(1)
+        self.assertEqual(session.target_language, "en")
+
+    async def test_retention_drops_persisted_session(self):
+        await self.store_idle_session(1, idle=120)
+        await self.store_idle_session(2, idle=600)
+        reaper = SessionReaper(ttl=60, retention=300)
+
+        self.assertEqual(reaper.sweep(self.application), 2)
+        self.assertEqual(reaper.dropped, 1)
+        await self.application.update_persistence()
+
+        self.assertEqual((await self.reload(1)).target_language, "en")
+        self.assertNotEqual((await self.reload(2)).target_language, "en")
+
+    async def test_pending_session_waits_for_next_sweep(self):
+        await self.store_idle_session(1, idle=120)
+        self.application._user_ids_to_be_updated_in_persistence.add(1)
+        self.assertEqual(SessionReaper(ttl=60).sweep(self.application), 0)
+        self.assertIn(1, self.application.user_data)
+
+
+if __name__ == "__main__":
+    unittest.main()
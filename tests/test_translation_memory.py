@@ -0,0 +1,61 @@
+import unittest
+
+from services.translation_memory import COPY, EXACT, FUZZY, TranslationMemory, split_segments
+
+
+def assemble(segments, gaps):
+    return gaps[0] + "".join(segment + gap for segment, gap in zip(segments, gaps[1:]))
+
+
+class SplitSegmentsTest(unittest.TestCase):
+    def assertSplit(self, text, expected):
+        segments, gaps = split_segments(text)
+        self.assertEqual(segments, expected)
+        self.assertEqual(assemble(segments, gaps), text)
+
+    def test_sentences(self):
+        self.assertSplit("Привет. Как дела? Отлично!", ["Привет.", "Как дела?", "Отлично!"])
+        self.assertSplit("  Hello!\nHow are you?\n\n", ["Hello!", "How are you?"])
+
+    def test_lowercase_continuation_is_not_split(self):
+        self.assertSplit("Это т. е. пример. Конец.", ["Это т. е. пример.", "Конец."])
+
+    def test_abbreviations_are_not_split(self):
+        self.assertSplit("Mr. Smith said hi. Then he left.", ["Mr. Smith said hi.", "Then he left."])
+        self.assertSplit("Dr. Who arrived.", ["Dr. Who arrived."])
+        self.assertSplit("А. С. Пушкин родился в Москве. Это известно.",
+                         ["А. С. Пушкин родился в Москве.", "Это известно."])
+        self.assertSplit("Купил хлеб, молоко и т.д. Потом ушел.", ["Купил хлеб, молоко и т.д. Потом ушел."])
+
+    def test_line_break_always_splits(self):
+        self.assertSplit("Mr.\nSmith", ["Mr.", "Smith"])
+
+
+class LookupTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.memory = TranslationMemory("", max_segments=100, fuzzy_threshold=0.9)
+        plan = self.memory.lookup("I will come to the meeting tomorrow. See you.", "en")
+        await self.memory.remember(plan, ["Я приду на встречу завтра.", "До встречи."])
+
+    async def test_exact_segments_come_from_memory(self):
+        plan = self.memory.lookup("see you. 42", "en")
+        self.assertEqual(plan.methods, [EXACT, COPY])
+        self.assertEqual(plan.missing, [])
+        self.assertEqual(plan.assemble(), "до встречи. 42")
+
+    async def test_similar_segment_is_a_reference_not_a_translation(self):
+        plan = self.memory.lookup("I will not come to the meeting tomorrow.", "en")
+        self.assertEqual(plan.methods, [FUZZY])
+        self.assertEqual(plan.missing, [0])
+        self.assertEqual(plan.references[0], ("I will come to the meeting tomorrow.", "Я приду на встречу завтра."))
+
+        await self.memory.remember(plan, ["Я не приду на встречу завтра."])
+        self.assertEqual(self.memory.lookup("I will not come to the meeting tomorrow.", "en").methods, [EXACT])
+
+    async def test_other_language_and_new_text_miss(self):
+        self.assertEqual(self.memory.lookup("See you.", "de").missing, [0])
+        self.assertEqual(self.memory.lookup("Something else entirely.", "en").missing, [0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,37 @@
+import json
+import unittest
+
+from services.webhook_server import SECRET_TOKEN_HEADER, WebhookServer, check_secret
+
+UPDATE = json.dumps({"update_id": 1}).encode()
+
+
+class WebhookSecretTest(unittest.TestCase):
+    def make_server(self, secret_token: str = "") -> WebhookServer:
+        self.updates = []
+        return WebhookServer(sink=lambda update, body: self.updates.append(update) or True,
+                             secret_token=secret_token)
+
+    def test_post_without_secret_is_refused(self):
+        server = self.make_server()
+        self.assertEqual(server._accept("POST", "/telegram", {}, UPDATE), 403)
+        self.assertEqual(server._accept("POST", "/telegram", {SECRET_TOKEN_HEADER: ""}, UPDATE), 403)
+        self.assertEqual(self.updates, [])
+
+    def test_configured_secret_is_checked(self):
+        server = self.make_server("s3cret")
+        self.assertEqual(server._accept("POST", "/telegram", {SECRET_TOKEN_HEADER: "wrong"}, UPDATE), 403)
+        self.assertEqual(server._accept("POST", "/telegram", {SECRET_TOKEN_HEADER: "s3cret"}, UPDATE), 200)
+        self.assertEqual(len(self.updates), 1)
+
+    def test_generated_secret_needs_webhook_url(self):
+        server = self.make_server()
+        self.assertTrue(server.secret_token)
+        with self.assertRaises(ValueError):
+            check_secret(server, "")
+        check_secret(server, "https://example.org/telegram")
+        check_secret(self.make_server("s3cret"), "")
+
+
+if __name__ == "__main__":
+    unittest.main()